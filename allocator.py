@@ -1,24 +1,27 @@
-import geopandas as gpd
 import data_retriever as dr
 import modeling as mdl
-from shapely.geometry import Polygon, MultiPolygon, Point
 import numpy as np
-from ipyleaflet import Map, CircleMarker, LayerGroup, GeoJSON, Marker, Popup, DivIcon
-import ipywidgets as widgets
-import time
-import json
+import logging
+import os
 import utils
+import context as ctx
 import economies
 import simulated_annealing
-from scipy.spatial.distance import pdist, squareform
-from scipy.sparse.csgraph import minimum_spanning_tree
+import feasibility
+import surrogate
+import cables
+import refinement
+import pareto
+import instrumentation
+import checkpoint
+import history
 from pyproj import Transformer
-import yaml
 
 
 class Allocator:
-    def __init__(self, data_retriever: dr.WeatherRetriever, fm: mdl.FarmModel):
+    def __init__(self, data_retriever: dr.WeatherRetriever, fm: mdl.FarmModel, context: ctx.RunContext = None):
         self.data_retriever = data_retriever
+        self.context = context if context is not None else fm.context
         self.coordinates = data_retriever.coordinates
         self.constraints = data_retriever.constraints
         self.centroid = data_retriever.centroid
@@ -31,21 +34,59 @@ class Allocator:
         self.current_allocations = None
         self.prev_allocations = None
         self.m = None
+        self.observers = []
         self.iter = 0
         self.transformer = Transformer.from_crs(self.best_epsg, "EPSG:4326", always_xy=True)
         
 
-        with open("config.yml", "r") as f:
-            config = yaml.safe_load(f)
+        config = self.context.config
         
         self.iterations = config.get("iterations")
+        self.feasibility_resolution = config.get("feasibility_grid_resolution")
+        self.candidate_batch_size = config.get("candidate_batch_size", 64)
+        self.proposal_batch_size = config.get("proposal_batch_size", 1)
+        self.evaluation_workers = config.get("evaluation_workers")
+        self.replicas = config.get("replicas", 1)
+        self.swap_interval = config.get("swap_interval")
+        self.replica_temperature_ratio = config.get("replica_temperature_ratio", 2.0)
+        self.fidelity_schedule = sorted(config.get("multi_fidelity_schedule") or [])
+        self.final_wd_resolution = config.get("final_wind_direction_resolution", fm.data_manipulator.wd_resolution)
+        self.final_ws_resolution = config.get("final_wind_speed_resolution", fm.data_manipulator.ws_resolution)
+        self.fidelity = None
+        self.min_spacing = config.get("min_turbine_spacing", 3.0) * fm.rotor_diameter
+        self.pareto_search = config.get("pareto_search", False)
+        self.pareto_population = config.get("pareto_population", 8)
+        self.pareto_archive_size = config.get("pareto_archive_size", 100)
+        self.pareto = None
+        self.refinement = config.get("refinement", False)
+        self.refinement_iterations = config.get("refinement_iterations", 20)
+        self.refinement_fd_step = config.get("refinement_fd_step", 1.0)
+        self.cable_routing = config.get("cable_routing", "mst")
+        self.turbines_per_string = config.get("turbines_per_string", 8)
+        self.cable_delaunay_threshold = config.get("cable_delaunay_threshold", 100)
+        self.profiler = config.get("profiler")
+        self.checkpoint_file = config.get("checkpoint_file")
+        self.checkpoint_every = config.get("checkpoint_every", 10)
+        self.history_size = config.get("history_size", 10000)
+        self.history = history.HistoryRecorder(config.get("history_dir"), config.get("history_chunk_size", 4096))
+        self.stats = instrumentation.Instrumentation(config.get("trace_events", 0))
         self.intitial_allocation()
 
         self.R0 = np.sqrt(self.area) 
         self.R = self.R0
 
-        self.econ = economies.Econom(self.country, self.area)
-        self.sa = simulated_annealing.SimulatedAnnealer(self.iterations)
+        self.econ = economies.Econom(self.country, self.area, self.no_of_turbines, self.context)
+        self.sa = simulated_annealing.SimulatedAnnealer(self.iterations, history_size=self.history_size)
+
+        self.screen = None
+        if config.get("surrogate_screening"):
+            self.screen = surrogate.SurrogateScreen(
+                surrogate.JensenSurrogate(fm.wr, fm.turbine),
+                warmup=config.get("surrogate_warmup", 20),
+                min_acceptance=config.get("surrogate_min_acceptance", 1e-3),
+                margin=config.get("surrogate_margin", 3.0),
+                audit_rate=config.get("surrogate_audit_rate", 0.05),
+            )
 
 
     def intitial_allocation(self):
@@ -55,190 +96,525 @@ class Allocator:
             self.data_retriever.calculate_centroid()
             self.centroid = self.data_retriever.centroid
         
-        constraints_polygons = [Polygon([tuple(pt) for pt in poly]) for poly in self.constraints]
-        gdf_constraints = gpd.GeoDataFrame({'geometry': constraints_polygons}, crs="EPSG:4326")
-
-        coord_polygons = [Polygon([tuple(pt) for pt in poly]) for poly in self.coordinates]
-        gdf_coord = gpd.GeoDataFrame({'geometry': coord_polygons}, crs="EPSG:4326")
-        self.area = gdf_coord.to_crs(epsg=self.best_epsg).geometry.area.sum()
+        self.available_gdf, self.area = utils.available_land(self.coordinates, self.constraints, self.best_epsg)
+        self.area_cut = self.available_gdf.geometry.area.sum()
 
+        # built once, every placement afterwards goes through the index
+        self.feasibility = feasibility.FeasibilityIndex(
+            self.available_gdf,
+            resolution=self.feasibility_resolution,
+            batch_size=self.candidate_batch_size,
+        )
 
-        self.available_gdf = gpd.overlay(gdf_coord, gdf_constraints, how="difference").to_crs(epsg=self.best_epsg)
-        self.area_cut = self.available_gdf.geometry.area.sum()
+        if self.cable_routing == "capacitated":
+            self.cables = cables.StringRouting(self.feasibility, self.turbines_per_string)
+        elif self.cable_routing == "mst":
+            self.cables = cables.MinimumSpanningTree(self.cable_delaunay_threshold)
+        else:
+            raise ValueError(f"Unknown cable_routing {self.cable_routing!r}, use 'mst' or 'capacitated'")
 
         minx, miny, maxx, maxy = self.available_gdf.total_bounds
         self.bounds = self.available_gdf.total_bounds
-        allocations = []
         self.maxx, self.maxy = self.transformer.transform(maxx, maxy)
-        
-        # generate more points than needed, filter inside polygon
-        while len(allocations) < self.no_of_turbines:
-            x = np.random.uniform(minx, maxx, self.no_of_turbines*2)
-            y = np.random.uniform(miny, maxy, self.no_of_turbines*2)
-            candidates = [Point(xi, yi) for xi, yi in zip(x, y)]
-            allocations.extend([p for p in candidates if self.available_gdf.contains(p).values[0]])
-            allocations = allocations[:self.no_of_turbines]  # keep only n_points
-        
-        self.current_allocations = allocations
-        self.prev_allocations = self.current_allocations
+
+        self.spacing = None
+        if self.min_spacing:
+            self.spacing = feasibility.SpacingIndex(np.empty((0, 2)), self.min_spacing)
+        self.accept_allocations(self.initial_layout(self.no_of_turbines))
+
+    def initial_layout(self, n):
+        """
+        Random layout of n turbines over the available land, respecting the
+        minimum spacing.
+
+        Returns:
+        np.ndarray: Turbine x, y in metres, shape (n, 2).
+        """
+        # layouts are (n, 2) float arrays of x, y in metres
+        layout = self.feasibility.sample_many(n)
+        if self.spacing is not None:
+            minx, miny, maxx, maxy = self.bounds
+            rejections = self.spacing.rejections
+            layout = self.spacing.spread(
+                layout,
+                lambda accept: np.array(self.feasibility.sample(minx, miny, maxx, maxy, accept)),
+            )
+            self.spacing.rejections = rejections
+        return layout
+
+    def set_no_of_turbines(self, n, layout=None):
+        """
+        Start over with n turbines, keeping the site, the land index and the
+        FLORIS model.
+
+        Parameters:
+        layout (np.ndarray): Optional (n, 2) start layout, random otherwise.
+        """
+        self.no_of_turbines = n
+        self.fm.no_of_turbines = n
+        self.econ.no_of_turbines = n
+        self.sa = simulated_annealing.SimulatedAnnealer(self.iterations, self.sa.verbose, self.history_size)
+        self.R = self.R0
+        self.iter = 0
+        if self.screen is not None:
+            self.screen.reset(self.fm.wr)
+        if layout is None:
+            layout = self.initial_layout(n)
+        self.accept_allocations(np.array(layout, dtype=float))
 
 
     
     def allocate_turbine_absolute(self):
         minx, miny, maxx, maxy = self.bounds
-        x = np.random.uniform(minx, maxx)
-        y = np.random.uniform(miny, maxy)
-        p = Point(x, y)
-
-        while not self.available_gdf.contains(p).values.any():
-            x = np.random.uniform(minx, maxx)
-            y = np.random.uniform(miny, maxy)
-            p = Point(x, y)
-        
-        return p
+        return np.array(self.feasibility.sample(minx, miny, maxx, maxy))
     
-    def allocate_turbine(self, pos):
-        x = np.random.uniform(pos.x-self.R, pos.x+self.R)
-        y = np.random.uniform(pos.y-self.R, pos.y+self.R)
-        p = Point(x, y)
-
-        while not self.available_gdf.contains(p).values.any():
-            x = np.random.uniform(pos.x-self.R, pos.x+self.R)
-            y = np.random.uniform(pos.y-self.R, pos.y+self.R)
-            p = Point(x, y)
-        
-        return p
+    def allocate_turbine(self, pos, i=None):
+        x, y = pos
+        accept = None
+        if self.spacing is not None:
+            # checked against the accepted layout, turbine i is the one moving
+            accept = lambda cx, cy: self.spacing.valid(cx, cy, skip=i)
+        return np.array(self.feasibility.sample(x-self.R, y-self.R, x+self.R, y+self.R, accept))
         
 
     def obtain_new_positions(self, i):
-       p = self.allocate_turbine(self.current_allocations[i])
-       self.current_allocations[i] = p
+       self.current_allocations[i] = self.allocate_turbine(self.current_allocations[i], i)
+
+    def accept_allocations(self, allocations=None):
+        # the accepted layout gets its own copy, proposals never write into it
+        if allocations is not None:
+            self.current_allocations = allocations
+        self.prev_allocations = self.current_allocations.copy()
+        if self.spacing is not None:
+            self.spacing.rebuild(self.prev_allocations)
+
+    def reject_allocations(self):
+        self.current_allocations = self.prev_allocations.copy()
 
 
     def run(self):
-        for iteration in range(self.iterations):
-            for i in range(len(self.current_allocations)):
+        """
+        Run the optimization. An interrupted run (restored from a checkpoint)
+        continues from its iteration, a finished one starts over.
+        """
+        if self.iter >= self.iterations:
+            self.iter = 0
+        stats = self.stats
+        with stats.profiled(self.profiler), stats.stage("run"):
+            if self.replicas > 1:
+                # imported here, the replicas build their own allocators
+                import parallel_tempering
+                parallel_tempering.ParallelTempering(self).run()
+            elif self.pareto_search:
+                with stats.stage("pareto"):
+                    self.run_pareto()
+            elif self.proposal_batch_size > 1:
+                self.run_batched()
+            else:
+                for iteration in range(self.iter, self.iterations):
+                    self.run_iteration(iteration)
+            if self.fidelity_schedule:
+                # the best layouts were found on coarse roses, score them on the fine one
+                with stats.stage("fidelity"):
+                    self.set_fidelity(self.final_wd_resolution, self.final_ws_resolution)
+            if self.refinement:
+                with stats.stage("refine"):
+                    self.refine()
+            if self.fm.incremental is not None:
+                # the reported results come from full solves, not incremental updates
+                with stats.stage("rescore"):
+                    self.rescore_best(exact=True)
+        if self.screen is not None:
+            self.screen.report()
+        cache = self.fm.cache
+        logging.info(f"Layout cache: {cache.hits} hits, {cache.misses} misses, {len(cache.entries)} entries")
+        if cache.path:
+            cache.save()
+        if self.spacing is not None:
+            logging.info(f"Minimum spacing: {self.spacing.rejections} candidate positions rejected")
+        incremental = self.fm.incremental
+        if incremental is not None:
+            logging.info(
+                f"Incremental AEP: {incremental.updates} updates, {incremental.full_runs} full solves, "
+                f"{incremental.failures} validations failed, max error {incremental.max_error:.2e}"
+            )
+        self.history.close()
+        self.collect_counters()
+        stats.log_report()
+        if self.checkpoint_file:
+            self.save_checkpoint()
+        self.notify("on_finish")
+
+    def extend(self, iterations):
+        """
+        Continue a finished run for more iterations, from its current layout,
+        temperature and best layouts, with the same wind rose and FLORIS
+        model.
+
+        The temperature keeps cooling at the rate of the run and the move
+        radius follows the schedule of the new total, so extend(n) after N
+        iterations is not the run of N + n iterations: that one cools more
+        slowly from the start.
+        """
+        # update_iterations would spread the cooling from the current,
+        # already cold, temperature to T_final, that is heat the chain up
+        cooling = self.sa.cooling
+        self.update_iterations(self.iterations + iterations)
+        self.sa.cooling = cooling
+        self.run()
+
+    def detach_outputs(self):
+        """
+        Quiet allocator without checkpoint or history files, for runs in
+        worker processes next to others of the same config.
+        """
+        self.sa.verbose = False
+        self.checkpoint_file = None
+        self.history = history.HistoryRecorder(chunk_size=self.history.chunk_size)
+
+    def save_checkpoint(self, path=None):
+        """
+        Write the state of the run to `path` (checkpoint_file by default),
+        see checkpoint.resume.
+        """
+        checkpoint.save(self, path or self.checkpoint_file)
+
+    def collect_counters(self):
+        # counts kept by the components themselves, next to the ones of the loop
+        counters = self.stats.counters
+        counters["infeasible"] = self.feasibility.rejections
+        if self.spacing is not None:
+            counters["too_close"] = self.spacing.rejections
+        counters["floris_calls"] = self.fm.floris_runs
+        counters["cache_hits"] = self.fm.cache.hits
+
+    def run_iteration(self, iteration):
+        stats = self.stats
+        sample, cable, screen, floris, lcoe_stage, accept = (
+            stats.stage(name) for name in ("sample", "cables", "screen", "floris", "lcoe", "accept")
+        )
+        with stats.stage("fidelity"):
+            self.update_fidelity(iteration)
+        for i in range(len(self.current_allocations)):
+            stats.count("proposals")
+            with sample:
                 self.obtain_new_positions(i)
+            with cable:
+                cables_length,subs = self.get_cables_length_and_substation()
+            with screen:
+                decision = self.screen_proposal(self.current_allocations, cables_length)
+            if decision == "skip":  # surrogate says hopeless, no FLORIS run
+                stats.count("screened_out")
+                self.history.record(iteration, i, np.nan, np.nan, self.sa.T, self.R, False)
+                self.reject_allocations()
+                self.sa.update()
+                continue
+            with floris:
                 self.fm.new_run(self.current_allocations)  # run Fmodel
                 aep = self.fm.get_aep()  # obtain aep
-                cables_length,subs = self.get_cables_length_and_substation()
+            with lcoe_stage:
                 lcoe = self.econ.get_lcoe(aep,cables_length)   # obtain lcoe  
+            with accept:
+                self.observe_proposal(decision, self.current_allocations, aep, lcoe)
                 self.sa.check_LCOE(lcoe, self.current_allocations, aep)  # check lcoe # check aep with lcoe
                 acceptance = self.sa.annealing_acceptance(lcoe)  # check annealingacc
+                self.history.record(iteration, i, lcoe, aep, self.sa.T, self.R, acceptance,
+                                    self.current_allocations if acceptance else None)
                 if acceptance:  # change pos or not
-                    self.prev_allocations = self.current_allocations
-                    self.update_points() # update map
-                    self.update_labels()
+                    stats.count("accepted")
+                    self.accept_allocations()
                 else:
-                    self.current_allocations = self.prev_allocations
-                self.sa.update()
-            self.R = max(self.R0*0.1, self.R0 * (1 - iteration / self.iterations))
-            self.iter = iteration + 1
-            self.update_labels()
+                    self.reject_allocations()
+            if acceptance:
+                self.notify("on_accept") # update map
+            self.sa.update()
+        self.end_iteration(iteration)
+
+    def run_batched(self):
+        """
+        Run the annealing with K candidate moves per step.
+
+        Each step moves K turbines of the current layout independently, the K
+        layouts are evaluated together by the BatchEvaluator and the best of
+        them goes through the annealing acceptance. An iteration still makes
+        one proposal per turbine.
+        """
+        K = self.proposal_batch_size
+        n = len(self.current_allocations)
+        stats = self.stats
+        sample, cable, screen, floris, lcoe_stage, accept = (
+            stats.stage(name) for name in ("sample", "cables", "screen", "floris", "lcoe", "accept")
+        )
+        # a batch has at most K layouts, more workers would only sit idle
+        workers = min(self.evaluation_workers or os.cpu_count(), K)
+        evaluator = None
+        try:
+            for iteration in range(self.iter, self.iterations):
+                # the workers hold the wind rose, rebuild them when the fidelity changes
+                with stats.stage("fidelity"):
+                    if self.update_fidelity(iteration) or evaluator is None:
+                        if evaluator is not None:
+                            evaluator.close()
+                        evaluator = mdl.BatchEvaluator(self.fm, workers)
+                for start in range(0, n, K):
+                    candidates = []
+                    decisions = []
+                    cables = []
+                    movers = []
+                    for i in range(start, min(start + K, n)):
+                        stats.count("proposals")
+                        with sample:
+                            layout = self.current_allocations.copy()
+                            layout[i] = self.allocate_turbine(layout[i], i)
+                        with cable:
+                            cables_length, subs = self.get_cables_length_and_substation(layout)
+                        with screen:
+                            decision = self.screen_proposal(layout, cables_length)
+                        if decision == "skip":
+                            stats.count("screened_out")
+                            self.history.record(iteration, i, np.nan, np.nan, self.sa.T, self.R, False)
+                            self.sa.update()
+                            continue
+                        candidates.append(layout)
+                        decisions.append(decision)
+                        cables.append(cables_length)
+                        movers.append(i)
+                    if not candidates:
+                        continue
+
+                    with floris:
+                        aeps = evaluator.evaluate(candidates)
+                    lcoes = []
+                    temperatures = []
+                    for layout, aep, decision, cables_length in zip(candidates, aeps, decisions, cables):
+                        temperatures.append(self.sa.T)
+                        with lcoe_stage:
+                            lcoe = self.econ.get_lcoe(aep, cables_length)
+                        with accept:
+                            self.observe_proposal(decision, layout, aep, lcoe)
+                            self.sa.check_LCOE(lcoe, layout, aep)
+                        lcoes.append(lcoe)
+                        self.sa.update()
+
+                    best = int(np.argmin(lcoes))
+                    with accept:
+                        acceptance = self.sa.annealing_acceptance(lcoes[best])
+                        for k, i in enumerate(movers):
+                            accepted = acceptance and k == best
+                            self.history.record(iteration, i, lcoes[k], aeps[k], temperatures[k], self.R,
+                                                accepted, candidates[k] if accepted else None)
+                        if acceptance:
+                            stats.count("accepted")
+                            self.accept_allocations(candidates[best])
+                    if acceptance:
+                        self.notify("on_accept")
+                self.end_iteration(iteration)
+        finally:
+            if evaluator is not None:
+                evaluator.close()
+
+    def run_pareto(self):
+        """
+        Multi-objective mode: search the LCOE / AEP front with a population
+        of walkers, one generation per iteration. The front is kept in
+        self.pareto, the best LCOE and AEP layouts in the annealer as usual.
+        """
+        search = pareto.ParetoSearch(self, self.pareto_population, self.pareto_archive_size)
+        self.pareto = search.run(self.iterations)
+        self.accept_allocations(self.sa.min_LCOE_alloc.copy())
+        self.notify("on_accept")
+
+    def screen_proposal(self, allocations, cables_length):
+        """
+        Ask the surrogate screen whether a proposal needs a FLORIS run.
+
+        Returns:
+        str: "evaluate", "audit" (evaluate, screened out otherwise) or "skip".
+        """
+        if self.screen is None:
+            return "evaluate"
+        return self.screen.screen(
+            allocations,
+            lambda aep: self.econ.get_lcoe(aep, cables_length),
+            self.sa.prev_LCOE,
+            self.sa.T,
+        )
 
+    def observe_proposal(self, decision, allocations, aep, lcoe):
+        # feed the FLORIS result back to the surrogate, before the annealer sees it
+        if self.screen is None:
+            return
+        self.screen.surrogate.observe(allocations, aep)
+        if decision == "audit":
+            self.screen.audit(lcoe, self.sa.prev_LCOE, self.sa.T, lcoe < self.sa.min_LCOE)
+
+    def update_fidelity(self, iteration):
+        """
+        Multi-fidelity mode: pick the wind rose of the schedule stage this
+        iteration falls in. Stages are [fraction of iterations done, wind
+        direction resolution, wind speed resolution], so the rose gets finer
+        as the temperature drops.
+
+        Returns:
+        bool: True when the wind rose was changed.
+        """
+        if not self.fidelity_schedule:
+            return False
+        progress = iteration / self.iterations
+        started = [stage for stage in self.fidelity_schedule if stage[0] <= progress]
+        stage = started[-1] if started else self.fidelity_schedule[0]
+        if tuple(stage[1:]) == self.fidelity:
+            return False
+
+        self.set_fidelity(stage[1], stage[2])
+        # the chain continues from the current layout scored on the new rose
+        self.sa.prev_LCOE, _ = self.evaluate_lcoe(self.current_allocations)
+        return True
+
+    def set_fidelity(self, wd_resolution, ws_resolution):
+        md = self.fm.data_manipulator
+        self.fm.set_wind_rose(md.wind_rose_at(wd_resolution, ws_resolution))
+        self.fidelity = (wd_resolution, ws_resolution)
+        if self.screen is not None:
+            self.screen.reset(self.fm.wr)
+        logging.info(f"Wind rose resolution set to {wd_resolution} deg / {ws_resolution} m/s")
+        self.rescore_best()
+
+    def evaluate_lcoe(self, allocations, exact=False):
+        self.fm.new_run(allocations, exact=exact)
+        aep = self.fm.get_aep()
+        cables_length, subs = self.get_cables_length_and_substation(allocations)
+        return self.econ.get_lcoe(aep, cables_length), aep
+
+    def rescore_best(self, exact=False):
+        # best values from another wind rose are not comparable, score them again
+        if len(self.sa.min_LCOE_alloc):
+            self.sa.min_LCOE, self.sa.aep_at_min_lcoe = self.evaluate_lcoe(self.sa.min_LCOE_alloc, exact)
+        if len(self.sa.max_AEP_alloc):
+            lcoe, self.sa.max_AEP = self.evaluate_lcoe(self.sa.max_AEP_alloc, exact)
+
+    def refine(self):
+        """
+        Polish the min LCOE layout with the gradient based LayoutRefiner.
+        """
+        if not len(self.sa.min_LCOE_alloc):
+            return
+        refiner = refinement.LayoutRefiner(
+            self,
+            self.min_spacing,
+            iterations=self.refinement_iterations,
+            fd_step=self.refinement_fd_step,
+            workers=self.evaluation_workers,
+        )
+        coords, lcoe, aep = refiner.refine(self.sa.min_LCOE_alloc)
+        # scored by full solves, these replace the cached values of the start layout
+        sa = self.sa
+        sa.min_LCOE, sa.aep_at_min_lcoe = lcoe, aep
+        if not np.array_equal(coords, sa.min_LCOE_alloc):
+            sa.min_LCOE_alloc = coords.copy()
+            sa.min_LCOE_hist.append(lcoe)
+            sa.check_AEP(aep, coords)
+            self.accept_allocations(coords)
+            self.notify("on_accept")
+
+    def end_iteration(self, iteration):
+        self.R = max(self.R0*0.1, self.R0 * (1 - iteration / self.iterations))
+        self.iter = iteration + 1
+        self.notify("on_iteration")
+        if self.checkpoint_file and self.checkpoint_every and self.iter % self.checkpoint_every == 0:
+            with self.stats.stage("checkpoint"):
+                self.save_checkpoint()
+
+
+    def add_observer(self, observer):
+        """
+        Register an observer of the run. Observers implement any of
+        on_accept, on_iteration, on_layout and on_finish, each called with
+        the allocator.
+        """
+        self.observers.append(observer)
+
+    def notify(self, event):
+        if not self.observers:
+            return
+        # observers include the map renderer, their time is a stage of its own
+        with self.stats.stage("notify"):
+            for observer in self.observers:
+                handler = getattr(observer, event, None)
+                if handler is not None:
+                    handler(self)
 
     def mapper(self):
-        if self.current_allocations is None:
-            raise RuntimeError("Cannot run this before allocations are initialized")
-        
-        self.m = Map(center=self.centroid, zoom=10)
-        self.points_layer = LayerGroup()
-        self.labels_layer = LayerGroup()
-        self.m.add_layer(self.points_layer)
-        self.m.add_layer(self.labels_layer)
-
-        icon = DivIcon(html=(f'Press the "Start" button to start.<br>'
-                             f'Red dots represent each turbine.<br>'
-                             f'Each iteration consists of moving each turbine.<br>'
-                             f'Each move can be accepted or rejected.<br>'
-                             f'When accepted it shows on the map.<br>'
-                             ), icon_size=[250, 100])
-
-        self.label_marker = Marker(location=(self.maxy+0.025, self.centroid[1]), icon=icon, draggable=True)
-
-        self.labels_layer.add_layer(self.label_marker)
-        
-        
-        self.update_points()
-
-        geo_json_data = json.loads(self.available_gdf.to_crs(epsg=4326).to_json())
-        geo_json_layer = GeoJSON(data=geo_json_data, style={
-            "color": "blue",
-            "opacity": 1,
-            "fillColor": "blue",
-            "fillOpacity": 0.3
-        })
-        self.m.add_layer(geo_json_layer)
-
+        # imported here so headless runs never load the widget stack
+        import map_render
+        renderer = map_render.MapRenderer(self)
+        self.add_observer(renderer)
+        self.m = renderer.m
         return self.m
 
+    def transform_points(self, allocations=None):
+        """
+        Returns:
+        np.ndarray: The (n, 2) lon, lat of the turbines in EPSG:4326.
+        """
+        if allocations is None:
+            allocations = self.current_allocations
+        lon, lat = self.transformer.transform(allocations[:, 0], allocations[:, 1])
+        return np.column_stack([lon, lat])
 
 
-    def update_points(self):
-        # Clear previous points
-        self.points_layer.clear_layers()
-        points = self.transform_points()
-        # Add current points
-        for point in points:
-            lat, lon = point.y, point.x  # ipyleaflet expects (lat, lon)
-            marker = CircleMarker(location=(lat, lon), radius=2, color="red", fill_color="red")
-            self.points_layer.add_layer(marker)
 
-
-    def update_labels(self):
-        self.label_marker.icon = DivIcon(
-            html=(
-            f'min LCOE: {self.sa.min_LCOE:.3f} ct/kWh<br>'
-            f'max AEP: {self.sa.max_AEP/1e6:.3f} MWh<br>'
-            f'iteration: {self.iter}/{self.iterations}<br>'
-            f"latest LCOE: {self.sa.lcoe_hist[-1]:.3f} ct/kWh" if self.sa.lcoe_hist else ""
-            ),
-            icon_size=[170, 75]
-        )
-
-    def transform_points(self):
-        points_epsg4326 = []
-        for pt in self.current_allocations:
-            lon, lat = self.transformer.transform(pt.x, pt.y)
-            points_epsg4326.append(Point(lon, lat))
-        return points_epsg4326
-
-
-
-    def get_cables_length_and_substation(self):
-        coords = np.array([[p.x, p.y] for p in self.current_allocations])
-        dist_matrix = squareform(pdist(coords))  
-        mst = minimum_spanning_tree(dist_matrix)
-        centroid = np.mean(coords, axis=0)
-        substation = Point(centroid[0], centroid[1])
-        return mst.sum(), substation
+    def get_cables_length_and_substation(self, allocations=None):
+        if allocations is None:
+            allocations = self.current_allocations
+        return self.cables.route(allocations)
 
     def show_best_lcoe(self):
-        self.current_allocations = self.sa.min_LCOE_alloc
-        self.update_points()
+        self.accept_allocations(self.sa.min_LCOE_alloc.copy())
+        self.notify("on_layout")
         print(f"Best LCOE is {self.sa.min_LCOE:.3f} ct/kWh")
 
     def show_best_aep(self):
-        self.current_allocations = self.sa.max_AEP_alloc
-        self.update_points()
+        self.accept_allocations(self.sa.max_AEP_alloc.copy())
+        self.notify("on_layout")
         print(f"Best AEP is {self.sa.max_AEP/1e6:.3f} MWh")
 
+    def summary(self):
+        max_aep_cables, _ = self.get_cables_length_and_substation(self.sa.max_AEP_alloc)
+        lcoe_at_max_aep = self.econ.get_lcoe(self.sa.max_AEP, max_aep_cables)
+        # cables, substation and capex of the min LCOE layout, not of the last accepted one
+        cables_length, subs = self.get_cables_length_and_substation(self.sa.min_LCOE_alloc)
+        self.econ.calculate_capex(cables_length)
+        return {
+            "min_lcoe": self.sa.min_LCOE,
+            "aep_at_min_lcoe": self.sa.aep_at_min_lcoe,
+            "wake_losses_at_min_lcoe": self.fm.get_wake_losses(self.sa.min_LCOE_alloc),
+            "max_aep": self.sa.max_AEP,
+            "lcoe_at_max_aep": lcoe_at_max_aep,
+            "wake_losses_at_max_aep": self.fm.get_wake_losses(self.sa.max_AEP_alloc),
+            "land_area": self.area,
+            "available_area": self.area_cut,
+            "land_cost": self.econ.land_cost,
+            "capex": self.econ.capex,
+            "cable_length": cables_length,
+            "substation": (subs[0], subs[1]),
+            "spacing_rejections": self.spacing.rejections if self.spacing is not None else 0,
+        }
+
     def print_summary(self):
-        print(f"Best LCOE is {self.sa.min_LCOE:.3f} ct/kWh")
-        print(f"AEP at min LCOE is {self.sa.aep_at_min_lcoe/1e6:.3f} MWh")
-        print(f"wake losses at min LCOE: {self.fm.get_wake_losses(self.sa.min_LCOE_alloc):.3f} %")
-        print(f"Best AEP is {self.sa.max_AEP/1e6:.3f} MWh")
-        cables_length, subs = self.get_cables_length_and_substation()
-        lcoe = self.econ.get_lcoe(self.sa.max_AEP, cables_length)
-        print(f"LCOE at max AEP is {lcoe:.3f} ct/kWh")
-        wake_losses = self.fm.get_wake_losses(self.sa.max_AEP_alloc)
-        print(f"Wake losses at max AEP: {wake_losses:.3f} %")
-        print(f"Land area: {self.area/1e6:.3f} km2")
-        print(f"Available land area after constraints: {self.area_cut/1e6:.3f} km2")
-        print(f"Land cost: {self.econ.land_cost/1e6:.2f} MEUR")
-        print(f"Total capex: {self.econ.capex/1e6:.2f} MEUR")
-        print(f"Cable length: {cables_length/1e3:.2f} km")
-        print(f"Substation location (EPSG:{self.best_epsg}): ({subs.y:.4f}, {subs.x:.4f})")
+        s = self.summary()
+        print(f"Best LCOE is {s['min_lcoe']:.3f} ct/kWh")
+        print(f"AEP at min LCOE is {s['aep_at_min_lcoe']/1e6:.3f} MWh")
+        print(f"wake losses at min LCOE: {s['wake_losses_at_min_lcoe']:.3f} %")
+        print(f"Best AEP is {s['max_aep']/1e6:.3f} MWh")
+        print(f"LCOE at max AEP is {s['lcoe_at_max_aep']:.3f} ct/kWh")
+        print(f"Wake losses at max AEP: {s['wake_losses_at_max_aep']:.3f} %")
+        print(f"Land area: {s['land_area']/1e6:.3f} km2")
+        print(f"Available land area after constraints: {s['available_area']/1e6:.3f} km2")
+        print(f"Land cost: {s['land_cost']/1e6:.2f} MEUR")
+        print(f"Total capex: {s['capex']/1e6:.2f} MEUR")
+        print(f"Cable length: {s['cable_length']/1e3:.2f} km")
+        print(f"Substation location (EPSG:{self.best_epsg}): ({s['substation'][1]:.4f}, {s['substation'][0]:.4f})")
 
     def update_iterations(self, iterations):
         self.iterations = iterations
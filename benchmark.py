@@ -0,0 +1,484 @@
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point
+from scipy.spatial.distance import pdist, squareform
+from scipy.sparse.csgraph import minimum_spanning_tree
+import data_retriever as dr
+import allocator
+import cables
+import instrumentation
+import feasibility
+import modeling as mdl
+import utils
+
+
+def legacy_sample(available_gdf, minx, miny, maxx, maxy):
+    # the rejection loop the allocator used before the feasibility index
+    p = Point(np.random.uniform(minx, maxx), np.random.uniform(miny, maxy))
+    while not available_gdf.contains(p).values.any():
+        p = Point(np.random.uniform(minx, maxx), np.random.uniform(miny, maxy))
+    return p
+
+
+def bench_feasibility(samples=500, resolution=25.0, seed=0):
+    """
+    Time the acceptance loop of a turbine move, legacy GeoPandas path against
+    the feasibility index with and without the raster.
+    """
+    wr = dr.WeatherRetriever(default=True)
+    available_gdf, area = utils.available_land(wr.coordinates, wr.constraints, wr.best_epsg)
+    R0 = np.sqrt(area)
+
+    index = feasibility.FeasibilityIndex(available_gdf)
+    np.random.seed(seed)
+    starts = index.sample_many(samples)
+
+    paths = {
+        "legacy": lambda *box: legacy_sample(available_gdf, *box),
+        "prepared": index.sample,
+        "raster": feasibility.FeasibilityIndex(available_gdf, resolution=resolution).sample,
+    }
+
+    results = {}
+    for radius_name, R in [("R0", R0), ("0.1*R0", 0.1 * R0)]:
+        for name, sample in paths.items():
+            np.random.seed(seed)
+            t0 = time.perf_counter()
+            for x, y in starts:
+                sample(x - R, y - R, x + R, y + R)
+            elapsed = time.perf_counter() - t0
+            results[(radius_name, name)] = elapsed / samples * 1e6
+
+    print(f"{'radius':<8} {'path':<10} {'us/move':>10} {'speedup':>8}")
+    for (radius_name, name), us in results.items():
+        speedup = results[(radius_name, "legacy")] / us
+        print(f"{radius_name:<8} {name:<10} {us:>10.1f} {speedup:>7.1f}x")
+    return results
+
+
+def legacy_step(index, layout, prev, i, R, prefix):
+    # one proposal with the layout as a list of shapely Points, as before
+    pos = layout[i]
+    layout[i] = Point(*index.sample(pos.x - R, pos.y - R, pos.x + R, pos.y + R))
+    coords = np.array([[p.x, p.y] for p in layout])
+    cables = minimum_spanning_tree(squareform(pdist(coords))).sum()
+    centroid = np.mean(coords, axis=0)
+    substation = Point(centroid[0], centroid[1])
+    xs = [p.x for p in layout]
+    ys = [p.y for p in layout]
+    q = np.rint(np.array([[p.x, p.y] for p in layout])).astype(np.int64)
+    key = prefix + q[np.lexsort((q[:, 1], q[:, 0]))].tobytes()
+    return list(prev)
+
+
+def array_step(index, cache, layout, prev, i, R, prefix):
+    # the same proposal on an (n, 2) array with copy-on-accept
+    x, y = layout[i]
+    layout[i] = index.sample(x - R, y - R, x + R, y + R)
+    cables = minimum_spanning_tree(squareform(pdist(layout))).sum()
+    substation = np.mean(layout, axis=0)
+    positions = np.array(layout, dtype=float)
+    key = cache.key(prefix, positions)
+    return prev.copy()
+
+
+def bench_step(turbines=(5, 15, 50, 150), steps=2000, seed=0):
+    """
+    Time the per-proposal work outside FLORIS (move, cables, substation,
+    layout handed to the farm model, cache key and restoring the layout),
+    shapely Point lists against (n, 2) arrays.
+    """
+    wr = dr.WeatherRetriever(default=True)
+    available_gdf, area = utils.available_land(wr.coordinates, wr.constraints, wr.best_epsg)
+    R = 0.1 * np.sqrt(area)
+    index = feasibility.FeasibilityIndex(available_gdf)
+    cache = mdl.LayoutCache()
+    prefix = b"bench"
+
+    results = {}
+    for n in turbines:
+        np.random.seed(seed)
+        coords = index.sample_many(n)
+
+        layout = [Point(x, y) for x, y in coords]
+        np.random.seed(seed)
+        t0 = time.perf_counter()
+        for step in range(steps):
+            layout = legacy_step(index, layout, layout, step % n, R, prefix)
+        results[(n, "points")] = (time.perf_counter() - t0) / steps * 1e6
+
+        layout = coords.copy()
+        np.random.seed(seed)
+        t0 = time.perf_counter()
+        for step in range(steps):
+            layout = array_step(index, cache, layout, layout, step % n, R, prefix)
+        results[(n, "array")] = (time.perf_counter() - t0) / steps * 1e6
+
+    print(f"{'turbines':>8} {'layout':<8} {'us/step':>10} {'speedup':>8}")
+    for (n, name), us in results.items():
+        speedup = results[(n, "points")] / us
+        print(f"{n:>8} {name:<8} {us:>10.1f} {speedup:>7.1f}x")
+    return results
+
+
+def bench_cables(turbines=(15, 50, 150, 300), steps=300, seed=0):
+    """
+    Time the cable length of single-turbine moves, dense scipy MST against
+    the repaired tree (and the Delaunay build for large farms).
+    """
+    rng = np.random.default_rng(seed)
+    results = {}
+    for n in turbines:
+        span = 1000 * np.sqrt(n)
+        layouts = []
+        layout = rng.uniform(0, span, (n, 2))
+        for step in range(steps):
+            proposal = layout.copy()
+            proposal[step % n] += rng.normal(0, 0.1 * span, 2)
+            layouts.append(proposal)
+            if rng.uniform() < 0.3:  # accepted
+                layout = proposal
+
+        t0 = time.perf_counter()
+        dense = [minimum_spanning_tree(squareform(pdist(c))).sum() for c in layouts]
+        results[(n, "dense")] = (time.perf_counter() - t0) / steps * 1e6
+
+        tree = cables.MinimumSpanningTree(delaunay_threshold=np.inf)
+        t0 = time.perf_counter()
+        repaired = [tree.length(c) for c in layouts]
+        results[(n, "repair")] = (time.perf_counter() - t0) / steps * 1e6
+        assert np.allclose(dense, repaired)
+
+        delaunay = cables.MinimumSpanningTree(delaunay_threshold=0)
+        t0 = time.perf_counter()
+        built = [delaunay.build(c)[1].sum() for c in layouts]
+        results[(n, "delaunay")] = (time.perf_counter() - t0) / steps * 1e6
+        assert np.allclose(dense, built)
+
+    print(f"{'turbines':>8} {'path':<9} {'us/move':>10} {'speedup':>8}")
+    for (n, name), us in results.items():
+        speedup = results[(n, "dense")] / us
+        print(f"{n:>8} {name:<9} {us:>10.1f} {speedup:>7.1f}x")
+    return results
+
+
+def bench_routing(turbines=(5, 15, 50, 150), steps=300, capacity=8, seed=0):
+    """
+    Time the collection system of single-turbine moves on the default site,
+    spanning tree against capacitated strings, and compare their lengths.
+    """
+    wr = dr.WeatherRetriever(default=True)
+    available_gdf, area = utils.available_land(wr.coordinates, wr.constraints, wr.best_epsg)
+    R = 0.1 * np.sqrt(area)
+    index = feasibility.FeasibilityIndex(available_gdf)
+
+    results = {}
+    for n in turbines:
+        np.random.seed(seed)
+        layout = index.sample_many(n)
+        layouts = []
+        for step in range(steps):
+            proposal = layout.copy()
+            x, y = proposal[step % n]
+            proposal[step % n] = index.sample(x - R, y - R, x + R, y + R)
+            layouts.append(proposal)
+            if np.random.uniform() < 0.3:  # accepted
+                layout = proposal
+
+        for name, router in [
+            ("mst", cables.MinimumSpanningTree()),
+            ("strings", cables.StringRouting(index, capacity, maxsize=0)),
+        ]:
+            t0 = time.perf_counter()
+            lengths = [router.route(c)[0] for c in layouts]
+            results[(n, name)] = ((time.perf_counter() - t0) / steps * 1e6, np.mean(lengths) / 1e3)
+
+    print(f"{'turbines':>8} {'routing':<8} {'us/move':>10} {'km':>8}")
+    for (n, name), (us, km) in results.items():
+        print(f"{n:>8} {name:<8} {us:>10.1f} {km:>8.2f}")
+    return results
+
+
+def synthetic_weather(year=2023, seed=0):
+    """
+    Seeded hourly weather for one year, with the columns retrieve_weather
+    returns: a prevailing south-westerly and a weaker easterly wind, Weibull
+    speeds stronger in winter and in the afternoon.
+    """
+    rng = np.random.default_rng(seed)
+    date = pd.date_range(f"{year}-01-01", f"{year}-12-31 23:00", freq="h", tz="UTC")
+    n = len(date)
+    hour = date.hour.to_numpy()
+    day = date.dayofyear.to_numpy()
+
+    westerly = rng.uniform(size=n) < 0.7
+    direction = np.where(westerly, rng.vonmises(np.radians(240), 4.0, n), rng.vonmises(np.radians(90), 2.0, n))
+    scale = 8.0 * (1 + 0.15 * np.cos(2 * np.pi * day / 365)) * (1 + 0.1 * np.sin(2 * np.pi * (hour - 9) / 24))
+    return pd.DataFrame({
+        "date": date,
+        "temperature_2m": 9 - 9 * np.cos(2 * np.pi * (day - 15) / 365) + rng.normal(0, 3, n),
+        "wind_direction_100m": np.degrees(direction) % 360,
+        "wind_speed_100m": scale * rng.weibull(2.0, n),
+    })
+
+
+def synthetic_site(side_km, patches, seed=0, lon=15.1, lat=52.24):
+    """
+    Square site of `side_km` split in two parcels by a strip, with
+    `patches` circular exclusions of random size and place.
+
+    Returns:
+    tuple: The site and constraint rings in lon/lat, as WeatherRetriever
+        coordinates and constraints.
+    """
+    rng = np.random.default_rng(seed)
+    dlat = side_km / 111.32
+    dlon = dlat / np.cos(np.radians(lat))
+    x0, y0 = lon - dlon / 2, lat - dlat / 2
+
+    def box(ax, ay, bx, by):
+        return [[ax, ay], [bx, ay], [bx, by], [ax, by], [ax, ay]]
+
+    coordinates = [
+        box(x0, y0, x0 + 0.45 * dlon, y0 + dlat),
+        box(x0 + 0.5 * dlon, y0 + 0.1 * dlat, x0 + dlon, y0 + dlat),
+    ]
+
+    constraints = []
+    angle = np.linspace(0, 2 * np.pi, 13)
+    for _ in range(patches):
+        cx, cy = x0 + rng.uniform(0, dlon), y0 + rng.uniform(0, dlat)
+        radius = rng.uniform(0.02, 0.07)
+        ring = np.column_stack([cx + radius * dlon * np.cos(angle), cy + radius * dlat * np.sin(angle)])
+        ring[-1] = ring[0]
+        constraints.append(ring.tolist())
+    return coordinates, constraints
+
+
+# name: (side in km, excluded patches, turbines), None for the default site.
+# A FLORIS run of the large site takes about a minute, it is left out unless asked for.
+SITES = {
+    "small": (1.5, 3, 5),
+    "default": (None, None, 15),
+    "medium": (5.0, 12, 50),
+    "large": (9.0, 30, 150),
+}
+DEFAULT_SITES = ("small", "default", "medium")
+
+
+def site_retriever(name, seed=0):
+    side_km, patches, turbines = SITES[name]
+    if side_km is None:
+        wr = dr.WeatherRetriever(default=True)
+    else:
+        wr = dr.WeatherRetriever()
+        wr.coordinates, wr.constraints = synthetic_site(side_km, patches, seed)
+        wr.calculate_centroid()
+    wr.weather = synthetic_weather(seed=seed)
+    return wr, turbines
+
+
+def measure(setup, memory=True):
+    """
+    Time one call of the function returned by setup(), and its peak
+    allocation in a second, traced call (tracemalloc slows Python code
+    down, so the timed call runs without it).
+
+    Returns:
+    dict: wall_s, the counts returned by the call and peak_mb.
+    """
+    run = setup()
+    t0 = time.perf_counter()
+    counts = run()
+    wall = time.perf_counter() - t0
+    result = {"wall_s": wall, **counts}
+    for name, value in counts.items():
+        result[f"{name}_per_s"] = value / wall if wall else None
+
+    result["peak_mb"] = None
+    if memory:
+        run = setup()
+        tracemalloc.start()
+        try:
+            run()
+            result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def single_moves(alc, steps, seed):
+    # layouts that each move one turbine of the previous one, as the annealer proposes
+    np.random.seed(seed)
+    layout = alc.current_allocations.copy()
+    layouts = []
+    for step in range(steps):
+        layout = layout.copy()
+        i = step % len(layout)
+        layout[i] = alc.allocate_turbine(layout[i], i)
+        layouts.append(layout)
+    return layouts
+
+
+def bench_site(name, iterations=1, steps=5, seed=0, memory=True):
+    """
+    Benchmark the wind rose, the FLORIS runs, the cable routing and a full
+    annealing run on one site.
+
+    Returns:
+    list: One dict of measures per target.
+    """
+    wr, turbines = site_retriever(name, seed)
+    np.random.seed(seed)
+    md = mdl.ModelData(wr)
+    fm = mdl.FarmModel(md, no_of_turbines=turbines)
+    alc = allocator.Allocator(wr, fm)
+    alc.sa.verbose = False
+    layouts = single_moves(alc, steps, seed)
+
+    def wind_rose():
+        mdl._wind_rose_cache.clear()
+        return lambda: (md.wind_rose(), {"calls": 1})[1]
+
+    def new_run():
+        fm.cache.entries.clear()
+        if fm.incremental is not None:
+            fm.incremental.reset(fm.wr)
+
+        def run():
+            start = fm.floris_runs
+            for layout in layouts:
+                fm.new_run(layout)
+            return {"calls": len(layouts), "floris_calls": fm.floris_runs - start}
+        return run
+
+    def routing():
+        # a new router each time, its caches would answer the second pass
+        if alc.cable_routing == "capacitated":
+            alc.cables = cables.StringRouting(alc.feasibility, alc.turbines_per_string)
+        else:
+            alc.cables = cables.MinimumSpanningTree(alc.cable_delaunay_threshold)
+
+        def run():
+            for layout in layouts:
+                alc.get_cables_length_and_substation(layout)
+            return {"calls": len(layouts)}
+        return run
+
+    def annealing():
+        np.random.seed(seed)
+        fm.cache.entries.clear()
+        alc.update_iterations(iterations)
+        alc.set_no_of_turbines(turbines)
+        alc.stats = instrumentation.Instrumentation()
+
+        def run():
+            start = fm.floris_runs
+            alc.run()
+            return {"proposals": alc.stats.counters.get("proposals", 0), "floris_calls": fm.floris_runs - start}
+        return run
+
+    rows = []
+    for target, setup in [
+        ("ModelData.wind_rose", wind_rose),
+        ("FarmModel.new_run", new_run),
+        ("Allocator.get_cables_length_and_substation", routing),
+        ("Allocator.run", annealing),
+    ]:
+        rows.append({"site": name, "turbines": turbines, "target": target, **measure(setup, memory)})
+    return rows
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(sites=DEFAULT_SITES, iterations=1, steps=5, seed=0, memory=True,
+                output="benchmark.json", baseline=None):
+    """
+    Offline benchmark of the optimizer on the default site and synthetic
+    ones, with seeded synthetic weather. The measures, the commit, the
+    versions and the config are written to `output` as json. With a
+    baseline json of an earlier commit, the rates are compared (above 1x
+    is faster).
+    """
+    import floris
+
+    rows = []
+    for name in sites:
+        rows.extend(bench_site(name, iterations, steps, seed, memory))
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "floris": floris.__version__,
+            "machine": platform.machine(),
+            "iterations": iterations,
+            "steps": steps,
+            "seed": seed,
+            "config": dict(dr.WeatherRetriever().context.config),
+        },
+        "results": rows,
+    }
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, default=float)
+
+    previous = {}
+    if baseline is not None:
+        with open(baseline) as f:
+            previous = {(r["site"], r["target"]): r for r in json.load(f)["results"]}
+
+    def rate(row):
+        return row.get("proposals_per_s") or row.get("calls_per_s")
+
+    print(f"{'site':<8} {'target':<44} {'wall s':>9} {'per s':>10} {'peak MB':>8} {'vs base':>8}")
+    for row in rows:
+        peak = f"{row['peak_mb']:>8.1f}" if row["peak_mb"] is not None else f"{'-':>8}"
+        base = previous.get((row["site"], row["target"]))
+        change = f"{rate(row) / rate(base):>7.2f}x" if base else f"{'-':>8}"
+        print(f"{row['site']:<8} {row['target']:<44} {row['wall_s']:>9.3f} {rate(row):>10.1f} {peak} {change}")
+    return results
+
+
+BENCHMARKS = {
+    "feasibility": bench_feasibility,
+    "step": bench_step,
+    "cables": bench_cables,
+    "routing": bench_routing,
+    "suite": bench_suite,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="farmopt micro benchmarks")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run, any of {', '.join(BENCHMARKS)}")
+    parser.add_argument("--sites", nargs="+", choices=list(SITES), default=list(DEFAULT_SITES), help="sites of the suite")
+    parser.add_argument("--iterations", type=int, default=1, help="annealing iterations of the suite")
+    parser.add_argument("--output", default="benchmark.json", help="json file of the suite results")
+    parser.add_argument("--baseline", help="suite json of an earlier commit to compare against")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced runs for the peak memory")
+    args = parser.parse_args()
+    for name in args.names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}")
+        print(f"== {name} ==")
+        if name == "suite":
+            bench_suite(args.sites, args.iterations, memory=not args.no_memory,
+                        output=args.output, baseline=args.baseline)
+        else:
+            BENCHMARKS[name]()
@@ -0,0 +1,306 @@
+from collections import OrderedDict
+import numpy as np
+from scipy.spatial import Delaunay, QhullError, cKDTree
+from scipy.spatial.distance import pdist, squareform
+
+
+class MinimumSpanningTree:
+    """
+    Cable length of a layout as the length of its minimum spanning tree.
+
+    The trees of the last few layouts are kept. A layout that differs from
+    one of them in a single turbine is repaired instead of rebuilt: dropping
+    the moved turbine splits its tree into a few subtrees (at most six, the
+    degree bound of a Euclidean tree), which are joined again by the shortest
+    edges between them, and the spanning tree of those edges plus the edges
+    from the turbine's new position is the new tree. The shortest edge
+    between two subtrees is a nearest neighbour query of the smaller one in a
+    k-d tree of the larger, so a repair is O(n log n), against O(n^2) for a
+    full build. From `delaunay_threshold` turbines on, full builds only look
+    at the edges of the Delaunay triangulation, which contains the Euclidean
+    tree.
+    """
+    def __init__(self, delaunay_threshold=100, max_trees=4):
+        self.delaunay_threshold = delaunay_threshold
+        self.max_trees = max_trees
+        self.trees = OrderedDict()
+        self.repairs = 0
+        self.builds = 0
+
+    def length(self, coords):
+        """
+        Parameters:
+        coords (np.ndarray): Turbine x, y in metres, shape (n, 2).
+
+        Returns:
+        float: Total length of the tree in metres.
+        """
+        return self.tree(coords)[1].sum()
+
+    def route(self, coords):
+        """
+        Returns:
+        tuple: Cable length in metres and the substation (x, y), at the centroid.
+        """
+        return self.length(coords), np.mean(coords, axis=0)
+
+    def tree(self, coords):
+        """
+        Returns:
+        tuple: The (n - 1, 2) turbine index pairs of the tree edges and their lengths.
+        """
+        key = coords.tobytes()
+        if key in self.trees:
+            self.trees.move_to_end(key)
+            return self.trees[key][1:]
+
+        if len(coords) < 2:
+            edges, weights = np.empty((0, 2), dtype=np.int64), np.empty(0)
+        else:
+            base = self.find_tree(coords)
+            if base is None:
+                edges, weights = self.build(coords)
+                self.builds += 1
+            else:
+                edges, weights = self.repair(coords, *base)
+                self.repairs += 1
+
+        self.trees[key] = (coords.copy(), edges, weights)
+        while len(self.trees) > self.max_trees:
+            self.trees.popitem(last=False)
+        return edges, weights
+
+    def find_tree(self, coords):
+        for base_coords, edges, weights in reversed(self.trees.values()):
+            if base_coords.shape != coords.shape:
+                continue
+            moved = np.flatnonzero(np.any(base_coords != coords, axis=1))
+            if len(moved) == 1:
+                return edges, weights, moved[0]
+        return None
+
+    def build(self, coords):
+        n = len(coords)
+        if n >= self.delaunay_threshold:
+            try:
+                simplices = Delaunay(coords).simplices
+            except QhullError:  # collinear or duplicate turbines, use the dense path
+                pass
+            else:
+                pairs = np.vstack([simplices[:, [0, 1]], simplices[:, [1, 2]], simplices[:, [0, 2]]])
+                return kruskal(coords, np.unique(np.sort(pairs, axis=1), axis=0))
+        return prim(coords)
+
+    def repair(self, coords, edges, weights, k):
+        n = len(coords)
+        edges = edges[~np.any(edges == k, axis=1)]
+
+        # subtrees left when the moved turbine is dropped from the old tree
+        forest = UnionFind(n)
+        for i, j in edges.tolist():
+            forest.union(i, j)
+        roots = np.array([forest.find(i) for i in range(n)])
+        roots[k] = -1
+        groups = [np.flatnonzero(roots == root) for root in np.unique(roots[roots >= 0])]
+
+        # shortest edge between every two subtrees, the smaller one queried
+        # against a k-d tree of the larger
+        kdtrees = [cKDTree(coords[group]) for group in groups]
+        bridges = []
+        for a in range(len(groups)):
+            for b in range(a + 1, len(groups)):
+                small, large = sorted((a, b), key=lambda g: len(groups[g]))
+                d, nearest = kdtrees[large].query(coords[groups[small]])
+                i = np.argmin(d)
+                bridges.append((groups[small][i], groups[large][nearest[i]]))
+
+        others = np.delete(np.arange(n), k)
+        pairs = np.vstack([
+            edges,
+            np.array(bridges, dtype=np.int64).reshape(-1, 2),
+            np.column_stack([np.full(n - 1, k), others]),
+        ])
+        return kruskal(coords, pairs)
+
+
+class StringRouting:
+    """
+    Collection system of strings of at most `capacity` turbines, each string
+    a tree rooted at the substation.
+
+    The substation goes to the geometric median of the turbines (Weiszfeld
+    iterations, started from the previous median), moved to the closest
+    available land when the median falls outside. The turbines are swept by
+    angle around the substation and cut into strings of `capacity`
+    consecutive turbines; every cut offset is tried and the cheapest kept.
+    The spanning trees of all strings of all offsets are solved together as
+    one batched Prim. Routed layouts are kept in an LRU cache of `maxsize`.
+    """
+    def __init__(self, feasibility, capacity=8, maxsize=4096):
+        self.feasibility = feasibility
+        self.capacity = capacity
+        self.maxsize = maxsize
+        self.median = None
+        self.routes = OrderedDict()
+
+    def route(self, coords):
+        """
+        Returns:
+        tuple: Cable length in metres and the substation (x, y).
+        """
+        return self.routing(coords)[:2]
+
+    def routing(self, coords):
+        """
+        Returns:
+        tuple: Cable length, substation (x, y) and the (n, 2) edges of the
+            strings, where index n stands for the substation.
+        """
+        key = coords.tobytes()
+        if key in self.routes:
+            self.routes.move_to_end(key)
+            return self.routes[key]
+
+        substation = np.array(self.feasibility.nearest(*self.geometric_median(coords)))
+        length, edges = self.sweep(coords, substation)
+
+        result = (length, substation, edges)
+        if self.maxsize:
+            self.routes[key] = result
+            while len(self.routes) > self.maxsize:
+                self.routes.popitem(last=False)
+        return result
+
+    def geometric_median(self, coords, iterations=100, tolerance=0.1):
+        median = np.mean(coords, axis=0) if self.median is None else self.median
+        for _ in range(iterations):
+            distance = np.maximum(np.hypot(*(coords - median).T), 1e-9)
+            weights = 1 / distance
+            step = weights @ coords / weights.sum()
+            converged = np.hypot(*(step - median)) < tolerance
+            median = step
+            if converged:
+                break
+        self.median = median
+        return median
+
+    def sweep(self, coords, substation):
+        n = len(coords)
+        c = min(self.capacity, n)
+        strings = -(-n // c)
+        angle = np.arctan2(*(coords - substation).T[::-1])
+        order = np.argsort(angle)
+
+        # one row per string and cut offset, padded with the substation (index n)
+        padded = np.full((c, strings * c), n)
+        padded[:, :n] = order[(np.arange(c)[:, None] + np.arange(n)) % n]
+        members = padded.reshape(c * strings, c)
+        nodes = np.hstack([np.full((len(members), 1), n), members])
+
+        points = np.vstack([coords, substation])[nodes]
+        dist = np.hypot(*(points[:, :, None, :] - points[:, None, :, :]).transpose(3, 0, 1, 2))
+        lengths, parent = batched_prim(dist)
+
+        cost = lengths.reshape(c, strings).sum(axis=1)
+        best = int(np.argmin(cost))
+        rows = slice(best * strings, (best + 1) * strings)
+        child = nodes[rows, 1:]
+        edges = np.column_stack([np.take_along_axis(nodes[rows], parent[rows, 1:], axis=1).ravel(), child.ravel()])
+        # drop the padding, attached to the substation at no length
+        edges = edges[edges[:, 1] != n]
+        return cost[best], edges
+
+
+class UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        """
+        Returns:
+        bool: False when i and j were already connected.
+        """
+        i, j = self.find(i), self.find(j)
+        if i == j:
+            return False
+        self.parent[i] = j
+        return True
+
+
+def kruskal(coords, pairs):
+    """
+    Minimum spanning tree over the candidate edges `pairs`.
+
+    Returns:
+    tuple: The tree edges as index pairs and their lengths.
+    """
+    lengths = np.hypot(*(coords[pairs[:, 0]] - coords[pairs[:, 1]]).T)
+    order = np.argsort(lengths, kind="stable")
+    forest = UnionFind(len(coords))
+    chosen = []
+    for e, (i, j) in zip(order.tolist(), pairs[order].tolist()):
+        if forest.union(i, j):
+            chosen.append(e)
+            if len(chosen) == len(coords) - 1:
+                break
+    return pairs[chosen], lengths[chosen]
+
+
+def batched_prim(dist):
+    """
+    Minimum spanning trees of many small complete graphs at once.
+
+    Parameters:
+    dist (np.ndarray): Distances of shape (graphs, m, m), node 0 is the root.
+
+    Returns:
+    tuple: Tree length of each graph and the parent of each node (the root
+        is its own parent).
+    """
+    graphs, m, _ = dist.shape
+    rows = np.arange(graphs)
+    best = dist[:, 0].copy()
+    parent = np.zeros((graphs, m), dtype=np.int64)
+    done = np.zeros((graphs, m), dtype=bool)
+    done[:, 0] = True
+    best[:, 0] = np.inf
+    total = np.zeros(graphs)
+    for _ in range(m - 1):
+        j = np.argmin(best, axis=1)
+        total += best[rows, j]
+        done[rows, j] = True
+        best[rows, j] = np.inf
+        closer = ~done & (dist[rows, j] < best)
+        best = np.where(closer, dist[rows, j], best)
+        parent = np.where(closer, j[:, None], parent)
+    return total, parent
+
+
+def prim(coords):
+    """
+    Minimum spanning tree over the dense distance matrix.
+    """
+    n = len(coords)
+    dist = squareform(pdist(coords))
+    best = dist[0].copy()
+    parent = np.zeros(n, dtype=np.int64)
+    done = np.zeros(n, dtype=bool)
+    done[0] = True
+    best[0] = np.inf
+    edges = np.empty((n - 1, 2), dtype=np.int64)
+    for step in range(n - 1):
+        j = int(np.argmin(best))
+        edges[step] = parent[j], j
+        done[j] = True
+        best[j] = np.inf
+        closer = ~done & (dist[j] < best)
+        best[closer] = dist[j, closer]
+        parent[closer] = j
+    return edges, dist[edges[:, 0], edges[:, 1]]
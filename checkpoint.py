@@ -0,0 +1,172 @@
+import logging
+import os
+import pickle
+import numpy as np
+import context as ctx
+import data_retriever as dr
+import modeling as mdl
+import allocator
+
+VERSION = 2
+
+
+def _fields(obj, names):
+    return {name: getattr(obj, name) for name in names}
+
+
+def state(alc):
+    """
+    Everything an annealing run carries from one iteration to the next.
+
+    Besides the layouts, the annealer and the global NumPy RNG, this holds
+    the caches whose contents change results: the layout cache answers
+    layouts within its resolution, the incremental AEP starts from its
+    bases, the cable routing from its trees or last median. The FLORIS
+    models and the wind rose are not stored, they are rebuilt from the
+    site, the weather and the config.
+
+    Returns:
+    dict: The picklable state of the allocator.
+    """
+    fm = alc.fm
+    cables = alc.cables
+    if hasattr(cables, "trees"):
+        cable_state = _fields(cables, ("trees", "repairs", "builds"))
+    else:
+        cable_state = _fields(cables, ("median", "routes"))
+    # the history directory has to hold the rows up to this state, no more
+    alc.history.sync()
+    incremental = None
+    if fm.incremental is not None:
+        incremental = _fields(fm.incremental, ("bases", "updates", "full_runs", "failures", "max_error"))
+
+    return {
+        "rng": np.random.get_state(),
+        "allocator": _fields(alc, ("no_of_turbines", "iterations", "iter", "R", "fidelity",
+                                   "current_allocations", "prev_allocations")),
+        "sa": alc.sa,
+        "screen": alc.screen,
+        "cache": _fields(fm.cache, ("entries", "hits", "misses")),
+        "incremental": incremental,
+        "cables": cable_state,
+        "history": alc.history.state(),
+        "counters": {
+            "floris_runs": fm.floris_runs,
+            "infeasible": alc.feasibility.rejections,
+            "too_close": alc.spacing.rejections if alc.spacing is not None else 0,
+            "stats": dict(alc.stats.counters),
+        },
+    }
+
+
+def restore(alc, saved):
+    """
+    Put an allocator of the same site and config back in a saved state.
+    """
+    fm = alc.fm
+    fields = saved["allocator"]
+    n = fields["no_of_turbines"]
+    alc.no_of_turbines = fm.no_of_turbines = alc.econ.no_of_turbines = n
+
+    if fields["fidelity"] is not None and fields["fidelity"] != alc.fidelity:
+        fm.set_wind_rose(fm.data_manipulator.wind_rose_at(*fields["fidelity"]))
+        if alc.screen is not None:
+            alc.screen.reset(fm.wr)
+    for name, value in fields.items():
+        setattr(alc, name, value)
+    alc.accept_allocations(fields["prev_allocations"].copy())
+    alc.current_allocations = fields["current_allocations"].copy()
+
+    alc.sa = saved["sa"]
+    alc.screen = saved["screen"]
+    fm.cache.entries = saved["cache"]["entries"]
+    fm.cache.hits = saved["cache"]["hits"]
+    fm.cache.misses = saved["cache"]["misses"]
+    if saved["incremental"] is not None and fm.incremental is not None:
+        vars(fm.incremental).update(saved["incremental"])
+    vars(alc.cables).update(saved["cables"])
+    # chunks written after the checkpoint belong to the interrupted run
+    alc.history.rewind(saved["history"])
+
+    counters = saved["counters"]
+    fm.floris_runs = counters["floris_runs"]
+    alc.feasibility.rejections = counters["infeasible"]
+    if alc.spacing is not None:
+        alc.spacing.rejections = counters["too_close"]
+    alc.stats.counters = dict(counters["stats"])
+    np.random.set_state(saved["rng"])
+
+
+def save(alc, path):
+    """
+    Write the state of the run with what is needed to rebuild its
+    allocator: the site, the weather and the config it was read from. The
+    file is replaced atomically, a crash while writing keeps the previous
+    checkpoint.
+    """
+    wr = alc.data_retriever
+    checkpoint = {
+        "version": VERSION,
+        "config_file": alc.context.config_file,
+        "data_dir": alc.context.data_dir,
+        "coordinates": wr.coordinates,
+        "constraints": wr.constraints,
+        "weather": wr.weather,
+        "state": state(alc),
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def load(path):
+    """
+    Rebuild the allocator of a checkpoint, in the saved state.
+
+    Returns:
+    allocator.Allocator: The allocator, ready to continue with run().
+    """
+    with open(path, "rb") as f:
+        checkpoint = pickle.load(f)
+    if checkpoint.get("version") != VERSION:
+        raise ValueError(f"Unsupported checkpoint version {checkpoint.get('version')} in {path}")
+
+    context = ctx.get(checkpoint["config_file"], checkpoint["data_dir"])
+    wr = dr.WeatherRetriever(context=context)
+    wr.coordinates = checkpoint["coordinates"]
+    wr.constraints = checkpoint["constraints"]
+    wr.calculate_centroid()
+    wr.weather = checkpoint["weather"]
+
+    saved = checkpoint["state"]
+    md = mdl.ModelData(wr)
+    fm = mdl.FarmModel(md, no_of_turbines=saved["allocator"]["no_of_turbines"])
+    alc = allocator.Allocator(wr, fm)
+    restore(alc, saved)
+    return alc
+
+
+def resume(path, iterations=None):
+    """
+    Continue the run of a checkpoint where it stopped, saving further
+    checkpoints to the same file. With the same code and config, the
+    result is the one of the uninterrupted run.
+
+    Parameters:
+    iterations (int): Extra iterations after the saved run, see
+        Allocator.extend.
+
+    Returns:
+    allocator.Allocator: The allocator after the run.
+    """
+    alc = load(path)
+    alc.checkpoint_file = path  # later checkpoints go to the same file
+    logging.info(f"Resuming from {path} at iteration {alc.iter} of {alc.iterations}")
+    if iterations:
+        alc.extend(iterations)
+    elif alc.iter < alc.iterations:
+        alc.run()
+    else:
+        logging.info("The saved run is finished, nothing to resume")
+    return alc
@@ -0,0 +1,77 @@
+import os
+from functools import cached_property
+from types import MappingProxyType
+import geopandas as gpd
+import pandas as pd
+import yaml
+
+DEFAULT_CONFIG_FILE = "config.yml"
+DEFAULT_DATA_DIR = "data"
+
+# contexts of this process by (config file, data dir), inherited by forked workers
+_contexts = {}
+
+
+class RunContext:
+    """
+    Read-only inputs shared by all components of a run: the configuration,
+    the land price tables and the country shapes.
+
+    Each is loaded on first use and kept for the life of the process, so
+    building many allocators reads config.yml, the price csvs and the
+    shapefile once. Contexts are shared per (config file, data dir) through
+    `get`, and a pickled context only carries those two paths: a worker
+    process started by fork finds the loaded one in its copy of the
+    registry, a spawned worker loads its own lazily.
+    """
+    def __init__(self, config_file=DEFAULT_CONFIG_FILE, data_dir=DEFAULT_DATA_DIR):
+        self.config_file = config_file
+        self.data_dir = data_dir
+
+    def __reduce__(self):
+        return get, (self.config_file, self.data_dir)
+
+    @cached_property
+    def config(self):
+        with open(self.config_file, "r") as f:
+            return MappingProxyType(yaml.safe_load(f) or {})
+
+    @cached_property
+    def land_lease_prices(self):
+        return pd.read_csv(os.path.join(self.data_dir, "land_lease_price.csv"))
+
+    @cached_property
+    def land_purchase_prices(self):
+        return pd.read_csv(os.path.join(self.data_dir, "land_purchase_price.csv"))
+
+    @cached_property
+    def countries(self):
+        world = gpd.read_file(os.path.join(self.data_dir, "shapes", "ne_110m_admin_0_countries.shp"))
+        world = world.to_crs("EPSG:4326")
+        world.sindex  # built once here, not on the first lookup
+        return world
+
+    def country_finder(self, centroid):
+        """
+        Parameters:
+        centroid (shapely.Point): Location in EPSG:4326.
+
+        Returns:
+        str: Name of the country containing the location.
+        """
+        countries = self.countries
+        matches = countries.sindex.query(centroid, predicate="within")
+        if len(matches) == 0:
+            raise ValueError(f"No country found at {centroid.x:.4f}, {centroid.y:.4f}")
+        return countries["NAME"].values[matches.min()]
+
+
+def get(config_file=DEFAULT_CONFIG_FILE, data_dir=DEFAULT_DATA_DIR):
+    """
+    The context of this process for the given config file and data dir,
+    created on first request.
+    """
+    key = (os.path.abspath(config_file), os.path.abspath(data_dir))
+    if key not in _contexts:
+        _contexts[key] = RunContext(config_file, data_dir)
+    return _contexts[key]
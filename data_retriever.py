@@ -1,21 +1,43 @@
 import openmeteo_requests
 import pandas as pd
-import requests_cache
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
 from retry_requests import retry
-from ipyleaflet import Map, DrawControl
-from ipyleaflet import Polygon as LeafletPolygon
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import logging
+import geopandas as gpd
 from shapely.geometry import Polygon, MultiPolygon
 import utils
+import context as ctx
+import weather_store as ws
+
+
+# The order of variables in hourly is important to assign them correctly
+HOURLY_VARIABLES = ["temperature_2m", "wind_direction_100m", "wind_speed_100m"]
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
 
 
 
 class WeatherRetriever:
-    def __init__(self, default = False):
+    def __init__(self, default = False, store: ws.WeatherStore = None, context: ctx.RunContext = None):
+        self.context = context if context is not None else ctx.get()
         self.coordinates = None
         self.constraints = None
         self.centroid = None
         self.weather = None
 
+        if store is None:
+            config = self.context.config
+            store = ws.WeatherStore(
+                root = config.get("weather_store_dir", ".weather_store"),
+                precision = config.get("weather_store_precision", 2),
+                offline = config.get("weather_offline", False),
+            )
+        self.store = store
+
         if default:
             self.coordinates = [[[15.07925, 52.222121],
                                 [15.054703, 52.232531],
@@ -65,13 +87,43 @@ class WeatherRetriever:
             self.calculate_centroid()
                                         
 
+    def load_site(self, site_file, constraints_file = None):
+        """
+        Read the farm area and constraints from vector files instead of the map.
+
+        Parameters:
+        site_file (str): GeoJSON (or any file geopandas reads) with the farm polygons.
+        constraints_file (str): Optional file with the excluded polygons.
+        """
+        self.coordinates = self.read_polygons(site_file)
+        self.constraints = self.read_polygons(constraints_file) if constraints_file else []
+        self.calculate_centroid()
+
+    def read_polygons(self, path):
+        gdf = gpd.read_file(path).to_crs("EPSG:4326")
+        polygons = []
+        for geom in gdf.geometry.explode(index_parts = False):
+            polygons.append([list(pt) for pt in geom.exterior.coords])
+        return polygons
+
+    def load_weather(self, weather_file):
+        """
+        Read hourly weather from a csv file with the same columns retrieve_weather
+        produces (at least wind_speed_100m and wind_direction_100m).
+        """
+        weather = pd.read_csv(weather_file)
+        missing = {"wind_speed_100m", "wind_direction_100m"} - set(weather.columns)
+        if missing:
+            raise ValueError(f"Weather file {weather_file} is missing columns: {', '.join(sorted(missing))}")
+        self.weather = weather
+        return self.weather
+
     def retrieve_weather(self, year = 2023):
         """
-        Retrieve weather data for the given longitude and latitude.
+        Retrieve hourly weather at the centroid, through the weather store.
 
         Parameters:
-        longitude (float): The longitude of the location.
-        latitude (float): The latitude of the location.
+        year (int or iterable): Calendar year, or years to concatenate.
 
         Returns:
         pd.DataFrame: A DataFrame containing the weather data.
@@ -79,57 +131,45 @@ class WeatherRetriever:
         if not self.centroid:
             self.calculate_centroid()
 
-        # Setup the Open-Meteo API client with cache and retry on error
-        cache_session = requests_cache.CachedSession('.cache', expire_after = -1)
-        retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
+        self.weather = self.store.get(self.centroid[0], self.centroid[1], year, HOURLY_VARIABLES, fetch = self.fetch_weather)
+
+        return self.weather
+
+    def fetch_weather(self, year):
+        """
+        Fetch one calendar year of hourly weather at the centroid from the Open-Meteo archive.
+
+        Parameters:
+        year (int): The year to fetch.
+
+        Returns:
+        pd.DataFrame: A DataFrame containing the weather data.
+        """
+        # Setup the Open-Meteo API client with retry on error, the weather store does the caching
+        retry_session = retry(requests.Session(), retries = 5, backoff_factor = 0.2)
         openmeteo = openmeteo_requests.Client(session = retry_session)
 
-        # Make sure all required weather variables are listed here
-        # The order of variables in hourly or daily is important to assign them correctly below
-        url = "https://archive-api.open-meteo.com/v1/archive"
+        url = self.context.config.get("weather_api_url", ARCHIVE_URL)
 
         params = {
             "latitude": self.centroid[0],
             "longitude": self.centroid[1],
             "start_date": f"{year}-01-01",
             "end_date": f"{year}-12-31",
-            "hourly": ["temperature_2m", "wind_direction_100m", "wind_speed_100m"],
+            "hourly": HOURLY_VARIABLES,
         }
         responses = openmeteo.weather_api(url, params=params)
 
-        # Process first location. Add a for-loop for multiple locations or weather models
-        response = responses[0]
-        # print(f"Coordinates: {response.Latitude()}°N {response.Longitude()}°E")
-        # print(f"Elevation: {response.Elevation()} m asl")
-        # print(f"Timezone difference to GMT+0: {response.UtcOffsetSeconds()}s")
-
-        # Process hourly data. The order of variables needs to be the same as requested.
-        hourly = response.Hourly()
-        hourly_temperature_2m = hourly.Variables(0).ValuesAsNumpy()
-        hourly_wind_direction_100m = hourly.Variables(1).ValuesAsNumpy()
-        hourly_wind_speed_100m = hourly.Variables(2).ValuesAsNumpy()
-
-        hourly_data = {"date": pd.date_range(
-            start = pd.to_datetime(hourly.Time(), unit = "s", utc = True),
-            end = pd.to_datetime(hourly.TimeEnd(), unit = "s", utc = True),
-            freq = pd.Timedelta(seconds = hourly.Interval()),
-            inclusive = "left"
-        )}
-
-        hourly_data["temperature_2m"] = hourly_temperature_2m
-        hourly_data["wind_speed_100m"] = hourly_wind_speed_100m
-        hourly_data["wind_direction_100m"] = hourly_wind_direction_100m
-
-
-        self.weather = pd.DataFrame(data = hourly_data)
-
-        return self.weather
+        # Process first location, prefetch_weather handles multiple locations
+        return response_to_frame(responses[0])
     
     def get_coordinates(self):
         """
         get coordinates by drawing a polygon on a map.
         
         """
+        from ipyleaflet import Map, DrawControl
+
         m = Map(center = (52.52, 13.405), zoom = 8)
 
         draw_control = DrawControl(circle = {}, circlemarker = {}, marker = {}, polyline = {})
@@ -175,13 +215,16 @@ class WeatherRetriever:
             centroid = multi.centroid
             self.centroid = (centroid.y, centroid.x)
             self.best_epsg = utils.best_epsg(centroid)
-            self.country = utils.country_finder(centroid)
+            self.country = self.context.country_finder(centroid)
 
     def set_constraints(self):
         if self.coordinates is None:
             raise ValueError("No coordinates available. Please draw a polygon first.")
         elif self.centroid is None:
             self.calculate_centroid() 
+
+        from ipyleaflet import Map, DrawControl
+        from ipyleaflet import Polygon as LeafletPolygon
         
         m = Map(center = self.centroid, zoom = 12)
         draw_control = DrawControl(circle = {}, circlemarker = {}, marker = {}, polyline = {})
@@ -228,4 +271,143 @@ class WeatherRetriever:
             polygon_coords = [tuple(coord[::-1]) for coord in coords[i]]
             polygons.append(polygon_coords)
             
-        return polygons
\ No newline at end of file
+        return polygons
+
+
+def response_to_frame(response):
+    """
+    Convert one Open-Meteo location response to the hourly weather DataFrame.
+    """
+    # print(f"Coordinates: {response.Latitude()}°N {response.Longitude()}°E")
+    # print(f"Elevation: {response.Elevation()} m asl")
+    # print(f"Timezone difference to GMT+0: {response.UtcOffsetSeconds()}s")
+
+    # Process hourly data. The order of variables needs to be the same as requested.
+    hourly = response.Hourly()
+    hourly_temperature_2m = hourly.Variables(0).ValuesAsNumpy()
+    hourly_wind_direction_100m = hourly.Variables(1).ValuesAsNumpy()
+    hourly_wind_speed_100m = hourly.Variables(2).ValuesAsNumpy()
+
+    hourly_data = {"date": pd.date_range(
+        start = pd.to_datetime(hourly.Time(), unit = "s", utc = True),
+        end = pd.to_datetime(hourly.TimeEnd(), unit = "s", utc = True),
+        freq = pd.Timedelta(seconds = hourly.Interval()),
+        inclusive = "left"
+    )}
+
+    hourly_data["temperature_2m"] = hourly_temperature_2m
+    hourly_data["wind_speed_100m"] = hourly_wind_speed_100m
+    hourly_data["wind_direction_100m"] = hourly_wind_direction_100m
+
+    return pd.DataFrame(data = hourly_data)
+
+
+class RateLimiter:
+    """
+    Spaces out calls so that at most `rate` start per second, shared by all threads.
+    """
+    def __init__(self, rate = None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_start = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        time.sleep(start - now)
+
+
+def pooled_session(pool_size):
+    """
+    A requests session with a connection pool of `pool_size` and retries on
+    failed requests, meant to be shared by the prefetch threads.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections = pool_size,
+        pool_maxsize = pool_size,
+        max_retries = Retry(total = 5, backoff_factor = 0.2, status_forcelist = (429, 500, 502, 504)),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def prefetch_weather(centroids, years, store = None, batch_size = None, workers = None, rate = None, url = None,
+                     context = None):
+    """
+    Fill the weather store for many sites at once.
+
+    Locations already in the store are skipped, the others are grouped into
+    multi-location requests of `batch_size` and fetched concurrently by
+    `workers` threads over one pooled session, with at most `rate` requests
+    started per second.
+
+    Parameters:
+    centroids (iterable): (lat, lon) of each site, as WeatherRetriever.centroid.
+    years (int or iterable): Year or years to fetch.
+    store (WeatherStore): Store to fill, defaults to the one from the config.
+    context (RunContext): Context of the config, defaults to the one of config.yml.
+
+    Returns:
+    int: The number of (location, year) entries fetched.
+    """
+    context = context if context is not None else ctx.get()
+    config = context.config
+    if store is None:
+        store = WeatherRetriever(context = context).store
+    batch_size = batch_size or config.get("weather_batch_size", 20)
+    workers = workers or config.get("weather_workers", 4)
+    rate = rate if rate is not None else config.get("weather_requests_per_second", 2)
+    url = url or config.get("weather_api_url", ARCHIVE_URL)
+    if isinstance(years, int):
+        years = [years]
+    if store.offline:
+        raise RuntimeError("Cannot prefetch weather with the store in offline mode")
+
+    # one request location per store cell
+    cells = {}
+    for lat, lon in centroids:
+        cells.setdefault(store.cell(lat, lon), (lat, lon))
+
+    tasks = []
+    for year in years:
+        missing = [c for c in cells.values() if not store.has(c[0], c[1], year, HOURLY_VARIABLES)]
+        for i in range(0, len(missing), batch_size):
+            tasks.append((year, missing[i:i + batch_size]))
+
+    if not tasks:
+        return 0
+
+    session = pooled_session(workers)
+    openmeteo = openmeteo_requests.Client(session = session)
+    limiter = RateLimiter(rate)
+
+    def fetch(task):
+        year, locations = task
+        params = {
+            "latitude": [lat for lat, lon in locations],
+            "longitude": [lon for lat, lon in locations],
+            "start_date": f"{year}-01-01",
+            "end_date": f"{year}-12-31",
+            "hourly": HOURLY_VARIABLES,
+        }
+        limiter.wait()
+        responses = openmeteo.weather_api(url, params = params)
+        for (lat, lon), response in zip(locations, responses):
+            store.save(lat, lon, year, response_to_frame(response), HOURLY_VARIABLES)
+        return len(locations)
+
+    try:
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            fetched = sum(executor.map(fetch, tasks))
+    finally:
+        session.close()
+
+    logging.info(f"Prefetched weather for {fetched} location-years in {len(tasks)} requests")
+    return fetched
+
@@ -1,16 +1,18 @@
-import yaml
-import pandas as pd
+import context as ctx
 
 class Econom:
-    def __init__(self, country, area):
-        with open("config.yml", "r") as f:
-            config = yaml.safe_load(f)
+    def __init__(self, country, area, no_of_turbines=None, context=None):
+        self.context = context if context is not None else ctx.get()
+        config = self.context.config
 
         self.r = config.get("discount_rate")
         self.N = config.get("project_lifetime")
         self.energy_price = None
 
-        self.no_of_turbines = config.get("number_of_turbines")
+        if no_of_turbines is not None:
+            self.no_of_turbines = no_of_turbines
+        else:
+            self.no_of_turbines = config.get("number_of_turbines")
         self.turbine_cost = config.get("turbine_cost_per_mw")
         self.turbine_opex = config.get("operation_cost_per_mw")
         self.mw_per_turbine = 5
@@ -29,8 +31,8 @@ class Econom:
         self.opex = 0
 
         # include land price to the calculation.
-        self.land_lease_prices = pd.read_csv("data/land_lease_price.csv")
-        self.land_purchase_prices = pd.read_csv("data/land_purchase_price.csv")
+        self.land_lease_prices = self.context.land_lease_prices
+        self.land_purchase_prices = self.context.land_purchase_prices
 
         self.land_cost = self.get_land_price(country, area)
         
@@ -42,13 +44,14 @@ class Econom:
         turbines_cost = self.no_of_turbines * self.turbine_cost * self.mw_per_turbine
         other_costs = self.other_costs * turbines_cost
         cables_cost = cable_length*self.cable_cost
+        substation_cost = self.no_of_turbines * self.mw_per_turbine * self.substation_cost
         opex = turbines_cost * self.turbine_opex
         if self.lease:
             opex += self.land_cost
         else:
             capex += self.land_cost
 
-        capex += turbines_cost + other_costs + cables_cost
+        capex += turbines_cost + other_costs + cables_cost + substation_cost
 
         self.capex = capex
         self.opex = opex
@@ -0,0 +1,258 @@
+"""
+Headless entry point for the wind farm optimization.
+
+    python -m farmopt site.geojson --constraints constraints.geojson \
+        --weather weather.csv --config config.yml --output results
+
+Writes results.json (summary and best layouts) and layout.geojson (turbines
+and substation of the min LCOE layout) to the output directory, plus
+pareto.csv and pareto.geojson with pareto_search enabled. With
+--sweep MIN MAX every turbine count in the range is optimized and
+sweep.csv / sweep.geojson are written instead. results.json carries the
+time spent per stage of the run and its counters; trace.json (Chrome trace)
+and profile.prof / profile.html are added with trace_events or a profiler
+set. With checkpoint_file (or --checkpoint) the run state is saved every
+checkpoint_every iterations; --resume CHECKPOINT continues it, and --extend N
+adds N iterations to a finished one. Nothing in this path imports ipyleaflet
+or ipywidgets.
+"""
+import argparse
+import json
+import logging
+import os
+import context as ctx
+import data_retriever as dr
+import modeling as mdl
+import allocator
+import sweep
+import checkpoint
+
+
+def build_allocator(site_file, constraints_file=None, weather_file=None, config_file=None,
+                    no_of_turbines=None, year=None):
+    context = ctx.get(config_file) if config_file is not None else ctx.get()
+    if year is None:
+        year = context.config.get("weather_years", 2023)
+
+    wr = dr.WeatherRetriever(context=context)
+    wr.load_site(site_file, constraints_file)
+    if weather_file is not None:
+        wr.load_weather(weather_file)
+    else:
+        wr.retrieve_weather(year)
+
+    md = mdl.ModelData(wr)
+    fm = mdl.FarmModel(md, no_of_turbines=no_of_turbines)
+    return allocator.Allocator(wr, fm)
+
+
+def optimize(site_file, constraints_file=None, weather_file=None, config_file=None,
+             iterations=None, no_of_turbines=None, year=None, observers=(), profiler=None,
+             checkpoint_file=None):
+    """
+    Run a full optimization without any widgets.
+
+    Parameters:
+    site_file (str): GeoJSON with the farm area polygons (EPSG:4326).
+    constraints_file (str): Optional GeoJSON with excluded polygons.
+    weather_file (str): Optional csv with hourly wind_speed_100m and
+        wind_direction_100m, the Open-Meteo archive is queried otherwise.
+    config_file (str): Optional config.yml to use instead of the default one.
+    iterations (int): Overrides the iterations from the config.
+    no_of_turbines (int): Overrides number_of_turbines from the config.
+    year (int or iterable): Weather year(s) to retrieve when no weather file is
+        given, defaults to weather_years from the config.
+    observers (iterable): Observers registered on the allocator before the run.
+    profiler (str): Overrides the profiler from the config, "cprofile" or "pyinstrument".
+    checkpoint_file (str): Overrides checkpoint_file from the config.
+
+    Returns:
+    allocator.Allocator: The allocator after the run.
+    """
+    alc = build_allocator(site_file, constraints_file, weather_file, config_file, no_of_turbines, year)
+    if iterations is not None:
+        alc.update_iterations(iterations)
+    if profiler is not None:
+        alc.profiler = profiler
+    if checkpoint_file is not None:
+        alc.checkpoint_file = checkpoint_file
+    for observer in observers:
+        alc.add_observer(observer)
+
+    alc.run()
+    return alc
+
+
+def optimize_sweep(site_file, counts, constraints_file=None, weather_file=None, config_file=None,
+                   iterations=None, year=None, workers=None):
+    """
+    Run the optimization for several turbine counts, see sweep.sweep.
+
+    Parameters:
+    counts (iterable): Turbine counts to optimize.
+    workers (int): Parallel processes, defaults to sweep_workers from the config.
+
+    Returns:
+    tuple: The allocator and the pd.DataFrame of results per count.
+    """
+    counts = list(counts)
+    alc = build_allocator(site_file, constraints_file, weather_file, config_file, counts[0], year)
+    config = alc.context.config
+    table = sweep.sweep(
+        alc,
+        counts,
+        iterations=iterations,
+        workers=workers or config.get("sweep_workers", 1),
+        candidates=config.get("sweep_candidates", 16),
+    )
+    return alc, table
+
+
+def layout_features(alc, allocations, role):
+    features = []
+    for i, (lon, lat) in enumerate(alc.transform_points(allocations).tolist()):
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"role": role, "index": i},
+        })
+    return features
+
+
+def export_results(alc, output_dir):
+    """
+    Write results.json and layout.geojson for a finished run.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    summary = alc.summary()
+    lon, lat = alc.transformer.transform(*summary["substation"])
+
+    results = {key: value for key, value in summary.items() if key != "substation"}
+    results["substation"] = [lon, lat]
+    results["country"] = alc.country
+    results["epsg"] = alc.best_epsg
+    results["no_of_turbines"] = alc.no_of_turbines
+    results["iterations"] = alc.iterations
+    results["min_lcoe_layout"] = alc.transform_points(alc.sa.min_LCOE_alloc).tolist()
+    results["max_aep_layout"] = alc.transform_points(alc.sa.max_AEP_alloc).tolist()
+    results["instrumentation"] = alc.stats.report()
+
+    with open(os.path.join(output_dir, "results.json"), "w") as f:
+        json.dump(results, f, indent=2, default=float)
+
+    features = layout_features(alc, alc.sa.min_LCOE_alloc, "turbine")
+    features.append({
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        "properties": {"role": "substation"},
+    })
+    with open(os.path.join(output_dir, "layout.geojson"), "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f, indent=2)
+
+    if alc.pareto is not None:
+        export_pareto(alc, output_dir)
+    if alc.stats.events is not None:
+        alc.stats.export_trace(os.path.join(output_dir, "trace.json"))
+    alc.stats.save_profile(os.path.join(output_dir, "profile"))
+
+    return results
+
+
+def export_pareto(alc, output_dir):
+    """
+    Write pareto.csv (the front sorted by LCOE) and pareto.geojson (one
+    MultiPoint of turbines per front layout) of a Pareto search.
+    """
+    table = alc.pareto.table()
+    table.to_csv(os.path.join(output_dir, "pareto.csv"), index_label="rank")
+
+    features = []
+    for rank, (layout, row) in enumerate(zip(alc.pareto.layouts(), table.to_dict("records"))):
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "MultiPoint", "coordinates": alc.transform_points(layout).tolist()},
+            "properties": {"rank": rank, **row},
+        })
+    with open(os.path.join(output_dir, "pareto.geojson"), "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f, indent=2, default=float)
+    return table
+
+
+def export_sweep(alc, table, output_dir):
+    """
+    Write sweep.csv (LCOE, AEP, wake losses, capex and cable length per
+    turbine count) and sweep.geojson (the best layout of each count).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    table.drop(columns="layout").to_csv(os.path.join(output_dir, "sweep.csv"), index=False)
+
+    features = []
+    for row in table.to_dict("records"):
+        layout = row.pop("layout")
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "MultiPoint", "coordinates": alc.transform_points(layout).tolist()},
+            "properties": row,
+        })
+    with open(os.path.join(output_dir, "sweep.geojson"), "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f, indent=2, default=float)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="farmopt", description="Optimize a wind farm layout without the map interface.")
+    parser.add_argument("site", nargs="?", help="GeoJSON with the farm area polygons")
+    parser.add_argument("--constraints", help="GeoJSON with the excluded polygons")
+    parser.add_argument("--weather", help="csv with hourly wind_speed_100m and wind_direction_100m")
+    parser.add_argument("--config", default="config.yml", help="configuration file")
+    parser.add_argument("--output", default="results", help="output directory")
+    parser.add_argument("--iterations", type=int, help="override the iterations from the config")
+    parser.add_argument("--turbines", type=int, help="override number_of_turbines from the config")
+    parser.add_argument("--year", type=int, nargs="+", help="weather years when no weather file is given, overrides weather_years from the config")
+    parser.add_argument("--sweep", type=int, nargs=2, metavar=("MIN", "MAX"),
+                        help="optimize every turbine count from MIN to MAX instead of a single one")
+    parser.add_argument("--profile", choices=["cprofile", "pyinstrument"], help="profile the run with this profiler")
+    parser.add_argument("--checkpoint", help="file the run state is saved to, see checkpoint_every")
+    parser.add_argument("--resume", metavar="CHECKPOINT", help="continue the run saved in CHECKPOINT instead of a new one")
+    parser.add_argument("--extend", type=int, metavar="N", help="with --resume, N more iterations after the saved run")
+    args = parser.parse_args(argv)
+
+    if args.resume:
+        alc = checkpoint.resume(args.resume, args.extend)
+        results = export_results(alc, args.output)
+        logging.info(f"Best LCOE {results['min_lcoe']:.3f} ct/kWh, results written to {args.output}")
+        return
+    if args.site is None:
+        parser.error("the site is required unless resuming")
+
+    if args.sweep:
+        alc, table = optimize_sweep(
+            args.site,
+            range(args.sweep[0], args.sweep[1] + 1),
+            constraints_file=args.constraints,
+            weather_file=args.weather,
+            config_file=args.config,
+            iterations=args.iterations,
+            year=args.year,
+        )
+        export_sweep(alc, table, args.output)
+        best = table.loc[table["lcoe"].idxmin()]
+        logging.info(f"Best LCOE {best['lcoe']:.3f} ct/kWh with {best['no_of_turbines']} turbines, results written to {args.output}")
+        return
+
+    alc = optimize(
+        args.site,
+        constraints_file=args.constraints,
+        weather_file=args.weather,
+        config_file=args.config,
+        iterations=args.iterations,
+        no_of_turbines=args.turbines,
+        year=args.year,
+        profiler=args.profile,
+        checkpoint_file=args.checkpoint,
+    )
+    results = export_results(alc, args.output)
+    logging.info(f"Best LCOE {results['min_lcoe']:.3f} ct/kWh, results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import math
+import numpy as np
+import shapely
+
+
+OUTSIDE = 0
+INSIDE = 1
+BOUNDARY = 2
+
+
+class FeasibilityIndex:
+    """
+    Point-in-land index over the available area of a site.
+
+    The available polygons are merged into one prepared geometry, so candidate
+    positions are tested in batches with a single `shapely.contains_xy` call.
+    With a grid resolution set, a raster of the land is built as well: cells
+    fully inside or outside answer directly, and only points falling in cells
+    on the boundary are tested against the geometry. Candidates drawn off
+    the land by `sample` are counted in `rejections`.
+    """
+    def __init__(self, available_gdf, resolution=None, batch_size=64, max_batches=10000):
+        self.geometry = shapely.union_all(available_gdf.geometry.values)
+        shapely.prepare(self.geometry)
+        self.bounds = available_gdf.total_bounds
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.rejections = 0
+        self.resolution = None
+        self.grid = None
+
+        if resolution:
+            self.rasterize(resolution)
+
+    def rasterize(self, resolution):
+        """
+        Build the boolean raster of the available land.
+
+        Parameters:
+        resolution (float): Cell size in metres (units of the projected crs).
+        """
+        minx, miny, maxx, maxy = self.bounds
+        nx = max(int(np.ceil((maxx - minx) / resolution)), 1)
+        ny = max(int(np.ceil((maxy - miny) / resolution)), 1)
+
+        x0 = minx + np.arange(nx) * resolution
+        y0 = miny + np.arange(ny) * resolution
+        xx, yy = np.meshgrid(x0, y0)
+        cells = shapely.box(xx, yy, xx + resolution, yy + resolution)
+
+        grid = np.full((ny, nx), OUTSIDE, dtype=np.int8)
+        grid[shapely.intersects(self.geometry, cells)] = BOUNDARY
+        grid[shapely.contains_properly(self.geometry, cells)] = INSIDE
+
+        self.resolution = resolution
+        self.grid = grid
+
+    def contains(self, x, y):
+        """
+        Vectorized point-in-land test.
+
+        Parameters:
+        x, y (np.ndarray): Candidate coordinates in the projected crs.
+
+        Returns:
+        np.ndarray: Boolean mask of the candidates lying on available land.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if self.grid is None:
+            return shapely.contains_xy(self.geometry, x, y)
+
+        ny, nx = self.grid.shape
+        ix = np.floor((x - self.bounds[0]) / self.resolution).astype(np.int64)
+        iy = np.floor((y - self.bounds[1]) / self.resolution).astype(np.int64)
+        in_grid = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+
+        cell = np.full(x.shape, OUTSIDE, dtype=np.int8)
+        cell[in_grid] = self.grid[iy[in_grid], ix[in_grid]]
+
+        result = cell == INSIDE
+        edge = cell == BOUNDARY
+        if edge.any():
+            result[edge] = shapely.contains_xy(self.geometry, x[edge], y[edge])
+        return result
+
+    def sample(self, minx, miny, maxx, maxy, accept=None):
+        """
+        Draw a uniformly distributed feasible position inside a box.
+
+        Candidates are drawn `batch_size` at a time and the first one on
+        available land is returned. The box is clipped to the bounds of the
+        land first, which leaves the distribution unchanged since nothing
+        outside the bounds can be accepted.
+
+        Parameters:
+        accept (callable): Optional extra test called as accept(x, y) on the
+            candidates on available land, in order, until one passes.
+
+        Returns:
+        tuple: (x, y) of the accepted candidate.
+        """
+        minx = max(minx, self.bounds[0])
+        miny = max(miny, self.bounds[1])
+        maxx = min(maxx, self.bounds[2])
+        maxy = min(maxy, self.bounds[3])
+
+        for _ in range(self.max_batches):
+            x = np.random.uniform(minx, maxx, self.batch_size)
+            y = np.random.uniform(miny, maxy, self.batch_size)
+            inside = np.flatnonzero(self.contains(x, y))
+            for k, i in enumerate(inside):
+                if accept is None or accept(x[i], y[i]):
+                    # candidates drawn before this one that were off the land
+                    self.rejections += int(i) - k
+                    return x[i], y[i]
+            self.rejections += self.batch_size - len(inside)
+
+        raise RuntimeError(
+            f"No available land found in box ({minx:.1f}, {miny:.1f}, {maxx:.1f}, {maxy:.1f})"
+        )
+
+    def sample_many(self, n, minx=None, miny=None, maxx=None, maxy=None):
+        """
+        Draw `n` feasible positions, by default over the whole site.
+
+        Returns:
+        np.ndarray: Array of shape (n, 2).
+        """
+        bx0, by0, bx1, by1 = self.bounds
+        minx = bx0 if minx is None else max(minx, bx0)
+        miny = by0 if miny is None else max(miny, by0)
+        maxx = bx1 if maxx is None else min(maxx, bx1)
+        maxy = by1 if maxy is None else min(maxy, by1)
+
+        points = np.empty((0, 2))
+        for _ in range(self.max_batches):
+            x = np.random.uniform(minx, maxx, max(n * 2, self.batch_size))
+            y = np.random.uniform(miny, maxy, max(n * 2, self.batch_size))
+            valid = self.contains(x, y)
+            points = np.vstack([points, np.column_stack([x[valid], y[valid]])])
+            if len(points) >= n:
+                return points[:n]
+
+        raise RuntimeError(f"Could only place {len(points)} of {n} points on the available land")
+
+    def nearest(self, x, y):
+        """
+        The position itself when it lies on available land, the closest point
+        of the land otherwise.
+
+        Returns:
+        tuple: (x, y) of the feasible position.
+        """
+        if self.contains(np.array([x]), np.array([y]))[0]:
+            return x, y
+        point = shapely.shortest_line(self.geometry, shapely.Point(x, y)).coords[0]
+        return point[0], point[1]
+
+
+class SpacingIndex:
+    """
+    Grid hash of a layout for minimum spacing checks.
+
+    The cells are `min_spacing` wide, so any turbine closer than that to a
+    position lies in the 3x3 cells around it and a check looks at a handful
+    of turbines whatever the size of the farm. Checks that fail are counted
+    in `rejections`.
+    """
+    def __init__(self, coords, min_spacing):
+        self.min_spacing = min_spacing
+        self.rejections = 0
+        self.rebuild(coords)
+
+    def cell(self, x, y):
+        return math.floor(x / self.min_spacing), math.floor(y / self.min_spacing)
+
+    def rebuild(self, coords):
+        # plain floats, element access on an array costs more than the check
+        self.points = np.asarray(coords, dtype=float).tolist()
+        self.cells = {}
+        for i, (x, y) in enumerate(self.points):
+            self.cells.setdefault(self.cell(x, y), []).append(i)
+
+    def valid(self, x, y, skip=None):
+        """
+        True when (x, y) is at least `min_spacing` from every turbine of the
+        layout other than `skip`.
+        """
+        cx, cy = self.cell(x, y)
+        limit = self.min_spacing ** 2
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in self.cells.get((cx + dx, cy + dy), ()):
+                    if j == skip:
+                        continue
+                    ox, oy = self.points[j]
+                    if (ox - x) ** 2 + (oy - y) ** 2 < limit:
+                        self.rejections += 1
+                        return False
+        return True
+
+    def spread(self, coords, sample):
+        """
+        Redraw the turbines of `coords` that are too close to an earlier one.
+
+        Parameters:
+        sample (callable): Called as sample(accept) to draw a new position.
+
+        Returns:
+        np.ndarray: The spaced layout.
+        """
+        coords = np.array(coords, dtype=float)
+        self.rebuild(coords[:0])
+        for i in range(len(coords)):
+            if not self.valid(*coords[i]):
+                coords[i] = sample(self.valid)
+            self.points.append(coords[i].tolist())
+            self.cells.setdefault(self.cell(*coords[i]), []).append(i)
+        return coords
@@ -0,0 +1,194 @@
+import glob
+import os
+import queue
+import threading
+import numpy as np
+
+# one column per proposal
+COLUMNS = {
+    "iteration": np.int32,
+    "turbine": np.int32,
+    "lcoe": np.float64,
+    "aep": np.float64,
+    "T": np.float64,
+    "R": np.float64,
+    "accepted": np.bool_,
+}
+
+
+class HistoryRecorder:
+    """
+    Columnar record of every proposal of a run.
+
+    Rows go into preallocated NumPy columns of `chunk_size` rows, accepted
+    layouts are kept as (n, 2) float arrays next to them. A full chunk is
+    handed to a background thread that writes it to `directory` as one npz
+    file (history_000000.npz, ...) and a new chunk is started, so memory
+    stays bounded by two chunks whatever the length of the run. Without a
+    directory the old chunks are dropped. `tail` gives the latest rows for
+    live display.
+    """
+    def __init__(self, directory=None, chunk_size=4096, compress=True):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.total = 0
+        self.previous = None
+        self.queue = None
+        self.writer = None
+        self.error = None
+        self.sequence = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            # continue after the chunks of an earlier (resumed) run
+            self.sequence = len(glob.glob(os.path.join(directory, "history_*.npz")))
+        self.new_chunk()
+
+    def new_chunk(self):
+        self.columns = {name: np.empty(self.chunk_size, dtype) for name, dtype in COLUMNS.items()}
+        self.rows = 0
+        self.layouts = []
+        self.layout_rows = []
+
+    def record(self, iteration, turbine, lcoe, aep, T, R, accepted, layout=None):
+        """
+        Add one proposal. Screened out proposals have no LCOE and AEP, pass
+        NaN. `layout` is copied, pass it for accepted moves.
+        """
+        columns = self.columns
+        row = self.rows
+        columns["iteration"][row] = iteration
+        columns["turbine"][row] = turbine
+        columns["lcoe"][row] = lcoe
+        columns["aep"][row] = aep
+        columns["T"][row] = T
+        columns["R"][row] = R
+        columns["accepted"][row] = accepted
+        if layout is not None:
+            self.layouts.append(np.array(layout, dtype=float))
+            self.layout_rows.append(row)  # row within the chunk
+        self.rows += 1
+        self.total += 1
+        if self.rows == self.chunk_size:
+            self.flush()
+
+    def chunk(self):
+        # the rows recorded so far, columns trimmed to them
+        chunk = {name: column[:self.rows] for name, column in self.columns.items()}
+        sizes = [len(layout) for layout in self.layouts]
+        chunk["layout_rows"] = np.array(self.layout_rows, dtype=np.int64)
+        chunk["layout_offsets"] = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        chunk["layout_coords"] = np.concatenate(self.layouts) if self.layouts else np.empty((0, 2))
+        return chunk
+
+    def flush(self):
+        """
+        Hand the current chunk to the writer and start a new one.
+        """
+        if self.rows == 0:
+            return
+        self.previous = self.chunk()
+        if self.directory is not None:
+            if self.writer is None:
+                self.queue = queue.Queue()
+                self.writer = threading.Thread(target=self.write_chunks, daemon=True)
+                self.writer.start()
+            path = os.path.join(self.directory, f"history_{self.sequence:06d}.npz")
+            self.queue.put((path, self.previous))
+            self.sequence += 1
+        self.new_chunk()
+
+    def write_chunks(self):
+        save = np.savez_compressed if self.compress else np.savez
+        while True:
+            path, chunk = self.queue.get()
+            try:
+                # hidden until complete, readers only glob finished chunks
+                tmp = os.path.join(os.path.dirname(path), "." + os.path.basename(path))
+                save(tmp, **chunk)
+                os.replace(tmp, path)
+            except OSError as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def sync(self):
+        """
+        Write the partial chunk and wait until everything is on disk. The
+        recorder stays usable, checkpoints sync it so that the directory
+        holds exactly the rows recorded up to them.
+        """
+        self.flush()
+        if self.queue is not None:
+            self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """
+        Write what is left at the end of the run.
+        """
+        self.sync()
+
+    def state(self):
+        return {"sequence": self.sequence, "total": self.total}
+
+    def rewind(self, state):
+        """
+        Go back to a synced state: the rows recorded since are dropped and
+        the chunks written after it deleted.
+        """
+        self.sync()
+        if self.directory is not None:
+            for path in glob.glob(os.path.join(self.directory, "history_*.npz")):
+                if int(os.path.basename(path)[8:-4]) >= state["sequence"]:
+                    os.remove(path)
+        self.sequence = state["sequence"]
+        self.total = state["total"]
+        self.previous = None
+        self.new_chunk()
+
+    def tail(self, n=1000):
+        """
+        Returns:
+        dict: The columns of the latest n rows (at most two chunks back).
+        """
+        current = {name: column[:self.rows] for name, column in self.columns.items()}
+        if self.previous is None or self.rows >= n:
+            return {name: column[-n:].copy() for name, column in current.items()}
+        return {
+            name: np.concatenate([self.previous[name], current[name]])[-n:]
+            for name in COLUMNS
+        }
+
+
+def load(directory):
+    """
+    Read back the chunks written by a HistoryRecorder.
+
+    Returns:
+    dict: The columns over the whole run, plus "layouts" (the accepted
+        layouts as (n, 2) arrays) and "layout_rows" (their row in the
+        columns).
+    """
+    paths = sorted(glob.glob(os.path.join(directory, "history_*.npz")))
+    columns = {name: [] for name in COLUMNS}
+    layouts = []
+    layout_rows = []
+    start = 0
+    for path in paths:
+        with np.load(path) as chunk:
+            for name in COLUMNS:
+                columns[name].append(chunk[name])
+            offsets = chunk["layout_offsets"]
+            coords = chunk["layout_coords"]
+            layouts.extend(coords[a:b] for a, b in zip(offsets[:-1], offsets[1:]))
+            layout_rows.append(chunk["layout_rows"] + start)
+            start += len(chunk["lcoe"])
+    result = {
+        name: np.concatenate(parts) if parts else np.empty(0, COLUMNS[name])
+        for name, parts in columns.items()
+    }
+    result["layouts"] = layouts
+    result["layout_rows"] = np.concatenate(layout_rows) if layout_rows else np.empty(0, np.int64)
+    return result
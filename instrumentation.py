@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class Stage:
+    """
+    Timer of one named stage, used as a context manager. Stages are not
+    reentrant: the same stage must not be entered again before it exits.
+    """
+    __slots__ = ("name", "events", "start", "total", "calls")
+
+    def __init__(self, name, events):
+        self.name = name
+        self.events = events
+        self.start = 0.0
+        self.total = 0.0
+        self.calls = 0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = perf_counter() - self.start
+        self.total += elapsed
+        self.calls += 1
+        if self.events is not None:
+            self.events.append((self.name, self.start, elapsed))
+        return False
+
+
+class Instrumentation:
+    """
+    Per-stage timers and counters of an optimization run.
+
+    A stage costs two perf_counter calls and an attribute update, about a
+    microsecond against milliseconds for a FLORIS solve, so it stays on in
+    every run. With `trace_events` set, the last that many timed spans are
+    also kept, in a bounded deque, for a Chrome trace (chrome://tracing or
+    Perfetto). `profiled` wraps a block with cProfile or, when installed,
+    the pyinstrument sampling profiler.
+    """
+    def __init__(self, trace_events=0):
+        self.events = deque(maxlen=trace_events) if trace_events else None
+        self.stages = {}
+        self.counters = {}
+        self.origin = perf_counter()
+        self.profile = None
+
+    def stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage(name, self.events)
+        return stage
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, stages, counters):
+        """
+        Add the timers and counters of another run, such as a replica
+        process. Stage totals add up over processes running in parallel, so
+        they can exceed the wall time of the run.
+
+        Parameters:
+        stages (dict): (total, calls) per stage name.
+        counters (dict): Count per counter name.
+        """
+        for name, (total, calls) in stages.items():
+            stage = self.stage(name)
+            stage.total += total
+            stage.calls += calls
+        for name, n in counters.items():
+            self.count(name, n)
+
+    def report(self):
+        """
+        Returns:
+        dict: Calls, total and mean time of each stage, slowest first, and
+            the counters.
+        """
+        stages = sorted(self.stages.values(), key=lambda s: s.total, reverse=True)
+        return {
+            "stages": {
+                s.name: {"calls": s.calls, "total_s": s.total, "mean_ms": s.total / s.calls * 1000 if s.calls else 0.0}
+                for s in stages
+            },
+            "counters": dict(self.counters),
+        }
+
+    def log_report(self):
+        report = self.report()
+        run = report["stages"].get("run", {}).get("total_s") or 1.0
+        lines = ["Run profile:"]
+        for name, s in report["stages"].items():
+            lines.append(
+                f"  {name:<12} {s['calls']:>8} calls {s['total_s']:>9.3f} s {s['mean_ms']:>9.3f} ms/call"
+                f" {100 * s['total_s'] / run:>6.1f} %"
+            )
+        lines.append("  " + ", ".join(f"{name} {value}" for name, value in report["counters"].items()))
+        logging.info("\n".join(lines))
+
+    def export_trace(self, path):
+        """
+        Write the kept spans as a Chrome trace event file.
+        """
+        pid = os.getpid()
+        events = [
+            {"name": name, "ph": "X", "ts": (start - self.origin) * 1e6, "dur": elapsed * 1e6, "pid": pid, "tid": 0}
+            for name, start, elapsed in (self.events or ())
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.counters}, f)
+
+    @contextmanager
+    def profiled(self, profiler=None):
+        """
+        Run the block under a profiler, kept in self.profile.
+
+        Parameters:
+        profiler (str): None, "cprofile" or "pyinstrument".
+        """
+        if profiler is None:
+            yield
+            return
+        if profiler == "cprofile":
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            try:
+                yield
+            finally:
+                self.profile.disable()
+        elif profiler == "pyinstrument":
+            # optional dependency, only imported when asked for
+            from pyinstrument import Profiler
+            self.profile = Profiler()
+            self.profile.start()
+            try:
+                yield
+            finally:
+                self.profile.stop()
+        else:
+            raise ValueError(f"Unknown profiler {profiler!r}, use 'cprofile' or 'pyinstrument'")
+
+    def save_profile(self, path):
+        """
+        Write the profile of the last `profiled` block, as a pstats file for
+        cProfile or an html report for pyinstrument.
+
+        Returns:
+        str: The file written, None without a profile.
+        """
+        if self.profile is None:
+            return None
+        if hasattr(self.profile, "dump_stats"):
+            path += ".prof"
+            self.profile.dump_stats(path)
+        else:
+            path += ".html"
+            with open(path, "w") as f:
+                f.write(self.profile.output_html())
+        return path
@@ -1,6 +1,7 @@
 import allocator
 import modeling as mdl
 import data_retriever as dr
+import map_render
 import ipywidgets as widgets
 from IPython.display import display, clear_output
 
@@ -157,8 +158,12 @@ class MapInterface:
     def start_clicked(self, b):
         self.iterations = self.iter_slider.value
         self.alc.update_iterations(self.iterations)
-        self.alc.run()
         self.btn_start.disabled = True
+        self.btn_back.disabled = True
+        self.run_thread = map_render.run_in_background(self.alc, on_done=self.run_finished)
+
+    def run_finished(self, alc):
+        self.btn_back.disabled = False
 
 
     def update(self):
@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+from ipyleaflet import Map, CircleMarker, LayerGroup, GeoJSON, Marker, DivIcon
+
+
+class MapRenderer:
+    """
+    Draws an allocator on an ipyleaflet map.
+
+    Registered as an observer of the allocator. Accepted moves are coalesced:
+    the map is redrawn at most every `render_interval_ms`, or every
+    `render_every_n_accepts` accepted moves when that is set, and always once
+    at the end of the run. Turbine markers are created once and moved in
+    place. Runs without a renderer never import ipyleaflet.
+    """
+    def __init__(self, alc, interval_ms=None, every_n_accepts=None):
+        if alc.current_allocations is None:
+            raise RuntimeError("Cannot run this before allocations are initialized")
+
+        config = alc.context.config
+        if interval_ms is None:
+            interval_ms = config.get("render_interval_ms", 250)
+        if every_n_accepts is None:
+            every_n_accepts = config.get("render_every_n_accepts")
+
+        self.alc = alc
+        self.interval = (interval_ms or 0) / 1000
+        self.every_n_accepts = every_n_accepts
+        self.pending_accepts = 0
+        self.labels_stale = False
+        self.last_render = 0.0
+        self.markers = []
+        self.m = Map(center=alc.centroid, zoom=10)
+        self.points_layer = LayerGroup()
+        self.labels_layer = LayerGroup()
+        self.m.add_layer(self.points_layer)
+        self.m.add_layer(self.labels_layer)
+
+        icon = DivIcon(html=(f'Press the "Start" button to start.<br>'
+                             f'Red dots represent each turbine.<br>'
+                             f'Each iteration consists of moving each turbine.<br>'
+                             f'Each move can be accepted or rejected.<br>'
+                             f'When accepted it shows on the map.<br>'
+                             ), icon_size=[250, 100])
+
+        self.label_marker = Marker(location=(alc.maxy+0.025, alc.centroid[1]), icon=icon, draggable=True)
+
+        self.labels_layer.add_layer(self.label_marker)
+
+        self.update_points()
+
+        geo_json_data = json.loads(alc.available_gdf.to_crs(epsg=4326).to_json())
+        geo_json_layer = GeoJSON(data=geo_json_data, style={
+            "color": "blue",
+            "opacity": 1,
+            "fillColor": "blue",
+            "fillOpacity": 0.3
+        })
+        self.m.add_layer(geo_json_layer)
+
+    def on_accept(self, alc):
+        self.pending_accepts += 1
+        self.labels_stale = True
+        if self.due():
+            self.render()
+
+    def on_iteration(self, alc):
+        self.labels_stale = True
+        if self.due():
+            self.render()
+
+    def on_layout(self, alc):
+        self.update_points()
+
+    def on_finish(self, alc):
+        self.render()
+
+    def due(self):
+        if self.every_n_accepts:
+            return self.pending_accepts >= self.every_n_accepts
+        return time.monotonic() - self.last_render >= self.interval
+
+    def render(self):
+        if self.pending_accepts:
+            self.update_points()
+        if self.labels_stale:
+            self.update_labels()
+        self.pending_accepts = 0
+        self.labels_stale = False
+        self.last_render = time.monotonic()
+
+    def update_points(self):
+        points = self.alc.transform_points()
+        # move the existing markers, only add or drop the difference
+        for marker, point in zip(self.markers, points):
+            marker.location = (point[1], point[0])  # ipyleaflet expects (lat, lon)
+        for point in points[len(self.markers):]:
+            marker = CircleMarker(location=(point[1], point[0]), radius=2, color="red", fill_color="red")
+            self.points_layer.add_layer(marker)
+            self.markers.append(marker)
+        for marker in self.markers[len(points):]:
+            self.points_layer.remove_layer(marker)
+        del self.markers[len(points):]
+
+    def update_labels(self):
+        sa = self.alc.sa
+        self.label_marker.icon = DivIcon(
+            html=(
+            f'min LCOE: {sa.min_LCOE:.3f} ct/kWh<br>'
+            f'max AEP: {sa.max_AEP/1e6:.3f} MWh<br>'
+            f'iteration: {self.alc.iter}/{self.alc.iterations}<br>'
+            f"latest LCOE: {sa.lcoe_hist[-1]:.3f} ct/kWh" if sa.lcoe_hist else ""
+            ),
+            icon_size=[170, 75]
+        )
+
+
+def run_in_background(alc, on_done=None):
+    """
+    Run the optimization of `alc` in a daemon thread so the notebook kernel
+    stays responsive while the map updates.
+
+    Parameters:
+    alc (allocator.Allocator): Allocator to run.
+    on_done (callable): Optional callback called with the allocator when the run ends.
+
+    Returns:
+    threading.Thread: The started thread.
+    """
+    def target():
+        try:
+            alc.run()
+        finally:
+            if on_done is not None:
+                on_done(alc)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
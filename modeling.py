@@ -2,12 +2,16 @@ import data_retriever as dr
 import numpy as np
 from floris import (
     FlorisModel,
-    TimeSeries,
     WindRose,
 )
 import pandas as pd
-import yaml
+import context as ctx
 import logging
+import os
+import hashlib
+import pickle
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 
 logging.basicConfig(
@@ -15,14 +19,51 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
+
+# wind roses already built in this process, see ModelData.wind_rose
+WIND_ROSE_CACHE_SIZE = 32
+_wind_rose_cache = OrderedDict()
+
+
+def wind_rose_from_series(wind_speed, wind_direction, ws_resolution, wd_resolution, turbulence_intensity):
+    """
+    Bin hourly speed/direction series straight into a WindRose.
+
+    Both series are rounded to their resolution (360 degrees folds onto 0)
+    and the frequency table is counted with one bincount over the flat bin
+    index, without going through pandas or a TimeSeries.
+
+    Returns:
+    WindRose: The wind rose, with zero frequency bins skipped by FLORIS.
+    """
+    valid = np.isfinite(wind_speed) & np.isfinite(wind_direction)
+    wind_speed = wind_speed[valid]
+    wind_direction = wind_direction[valid]
+
+    ws_idx = np.rint(wind_speed / ws_resolution).astype(np.int64)
+    wd_bin = np.rint(wind_direction / wd_resolution) * wd_resolution
+    wd_bin[wd_bin == 360] = 0
+    wd_idx = np.rint(wd_bin / wd_resolution).astype(np.int64)
+
+    ws_min = ws_idx.min()
+    n_ws = ws_idx.max() - ws_min + 1
+    n_wd = wd_idx.max() + 1
+    counts = np.bincount(wd_idx * n_ws + (ws_idx - ws_min), minlength=n_wd * n_ws)
+
+    wind_directions = np.arange(n_wd) * float(wd_resolution)
+    wind_speeds = (np.arange(n_ws) + ws_min) * float(ws_resolution)
+    freq_table = counts.reshape(n_wd, n_ws) / counts.sum()
+
+    return WindRose(wind_directions, wind_speeds, float(turbulence_intensity), freq_table)
+
 class ModelData:
-    def __init__(self, weather_retriever: dr.WeatherRetriever):
+    def __init__(self, weather_retriever: dr.WeatherRetriever, context: ctx.RunContext = None):
         self.weather_retriever = weather_retriever
+        self.context = context if context is not None else weather_retriever.context
         self.weather = weather_retriever.weather
         self.wr = None
 
-        with open("config.yml", "r") as f:
-            config = yaml.safe_load(f)
+        config = self.context.config
 
         self.no_of_turbines = config.get("number_of_turbines")
         self.turbulence_intensity = config.get("turbulence_intensity")
@@ -31,60 +72,68 @@ class ModelData:
         self.alpha = config.get("wind_shear")
         self.ws_resolution = config.get("wind_speed_resolution")
         self.wd_resolution = config.get("wind_direction_resolution")
+        self.weather_years = config.get("weather_years", 2023)
 
         self.wind_rose()
 
-    def wind_rose(self, year = 2023):
+    def wind_rose(self, year = None):
         """
         generate a wind rose from the weather data.
         
         Parameters:
-        df (pd.DataFrame): A DataFrame containing the weather data.
+        year (int or iterable): Weather year(s) to retrieve when no weather
+            is loaded yet, defaults to weather_years from the config.
 
         Returns:
         WindRose: A WindRose object.
         """
         if self.weather is None:
+            if year is None:
+                year = self.weather_years
             self.weather_retriever.retrieve_weather(year)
             self.weather = self.weather_retriever.weather
         
-        df = self.weather.copy()
-        df["wind_speed_100m"] = df["wind_speed_100m"].clip(upper=30)
-        df["wind_speed_100m"] = df["wind_speed_100m"] * (self.target_height / self.reference_height) ** self.alpha
-        df["ws"] = (df["wind_speed_100m"] / self.ws_resolution).round() * self.ws_resolution
-        df["wd"] = (df["wind_direction_100m"] / self.wd_resolution).round() * self.wd_resolution
-        df["wd"] = df["wd"].replace(360, 0)
-        dff = df[['ws', 'wd']]
-        dff = dff.groupby(['ws', 'wd']).value_counts().reset_index()
-        dff['freq_val'] = dff['count']/dff['count'].sum()
-        dff.drop('count', axis = 1, inplace=True)
-        self.frequency_df = dff
-        
+        self.wr = self.wind_rose_at(self.wd_resolution, self.ws_resolution)
 
-        # sum all the freq ov over 30 and add them to 30 (or last entry, more robust)
-        # extra = dff.loc[df["ws"] > 30].groupby("wd")["freq_val"].sum()
-        # dff = dff[dff["ws"] <= 30]
-        # dff.loc[dff.index[-1], "freq_val"] += extra
-        # set all ws above 30 as 30 in the weather file from the beginning
+        mask = self.wr.freq_table > 0
+        wd_grid, ws_grid = np.meshgrid(self.wr.wind_directions, self.wr.wind_speeds, indexing="ij")
+        self.frequency_df = pd.DataFrame({
+            "ws": ws_grid[mask],
+            "wd": wd_grid[mask],
+            "freq_val": self.wr.freq_table[mask],
+        }).sort_values(["ws", "wd"], ignore_index=True)
+        self.dff = self.frequency_df # for debugging
 
-        self.dff = dff # for debugging
+        return self.wr
+        
+    def wind_rose_at(self, wd_resolution, ws_resolution):
+        """
+        Wind rose of the loaded weather at the given resolutions.
 
-        wd = dff['wd'].values
-        ws = dff['ws'].values
-        freq = dff['freq_val'].values
+        Returns:
+        WindRose: The (possibly cached) wind rose.
+        """
+        wind_speed = self.weather["wind_speed_100m"].to_numpy(dtype=float)
+        wind_direction = self.weather["wind_direction_100m"].to_numpy(dtype=float)
 
-        unique_wd = np.unique(wd)
-        unique_ws = np.unique(ws)
+        # keyed by the series themselves, which stand for the site and years
+        digest = hashlib.sha1(wind_speed.tobytes() + wind_direction.tobytes()).hexdigest()
+        key = (digest, ws_resolution, wd_resolution, self.alpha,
+               self.target_height, self.reference_height, self.turbulence_intensity)
 
-        wd_step = unique_wd[1] - unique_wd[0]
-        ws_step = unique_ws[1] - unique_ws[0]
+        if key in _wind_rose_cache:
+            _wind_rose_cache.move_to_end(key)
+            return _wind_rose_cache[key]
 
-        time_series = TimeSeries(wd, ws, self.turbulence_intensity)
+        # set all ws above 30 as 30 before shearing to hub height
+        wind_speed = np.minimum(wind_speed, 30) * (self.target_height / self.reference_height) ** self.alpha
+        wr = wind_rose_from_series(wind_speed, wind_direction, ws_resolution,
+                                   wd_resolution, self.turbulence_intensity)
+        _wind_rose_cache[key] = wr
+        if len(_wind_rose_cache) > WIND_ROSE_CACHE_SIZE:
+            _wind_rose_cache.popitem(last=False)
+        return wr
 
-        self.wr = time_series.to_WindRose(wd_step=wd_step, ws_step=ws_step, bin_weights=freq)
-        
-        #self.plot_wind_rose()
-        
     def plot_wind_rose(self):
         if not self.wr:
             raise ValueError("Wind rose not generated yet. Call wind_rose() first.")
@@ -92,14 +141,281 @@ class ModelData:
         self.wr.plot()
 
 
+class LayoutCache:
+    """
+    Bounded LRU map from layouts to their [AEP, no-wake AEP].
+
+    Keys are the turbine coordinates quantized to `resolution` metres and
+    sorted, so layouts that only differ by turbine order or by less than the
+    resolution share an entry, prefixed with a digest of the wind rose and
+    model they were computed with. The cache can be saved to and loaded from
+    a pickle file.
+    """
+    def __init__(self, maxsize=4096, resolution=1.0, path=None):
+        self.maxsize = maxsize
+        self.resolution = resolution
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def key(self, prefix, positions):
+        q = np.rint(positions / self.resolution).astype(np.int64)
+        q = q[np.lexsort((q[:, 1], q[:, 0]))]
+        return prefix + q.tobytes()
+
+    def get(self, key, field):
+        """
+        Cached value of `field` (0 for AEP, 1 for no-wake AEP), None on a miss.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[field] is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[field]
+
+    def put(self, key, field, value):
+        if not self.maxsize:
+            return
+        entry = self.entries.setdefault(key, [None, None])
+        entry[field] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def save(self, path=None):
+        path = path or self.path
+        with open(path, "wb") as f:
+            pickle.dump((self.resolution, self.entries), f)
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            resolution, entries = pickle.load(f)
+        if resolution == self.resolution:
+            self.entries.update(entries)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def info(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.entries),
+        }
+
+
+class IncrementalAEP:
+    """
+    AEP of single-turbine moves from the turbine powers of a nearby layout.
+
+    The powers of every turbine in every wind condition are kept for the last
+    few solved layouts (the bases). When a layout differs from a base in one
+    turbine, only the wind directions in which that turbine, at its old or new
+    position, wakes or is waked by another turbine are solved again, and only
+    for the turbines downstream of it plus everything upstream of those. The
+    wake is taken as a cone of half width `margin` rotor diameters plus
+    `spread` times the downstream distance, up to `length` rotor diameters
+    downstream. Every `validate_every` updates the result is checked against
+    a full solve, which is then returned instead.
+
+    With `depth` set, changes are only followed that many wakes downstream of
+    the moved turbine (and their inflow that many wakes upstream), which is
+    what keeps the re-solved set small in large farms. Results are
+    approximate either way: `depth=None` lifts the depth limit, but wakes
+    outside the cone are still ignored, relative errors around 1e-3 remain
+    on the default site. `exact` tells whether the last result came from a
+    full solve. A move whose re-solved set costs nearly as much as the whole
+    farm falls back to a full solve, which is most moves in farms of a few
+    tens of turbines: the savings come with large farms.
+    """
+    def __init__(self, floris, wr, rotor_diameter, margin=2.0, spread=0.1, length=30.0,
+                 depth=1, tolerance=1e-3, validate_every=50, max_bases=8):
+        self.floris = floris.copy()
+        self.rotor_diameter = rotor_diameter
+        self.margin = margin
+        self.spread = spread
+        self.length = length
+        self.depth = depth
+        self.tolerance = tolerance
+        self.validate_every = validate_every
+        self.max_bases = max_bases
+        self.updates = 0
+        self.full_runs = 0
+        self.failures = 0
+        self.max_error = 0.0
+        self.exact = False
+        self.reset(wr)
+
+    def reset(self, wr):
+        """
+        Use a new wind rose and forget the bases.
+        """
+        self.wd, self.ws, self.ti, self.freq = wr.unpack()[:4]
+        self.directions = np.unique(self.wd)
+        self.bases = OrderedDict()
+
+    def solve(self, coords, idx=None):
+        """
+        Turbine powers in W of shape (conditions, turbines).
+        """
+        if idx is None:
+            idx = slice(None)
+        self.floris.set(
+            wind_directions = self.wd[idx],
+            wind_speeds = self.ws[idx],
+            turbulence_intensities = self.ti[idx],
+            layout_x = coords[:, 0],
+            layout_y = coords[:, 1],
+        )
+        self.floris.run()
+        return self.floris.get_turbine_powers()
+
+    def aep(self, powers):
+        return float(np.nansum(self.freq * powers.sum(axis=1)) * 8760)
+
+    def influence(self, coords):
+        """
+        [d, i, j] is True when turbine i wakes turbine j for direction d.
+        """
+        # meteorological convention, wind from 270 blows along +x
+        theta = np.deg2rad(270.0 - self.directions)[:, None, None]
+        dx = coords[None, :, 0] - coords[:, None, 0]
+        dy = coords[None, :, 1] - coords[:, None, 1]
+        downstream = dx * np.cos(theta) + dy * np.sin(theta)
+        lateral = np.abs(-dx * np.sin(theta) + dy * np.cos(theta))
+        D = self.rotor_diameter
+        return (
+            (downstream > 0) & (downstream < self.length * D)
+            & (lateral < self.margin * D + self.spread * downstream)
+        )
+
+    def run(self, coords):
+        """
+        Returns:
+        float: The AEP of the layout in Wh.
+        """
+        base = self.find_base(coords)
+        if base is None:
+            return self.run_full(coords)
+
+        (base_coords, base_powers), k = base
+        powers = self.update(coords, base_coords, base_powers, k)
+        if powers is None:
+            return self.run_full(coords)
+
+        aep = self.aep(powers)
+        self.updates += 1
+        if self.validate_every and self.updates % self.validate_every == 0:
+            full = self.run_full(coords)
+            error = abs(aep - full) / full
+            self.max_error = max(self.max_error, error)
+            if error > self.tolerance:
+                self.failures += 1
+                logging.warning(f"Incremental AEP off by {error:.2e} (tolerance {self.tolerance:.1e}), using the full solve")
+            return full
+        self.add_base(coords, powers)
+        self.exact = False
+        return aep
+
+    def run_full(self, coords):
+        powers = self.solve(coords)
+        self.full_runs += 1
+        self.add_base(coords, powers)
+        self.exact = True
+        return self.aep(powers)
+
+    def find_base(self, coords):
+        for base_coords, base_powers in reversed(self.bases.values()):
+            if base_coords.shape != coords.shape:
+                continue
+            moved = np.flatnonzero(np.any(base_coords != coords, axis=1))
+            if len(moved) == 1:
+                return (base_coords, base_powers), moved[0]
+        return None
+
+    def add_base(self, coords, powers):
+        coords = np.array(coords, dtype=float)
+        self.bases[coords.tobytes()] = (coords, powers)
+        self.bases.move_to_end(coords.tobytes())
+        while len(self.bases) > self.max_bases:
+            self.bases.popitem(last=False)
+
+    def update(self, coords, base_coords, base_powers, k):
+        """
+        Turbine powers of `coords` from those of `base_coords`, which differ
+        in turbine `k` only. None when every turbine needs solving anyway.
+        """
+        n = len(coords)
+        # the old position of k is appended as turbine n
+        waking = self.influence(np.vstack([coords, base_coords[k]]))
+        waking[:, k, n] = waking[:, n, k] = False
+        waked_k = waking[:, :, k].any(axis=1) | waking[:, :, n].any(axis=1)
+
+        # turbines downstream of k at either position see a different inflow
+        changed = np.zeros((len(self.directions), n + 1), dtype=bool)
+        changed[:, [k, n]] = True
+        waking[:, :, n] = False
+        changed = self.closure(changed, waking, self.depth)
+        changed[:, n] = False
+        # their inflow also depends on every turbine upstream of them
+        waking[:, n, :] = False
+        needed = self.closure(changed, waking.transpose(0, 2, 1), self.depth)[:, :n]
+        changed = changed[:, :n]
+
+        # a lone turbine in free stream at both positions keeps its power
+        affected = (changed.sum(axis=1) > 1) | waked_k
+        if not affected.any():
+            return base_powers.copy()
+
+        # one solve over all affected directions, as resetting the model
+        # costs more than solving a few extra turbines
+        subset = np.flatnonzero(needed[affected].any(axis=0))
+        rows = np.flatnonzero(np.isin(self.wd, self.directions[affected]))
+        if len(rows) * len(subset) ** 2 >= 0.8 * len(self.wd) * n ** 2:
+            return None
+        sub_powers = self.solve(coords[subset], rows)
+        column = np.full(n, -1)
+        column[subset] = np.arange(len(subset))
+
+        # turbines outside the needed set of a direction are not upstream of
+        # its changed turbines, so they do not disturb their powers
+        powers = base_powers.copy()
+        direction_of_row = np.searchsorted(self.directions, self.wd[rows])
+        for d in np.flatnonzero(affected):
+            local = np.flatnonzero(direction_of_row == d)
+            turbines = np.flatnonzero(changed[d])
+            powers[np.ix_(rows[local], turbines)] = sub_powers[np.ix_(local, column[turbines])]
+        return powers
+
+    @staticmethod
+    def closure(reached, edges, depth=None):
+        # grow the reached turbines along the edges, `depth` times or until nothing changes
+        edges = edges.astype(np.int32)
+        step = 0
+        while depth is None or step < depth:
+            grown = reached | (np.einsum("di,dij->dj", reached.astype(np.int32), edges) > 0)
+            if (grown == reached).all():
+                break
+            reached = grown
+            step += 1
+        return reached
+
+
 class FarmModel:
-    def __init__(self, data_manipulator: ModelData = None, no_of_turbines: int = None):
+    def __init__(self, data_manipulator: ModelData = None, no_of_turbines: int = None, context: ctx.RunContext = None):
         self.data_manipulator = data_manipulator
+        self.context = context if context is not None else data_manipulator.context
         self.wr = data_manipulator.wr
         self.floris = None
 
-        with open("config.yml", "r") as f:
-            config = yaml.safe_load(f)
+        config = self.context.config
 
         self.model_file = config.get("floris_model_file")
         if no_of_turbines is not None:
@@ -107,35 +423,207 @@ class FarmModel:
         else:
             self.no_of_turbines = config.get("number_of_turbines")
 
+        self.cache = LayoutCache(
+            maxsize = config.get("layout_cache_size", 4096),
+            resolution = config.get("layout_cache_resolution", 1.0),
+            path = config.get("layout_cache_file"),
+        )
+        self.positions = None
+        self.key = None
+        self.layout_set = False
+        # model solves, cache hits excluded
+        self.floris_runs = 0
+        self.incremental = None
+
         self.setup_floris()
 
+        if config.get("incremental_aep", False):
+            self.incremental = IncrementalAEP(
+                self.floris, self.wr, self.rotor_diameter,
+                margin = config.get("incremental_wake_margin", 2.0),
+                spread = config.get("incremental_wake_spread", 0.1),
+                length = config.get("incremental_wake_length", 30.0),
+                depth = config.get("incremental_depth", 1),
+                tolerance = config.get("incremental_tolerance", 1e-3),
+                validate_every = config.get("incremental_validate_every", 50),
+            )
+
     def setup_floris(self):
         if not self.wr:
             raise ValueError("Wind rose not generated yet. run setup_floris() after getting wind rose.")
 
         self.floris = FlorisModel(self.model_file)
         self.floris.set(wind_data = self.wr)
+        self.turbine = self.floris.core.farm.turbine_definitions[0]
+        self.rotor_diameter = self.turbine["rotor_diameter"]
+        self.set_cache_prefix()
 
         floris_logger = logging.getLogger("floris.floris_model.FlorisModel")
         floris_logger.setLevel(logging.ERROR)
 
-    
-    def new_run(self, positions):
-        xs = [p.x for p in positions]
-        ys = [p.y for p in positions]
-        self.floris.set(layout_x = xs, layout_y= ys)
+    def set_wind_rose(self, wr):
+        """
+        Swap the wind rose used by the FLORIS model, keeping the layout.
+        """
+        self.wr = wr
+        self.floris.set(wind_data = self.wr)
+        self.set_cache_prefix()
+        if self.incremental is not None:
+            self.incremental.reset(self.wr)
+
+    def set_cache_prefix(self):
+        # cached results are only valid for the same model and wind rose
+        digest = hashlib.sha1(str(self.model_file).encode())
+        for table in (self.wr.wind_directions, self.wr.wind_speeds, self.wr.freq_table, self.wr.ti_table):
+            digest.update(np.ascontiguousarray(table, dtype=float).tobytes())
+        self.cache_prefix = digest.digest()
+
+    def new_run(self, positions, exact=False):
+        """
+        Parameters:
+        positions (np.ndarray): Turbine x, y in metres, shape (n, 2).
+        exact (bool): Solve the whole farm, never use the incremental AEP.
+        """
+        # own copy, the allocator keeps moving turbines of its layout
+        self.positions = np.array(positions, dtype=float)
+        self.key = self.cache.key(self.cache_prefix, positions)
+        self.layout_set = False
+        if self.cache.get(self.key, 0) is not None:
+            self.aep = self.cache.entries[self.key][0]
+            return
+        if self.incremental is not None and not exact:
+            # incremental AEPs are approximate, cached apart from the full solves
+            approximate = b"~" + self.key
+            if approximate in self.cache.entries:
+                self.aep = self.cache.entries[approximate][0]
+                self.cache.entries.move_to_end(approximate)
+                return
+            self.floris_runs += 1
+            self.aep = self.incremental.run(self.positions)
+            self.cache.put(self.key if self.incremental.exact else approximate, 0, self.aep)
+            return
+        self.floris_runs += 1
+        self.set_layout()
+        self.floris.run()
+        self.aep = self.floris.get_farm_AEP()
+        self.cache.put(self.key, 0, self.aep)
+
+    def solve(self, positions):
+        """
+        AEP in Wh of a full solve of the layout, bypassing the cache.
+        """
+        self.floris_runs += 1
+        self.floris.set(layout_x = positions[:, 0], layout_y = positions[:, 1])
+        self.layout_set = False  # the model no longer holds self.positions
         self.floris.run()
+        return self.floris.get_farm_AEP()
+
+    def set_layout(self):
+        if not self.layout_set:
+            self.floris.set(layout_x = self.positions[:, 0], layout_y = self.positions[:, 1])
+            self.layout_set = True
 
 
     def get_aep(self):
-        return self.floris.get_farm_AEP()
+        return self.aep
 
     def get_aep_without_wake(self):
-        self.floris.run_no_wake()
-        return self.floris.get_farm_AEP()
+        aep_no_wake = self.cache.get(self.key, 1)
+        if aep_no_wake is None:
+            self.floris_runs += 1
+            self.set_layout()
+            self.floris.run_no_wake()
+            aep_no_wake = self.floris.get_farm_AEP()
+            self.cache.put(self.key, 1, aep_no_wake)
+        return aep_no_wake
     
     def get_wake_losses(self, allocations):
-        self.new_run(allocations)
+        self.new_run(allocations, exact=True)
         aep = self.get_aep()
         aep_no_wake = self.get_aep_without_wake()
         return (aep_no_wake - aep) / aep_no_wake * 100
+
+
+# one FlorisModel per worker process, set up once by the pool initializer
+_worker_floris = None
+
+
+def _init_worker(model_file, wr):
+    global _worker_floris
+    _worker_floris = FlorisModel(model_file)
+    _worker_floris.set(wind_data = wr)
+    logging.getLogger("floris.floris_model.FlorisModel").setLevel(logging.ERROR)
+
+
+def _worker_aep(xs, ys):
+    _worker_floris.set(layout_x = xs, layout_y = ys)
+    _worker_floris.run()
+    return _worker_floris.get_farm_AEP()
+
+
+class BatchEvaluator:
+    """
+    Evaluates the AEP of a batch of candidate layouts in one pass.
+
+    Each worker process owns its own FlorisModel with the wind rose of the
+    farm model, so the K layouts of a batch are solved concurrently. With a
+    single worker the batch is run through the farm model itself. With
+    `cached` off every layout gets a full solve, for callers moving
+    turbines by less than the cache resolution.
+    """
+    def __init__(self, fm: FarmModel, workers: int = None, cached: bool = True):
+        self.fm = fm
+        self.cached = cached
+        self.workers = workers if workers else os.cpu_count()
+        self.pool = None
+
+        if self.workers > 1:
+            self.pool = ProcessPoolExecutor(
+                max_workers = self.workers,
+                initializer = _init_worker,
+                initargs = (fm.model_file, fm.wr),
+            )
+
+    def evaluate(self, layouts):
+        """
+        Parameters:
+        layouts (list): Candidate layouts, each an (n, 2) array of x, y.
+
+        Returns:
+        np.ndarray: The AEP of each layout in Wh.
+        """
+        if self.pool is None:
+            aeps = []
+            for positions in layouts:
+                if self.cached:
+                    self.fm.new_run(positions)
+                    aeps.append(self.fm.get_aep())
+                else:
+                    aeps.append(self.fm.solve(positions))
+            return np.array(aeps)
+
+        if not self.cached:
+            self.fm.floris_runs += len(layouts)
+            xs = [positions[:, 0] for positions in layouts]
+            ys = [positions[:, 1] for positions in layouts]
+            return np.array(list(self.pool.map(_worker_aep, xs, ys)))
+
+        # only layouts missing from the farm model cache go to the workers
+        cache = self.fm.cache
+        keys = [cache.key(self.fm.cache_prefix, positions) for positions in layouts]
+        aeps = np.array([cache.get(key, 0) for key in keys], dtype=float)
+        todo = [i for i, aep in enumerate(aeps) if np.isnan(aep)]
+
+        xs = [layouts[i][:, 0] for i in todo]
+        ys = [layouts[i][:, 1] for i in todo]
+        self.fm.floris_runs += len(todo)
+        for i, aep in zip(todo, self.pool.map(_worker_aep, xs, ys)):
+            aeps[i] = aep
+            cache.put(keys[i], 0, aep)
+        return aeps
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
@@ -0,0 +1,186 @@
+import logging
+import multiprocessing as mp
+import numpy as np
+import allocator
+import modeling as mdl
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+# seconds a replica gets to exit after "stop" before it is terminated
+JOIN_TIMEOUT = 10
+
+
+def _replica_main(conn, data_retriever, no_of_turbines, iterations, T, seed):
+    """
+    Replica process: owns its ModelData, FarmModel, Allocator and annealer
+    and serves commands from the coordinator until told to stop.
+    """
+    np.random.seed(seed)
+    md = mdl.ModelData(data_retriever)
+    fm = mdl.FarmModel(md, no_of_turbines=no_of_turbines)
+    alc = allocator.Allocator(data_retriever, fm)
+    alc.detach_outputs()
+    # same schedule as the parent run, the cooling only depends on T_final / T
+    alc.update_iterations(iterations)
+    alc.sa.T = T
+    alc.sa.T_final = alc.sa.T_final * T
+
+    while True:
+        command, arg = conn.recv()
+        if command == "run":
+            for _ in range(arg):
+                if alc.iter >= alc.iterations:
+                    break
+                alc.run_iteration(alc.iter)
+            conn.send((alc.sa.prev_LCOE, alc.current_allocations, alc.sa.T))
+        elif command == "set":
+            # layouts move between replicas, temperatures stay
+            alc.sa.prev_LCOE, allocations = arg
+            alc.accept_allocations(allocations)
+        elif command == "result":
+            sa = alc.sa
+            conn.send({
+                "min_LCOE": sa.min_LCOE,
+                "min_LCOE_alloc": sa.min_LCOE_alloc,
+                "aep_at_min_lcoe": sa.aep_at_min_lcoe,
+                "max_AEP": sa.max_AEP,
+                "max_AEP_alloc": sa.max_AEP_alloc,
+                "lcoe_hist": sa.lcoe_hist,
+                "aep_hist": sa.aep_hist,
+                "stages": {name: (stage.total, stage.calls) for name, stage in alc.stats.stages.items()},
+                "counters": alc.stats.counters,
+                # kept by the components, see Allocator.collect_counters
+                "floris_runs": fm.floris_runs,
+                "cache_hits": fm.cache.hits,
+                "cache_misses": fm.cache.misses,
+                "infeasible": alc.feasibility.rejections,
+                "too_close": alc.spacing.rejections if alc.spacing is not None else 0,
+            })
+        elif command == "stop":
+            break
+    conn.close()
+
+
+class ParallelTempering:
+    """
+    Replica exchange annealing over several processes.
+
+    Each replica runs its own chain with a start temperature `ratio` times
+    the one below it. Every `swap_interval` iterations neighbouring replicas
+    exchange their current layouts with the usual Metropolis criterion on
+    (E_i - E_j) * (1/T_i - 1/T_j). Without a swap interval the replicas are
+    independent multi-start chains. The best layouts of all replicas are
+    merged into the annealer of the parent allocator.
+    """
+    def __init__(self, alc: allocator.Allocator):
+        self.alc = alc
+        self.replicas = alc.replicas
+        self.swap_interval = alc.swap_interval
+        self.iterations = alc.iterations
+        T0 = alc.sa.T
+        self.temperatures = [T0 * alc.replica_temperature_ratio ** k for k in range(self.replicas)]
+        self.swaps_proposed = 0
+        self.swaps_accepted = 0
+
+    def run(self):
+        conns = []
+        processes = []
+        seeds = np.random.randint(0, 2**31 - 1, self.replicas)
+        for T, seed in zip(self.temperatures, seeds):
+            parent, child = mp.Pipe()
+            process = mp.Process(
+                target=_replica_main,
+                args=(child, self.alc.data_retriever, self.alc.no_of_turbines, self.iterations, T, int(seed)),
+                daemon=True,
+            )
+            process.start()
+            conns.append(parent)
+            processes.append(process)
+
+        try:
+            interval = self.swap_interval or self.iterations
+            done = 0
+            offset = 0
+            while done < self.iterations:
+                steps = min(interval, self.iterations - done)
+                for conn in conns:
+                    conn.send(("run", steps))
+                states = [conn.recv() for conn in conns]
+                done += steps
+
+                if self.swap_interval and done < self.iterations:
+                    states = self.exchange(states, offset)
+                    offset = 1 - offset
+                    for conn, (E, allocations, _) in zip(conns, states):
+                        conn.send(("set", (E, allocations)))
+
+                self.alc.iter = done
+                self.alc.notify("on_iteration")
+
+            for conn in conns:
+                conn.send(("result", None))
+            results = [conn.recv() for conn in conns]
+        finally:
+            for conn in conns:
+                try:
+                    conn.send(("stop", None))
+                except (BrokenPipeError, EOFError):
+                    pass  # the replica is gone already
+            for process in processes:
+                process.join(timeout=JOIN_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+
+        self.merge(results)
+        if self.swap_interval:
+            logging.info(f"Replica swaps accepted: {self.swaps_accepted}/{self.swaps_proposed}")
+        return results
+
+    def exchange(self, states, offset):
+        # alternate between even and odd neighbour pairs so every pair gets a chance
+        states = list(states)
+        # current temperatures, the replicas have been cooling since their start
+        temperatures = [T for _, _, T in states]
+        for i in range(offset, self.replicas - 1, 2):
+            j = i + 1
+            E_i, E_j = states[i][0], states[j][0]
+            T_i, T_j = temperatures[i], temperatures[j]
+            self.swaps_proposed += 1
+            if np.random.uniform() < np.exp(min(0.0, (E_i - E_j) * (1 / T_i - 1 / T_j))):
+                # swap the layouts, each replica keeps its temperature
+                states[i], states[j] = (E_j, states[j][1], T_i), (E_i, states[i][1], T_j)
+                self.swaps_accepted += 1
+        return states
+
+    def merge(self, results):
+        sa = self.alc.sa
+        best_lcoe = min(results, key=lambda r: r["min_LCOE"])
+        best_aep = max(results, key=lambda r: r["max_AEP"])
+
+        sa.min_LCOE = best_lcoe["min_LCOE"]
+        sa.min_LCOE_alloc = best_lcoe["min_LCOE_alloc"]
+        sa.aep_at_min_lcoe = best_lcoe["aep_at_min_lcoe"]
+        sa.min_LCOE_hist.append(sa.min_LCOE)
+        sa.max_AEP = best_aep["max_AEP"]
+        sa.max_AEP_alloc = best_aep["max_AEP_alloc"]
+        sa.max_AEP_hist.append(sa.max_AEP)
+        alc = self.alc
+        for r in results:
+            sa.lcoe_hist.extend(r["lcoe_hist"])
+            sa.aep_hist.extend(r["aep_hist"])
+            alc.stats.merge(r["stages"], r["counters"])
+            # the run report reads these from the components of the parent
+            alc.fm.floris_runs += r["floris_runs"]
+            alc.fm.cache.hits += r["cache_hits"]
+            alc.fm.cache.misses += r["cache_misses"]
+            alc.feasibility.rejections += r["infeasible"]
+            if alc.spacing is not None:
+                alc.spacing.rejections += r["too_close"]
+
+        alc.accept_allocations(sa.min_LCOE_alloc.copy())
+        alc.notify("on_accept")
+        logging.info(f"Merged {self.replicas} replicas, min_LCOE: {sa.min_LCOE}")
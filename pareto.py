@@ -0,0 +1,159 @@
+import logging
+import numpy as np
+import pandas as pd
+import feasibility
+import modeling as mdl
+
+
+class ParetoArchive:
+    """
+    Non-dominated layouts for minimal LCOE and maximal AEP.
+
+    Each entry holds the layout with its LCOE, AEP, wake losses and cable
+    length. When the archive grows beyond `maxsize`, the most crowded entry
+    (smallest crowding distance, the ends of the front are never dropped) is
+    removed, so the front stays spread out.
+    """
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self.entries = []
+
+    @staticmethod
+    def dominates(a, b):
+        # a and b are (lcoe, aep)
+        return a[0] <= b[0] and a[1] >= b[1] and (a[0] < b[0] or a[1] > b[1])
+
+    def add(self, layout, lcoe, aep, wake_losses, cable_length):
+        """
+        Returns:
+        bool: True when the layout entered the archive.
+        """
+        point = (lcoe, aep)
+        for entry in self.entries:
+            if self.dominates((entry["lcoe"], entry["aep"]), point) or (entry["lcoe"], entry["aep"]) == point:
+                return False
+        self.entries = [e for e in self.entries if not self.dominates(point, (e["lcoe"], e["aep"]))]
+        self.entries.append({
+            "layout": layout.copy(),
+            "lcoe": lcoe,
+            "aep": aep,
+            "wake_losses": wake_losses,
+            "cable_length": cable_length,
+        })
+        if len(self.entries) > self.maxsize:
+            del self.entries[int(np.argmin(self.crowding()))]
+        return True
+
+    def crowding(self):
+        objectives = np.array([[e["lcoe"], e["aep"]] for e in self.entries])
+        distance = np.zeros(len(objectives))
+        for column in objectives.T:
+            order = np.argsort(column)
+            span = column[order[-1]] - column[order[0]] or 1.0
+            distance[order[[0, -1]]] = np.inf
+            distance[order[1:-1]] += (column[order[2:]] - column[order[:-2]]) / span
+        return distance
+
+    def table(self):
+        """
+        Returns:
+        pd.DataFrame: The front sorted by LCOE, without the layouts.
+        """
+        return pd.DataFrame(
+            [{key: value for key, value in e.items() if key != "layout"} for e in self.entries],
+            columns=["lcoe", "aep", "wake_losses", "cable_length"],
+        ).sort_values("lcoe", ignore_index=True)
+
+    def layouts(self):
+        return [e["layout"] for e in sorted(self.entries, key=lambda e: e["lcoe"])]
+
+
+class ParetoSearch:
+    """
+    Archive based multi-objective annealing (MOSA).
+
+    A population of walkers anneals at once. Walker k minimizes its own mix
+    of the objectives, w_k * LCOE / LCOE_0 + (1 - w_k) * AEP_0 / AEP, with
+    the weights spread evenly over [0, 1] so the walkers cover the front.
+    Every generation each walker moves one turbine and the moves are scored
+    together by the BatchEvaluator, across processes. A move is accepted by
+    the walker with the Metropolis rule on its mix (in LCOE units, with the
+    temperatures of the annealer) and offered to the archive either way.
+
+    Wake losses are not a separate objective: with a homogeneous inflow the
+    no-wake AEP does not depend on the layout, so they follow from the AEP.
+    """
+    def __init__(self, alc, population=8, archive_size=100):
+        self.alc = alc
+        self.population = population
+        self.archive = ParetoArchive(archive_size)
+        self.weights = np.linspace(0.0, 1.0, population) if population > 1 else np.array([1.0])
+        self.evaluations = 0
+
+    def propose(self, parent, R):
+        alc = self.alc
+        i = np.random.randint(len(parent))
+        accept = None
+        if alc.min_spacing:
+            spacing = feasibility.SpacingIndex(parent, alc.min_spacing)
+            accept = lambda x, y: spacing.valid(x, y, skip=i)
+        x, y = parent[i]
+        child = parent.copy()
+        child[i] = alc.feasibility.sample(x - R, y - R, x + R, y + R, accept)
+        return child
+
+    def score(self, layouts, evaluator):
+        aeps = evaluator.evaluate(layouts)
+        self.evaluations += len(layouts)
+        scores = []
+        for layout, aep in zip(layouts, aeps):
+            cables_length, subs = self.alc.get_cables_length_and_substation(layout)
+            lcoe = self.alc.econ.get_lcoe(aep, cables_length)
+            wake_losses = (self.aep_no_wake - aep) / self.aep_no_wake * 100
+            self.archive.add(layout, lcoe, aep, wake_losses, cables_length)
+            self.alc.sa.check_LCOE(lcoe, layout, aep)
+            scores.append((lcoe, aep))
+        return scores
+
+    def run(self, generations):
+        """
+        Returns:
+        ParetoArchive: The non-dominated layouts found.
+        """
+        alc = self.alc
+        sa = alc.sa
+        start = alc.current_allocations
+        alc.fm.new_run(start)
+        self.aep_no_wake = alc.fm.get_aep_without_wake()
+
+        evaluator = mdl.BatchEvaluator(alc.fm, alc.evaluation_workers)
+        try:
+            walkers = [start.copy() for _ in range(self.population)]
+            scores = self.score([start], evaluator) * self.population
+            lcoe0, aep0 = scores[0]
+
+            def mix(k, score):
+                w = self.weights[k]
+                return (w * score[0] / lcoe0 + (1 - w) * aep0 / score[1]) * lcoe0
+
+            T = sa.T
+            cooling = (sa.T_final / sa.T) ** (1 / generations)
+            for generation in range(generations):
+                R = max(alc.R0 * 0.1, alc.R0 * (1 - generation / generations))
+                children = [self.propose(walker, R) for walker in walkers]
+                for k, score in enumerate(self.score(children, evaluator)):
+                    delta = mix(k, score) - mix(k, scores[k])
+                    if delta <= 0 or np.random.uniform() < np.exp(-delta / T):
+                        walkers[k] = children[k]
+                        scores[k] = score
+                T *= cooling
+                alc.iter = generation + 1
+                alc.notify("on_iteration")
+        finally:
+            evaluator.close()
+
+        logging.info(
+            f"Pareto search: {len(self.archive.entries)} non-dominated layouts "
+            f"from {self.evaluations} evaluations"
+        )
+        return self.archive
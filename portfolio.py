@@ -0,0 +1,331 @@
+"""
+Screening of many candidate sites in one job.
+
+    python -m portfolio candidates.gpkg --constraints protected.gpkg roads.geojson \
+        --output portfolio.sqlite --workers 8 --iterations 20
+
+Every polygon (or multipolygon) of the candidates file is one site, the
+polygons of all layers of the constraint files are excluded from the sites
+they overlap. Sites are optimized in a process pool, each process keeping
+the wind rose and FLORIS model of the weather cells it has seen, so the
+sites of one cell share them. Each site is seeded from its id and, in a
+pool, runs a single chain evaluated in process. Results are written to
+SQLite as sites finish: the `sites` table has one row per site, the `ranking` view ranks
+the finished ones by LCOE. Finished sites are skipped when the job runs
+again, failed ones are retried.
+"""
+import argparse
+import json
+import logging
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import context as ctx
+import data_retriever as dr
+import modeling as mdl
+import allocator
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sites (
+    site_id TEXT PRIMARY KEY,
+    status TEXT,
+    cell TEXT,
+    lat REAL,
+    lon REAL,
+    country TEXT,
+    land_area REAL,
+    available_area REAL,
+    no_of_turbines INTEGER,
+    min_lcoe REAL,
+    aep REAL,
+    wake_losses REAL,
+    land_cost REAL,
+    capex REAL,
+    cable_length REAL,
+    layout TEXT,
+    seconds REAL
+);
+CREATE VIEW IF NOT EXISTS ranking AS
+    SELECT RANK() OVER (ORDER BY min_lcoe) AS rank, *
+    FROM sites WHERE status = 'done';
+"""
+
+
+def rings(geometry):
+    """
+    Returns:
+    tuple: The exterior rings of a (multi)polygon and its holes, as lists
+        of [lon, lat].
+    """
+    polygons = getattr(geometry, "geoms", [geometry])
+    exteriors = [[list(pt) for pt in p.exterior.coords] for p in polygons]
+    holes = [[list(pt) for pt in ring.coords] for p in polygons for ring in p.interiors]
+    return exteriors, holes
+
+
+def read_layers(path):
+    # every layer of a GeoPackage, the only one of a GeoJSON
+    layers = gpd.list_layers(path)["name"]
+    frames = [gpd.read_file(path, layer=layer).to_crs("EPSG:4326") for layer in layers]
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_sites(candidates_file, constraint_files=(), id_column=None, store=None):
+    """
+    Candidate sites with their constraints and weather cell.
+
+    Parameters:
+    id_column (str): Column with the site ids, by default "id" or "name"
+        when present, the row number otherwise.
+    store (WeatherStore): Store whose cells group the sites.
+
+    Returns:
+    list: One dict per site with site_id, coordinates, constraints, lat,
+        lon and cell.
+    """
+    candidates = gpd.read_file(candidates_file).to_crs("EPSG:4326")
+    if id_column is None:
+        id_column = next((c for c in ("id", "name") if c in candidates.columns), None)
+    ids = candidates[id_column].astype(str) if id_column else candidates.index.astype(str)
+
+    constraints = None
+    if constraint_files:
+        constraints = pd.concat([read_layers(path) for path in constraint_files], ignore_index=True)
+        constraints = gpd.GeoDataFrame(constraints, crs="EPSG:4326").explode(index_parts=False)
+        constraints = constraints[constraints.geom_type == "Polygon"]
+
+    sites = []
+    for site_id, geometry in zip(ids, candidates.geometry):
+        coordinates, holes = rings(geometry)
+        excluded = list(holes)
+        if constraints is not None:
+            for i in constraints.sindex.query(geometry, predicate="intersects"):
+                excluded.extend(rings(constraints.geometry.iloc[i])[0])
+        centroid = geometry.centroid
+        lat, lon = centroid.y, centroid.x
+        sites.append({
+            "site_id": site_id,
+            "coordinates": coordinates,
+            "constraints": excluded,
+            "lat": lat,
+            "lon": lon,
+            "cell": store.cell(lat, lon) if store is not None else "all",
+        })
+    return sites
+
+
+# wind roses and FLORIS models of the last weather cells of this process
+_cell_models = OrderedDict()
+MAX_CELLS = 2
+
+
+def cell_model(site, context, weather_file, no_of_turbines):
+    key = (site["cell"], weather_file, no_of_turbines)
+    if key in _cell_models:
+        _cell_models.move_to_end(key)
+        fm = _cell_models[key]
+        # back to the base wind rose after a multi-fidelity run, layout
+        # cache entries stay valid, the AEP only depends on relative positions
+        if fm.wr is not fm.data_manipulator.wr:
+            fm.set_wind_rose(fm.data_manipulator.wr)
+        elif fm.incremental is not None:
+            fm.incremental.reset(fm.wr)
+        return fm
+
+    wr = dr.WeatherRetriever(context=context)
+    if weather_file is not None:
+        wr.load_weather(weather_file)
+    else:
+        wr.centroid = (site["lat"], site["lon"])
+        wr.retrieve_weather(context.config.get("weather_years", 2023))
+    md = mdl.ModelData(wr)
+    fm = mdl.FarmModel(md, no_of_turbines=no_of_turbines)
+
+    _cell_models[key] = fm
+    while len(_cell_models) > MAX_CELLS:
+        _cell_models.popitem(last=False)
+    return fm
+
+
+def site_seed(site_id):
+    # stable over runs and processes, unlike hash() of a str
+    return zlib.crc32(str(site_id).encode())
+
+
+def screen_site(site, context, weather_file=None, iterations=None, no_of_turbines=None, seed=None,
+                in_pool=False):
+    """
+    Optimize one site with the wind rose and FLORIS model of its cell.
+
+    Parameters:
+    seed (int): Seed of the run, derived from the site id by default so
+        every site gets its own and reruns of a site repeat it.
+    in_pool (bool): Running in a portfolio worker process, where the
+        replicas and the evaluation workers would start processes of their
+        own: the site runs a single chain, evaluated in process.
+
+    Returns:
+    dict: The row of the site in the results table.
+    """
+    start = time.perf_counter()
+    row = {"site_id": site["site_id"], "cell": site["cell"], "lat": site["lat"], "lon": site["lon"]}
+    try:
+        fm = cell_model(site, context, weather_file, no_of_turbines)
+        np.random.seed(site_seed(site["site_id"]) if seed is None else seed)
+        wr = dr.WeatherRetriever(context=context)
+        wr.coordinates = site["coordinates"]
+        wr.constraints = site["constraints"]
+        wr.calculate_centroid()
+        wr.weather = fm.data_manipulator.weather
+
+        alc = allocator.Allocator(wr, fm)
+        alc.detach_outputs()
+        if in_pool:
+            alc.replicas = 1
+            alc.evaluation_workers = 1
+        if iterations is not None:
+            alc.update_iterations(iterations)
+        alc.run()
+
+        best = alc.sa.min_LCOE_alloc
+        cables_length, subs = alc.get_cables_length_and_substation(best)
+        alc.econ.calculate_capex(cables_length)
+        row.update({
+            "status": "done",
+            "country": alc.country,
+            "land_area": alc.area,
+            "available_area": alc.area_cut,
+            "no_of_turbines": alc.no_of_turbines,
+            "min_lcoe": alc.sa.min_LCOE,
+            "aep": alc.sa.aep_at_min_lcoe,
+            "wake_losses": fm.get_wake_losses(best),
+            "land_cost": alc.econ.land_cost,
+            "capex": alc.econ.capex,
+            "cable_length": cables_length,
+            "layout": json.dumps(alc.transform_points(best).tolist()),
+        })
+    except Exception as e:
+        # one bad site must not end the job, it is retried when the job runs again
+        row = failed_row(site, e)
+    row["seconds"] = time.perf_counter() - start
+    return row
+
+
+def failed_row(site, error):
+    logging.warning(f"Site {site['site_id']} failed: {error!r}")
+    return {
+        "site_id": site["site_id"],
+        "cell": site["cell"],
+        "lat": site["lat"],
+        "lon": site["lon"],
+        "status": f"failed: {error!r}",
+    }
+
+
+def save_row(db, row):
+    columns = ", ".join(row)
+    placeholders = ", ".join("?" for _ in row)
+    db.execute(f"INSERT OR REPLACE INTO sites ({columns}) VALUES ({placeholders})", list(row.values()))
+    db.commit()
+
+
+def ranking(output):
+    """
+    Returns:
+    pd.DataFrame: The finished sites ranked by LCOE.
+    """
+    with sqlite3.connect(output) as db:
+        return pd.read_sql_query("SELECT * FROM ranking", db)
+
+
+def screen(candidates_file, constraint_files=(), output="portfolio.sqlite", weather_file=None,
+           config_file=None, iterations=None, no_of_turbines=None, workers=None, id_column=None):
+    """
+    Optimize every candidate site not finished yet in `output`.
+
+    Parameters:
+    candidates_file (str): GeoPackage or GeoJSON with one polygon per site.
+    constraint_files (iterable): Files with the excluded polygons.
+    weather_file (str): Optional csv used for every site, the weather store
+        (and the Open-Meteo archive) is used otherwise.
+    workers (int): Processes, defaults to portfolio_workers from the config.
+
+    Returns:
+    pd.DataFrame: The ranking of all finished sites.
+    """
+    context = ctx.get(config_file) if config_file is not None else ctx.get()
+    config = context.config
+    store = None if weather_file is not None else dr.WeatherRetriever(context=context).store
+    sites = read_sites(candidates_file, constraint_files, id_column, store)
+
+    db = sqlite3.connect(output)
+    db.executescript(SCHEMA)
+    done = {site_id for (site_id,) in db.execute("SELECT site_id FROM sites WHERE status = 'done'")}
+    todo = [site for site in sites if site["site_id"] not in done]
+    # sites of a cell next to each other, so the processes reuse their models
+    todo.sort(key=lambda site: site["cell"])
+    logging.info(f"Portfolio: {len(sites)} sites, {len(done)} already done, {len(todo)} to screen")
+
+    if store is not None and not store.offline and todo:
+        dr.prefetch_weather([(s["lat"], s["lon"]) for s in todo], config.get("weather_years", 2023),
+                            store=store, context=context)
+
+    workers = workers or config.get("portfolio_workers", 1)
+    try:
+        if workers <= 1:
+            for site in todo:
+                save_row(db, screen_site(site, context, weather_file, iterations, no_of_turbines))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(screen_site, site, context, weather_file, iterations, no_of_turbines, in_pool=True): site
+                    for site in todo
+                }
+                for future in as_completed(futures):
+                    try:
+                        row = future.result()
+                    except Exception as e:
+                        # a dead worker (BrokenProcessPool) fails its site and the ones still queued
+                        row = failed_row(futures[future], e)
+                    save_row(db, row)
+    finally:
+        db.close()
+    return ranking(output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="portfolio", description="Screen many candidate sites in one job.")
+    parser.add_argument("candidates", help="GeoPackage or GeoJSON with one polygon per candidate site")
+    parser.add_argument("--constraints", nargs="*", default=[], help="files with the excluded polygons, all layers are read")
+    parser.add_argument("--weather", help="csv with hourly wind_speed_100m and wind_direction_100m used for every site")
+    parser.add_argument("--config", default="config.yml", help="configuration file")
+    parser.add_argument("--output", default="portfolio.sqlite", help="SQLite file of the results")
+    parser.add_argument("--iterations", type=int, help="override the iterations from the config")
+    parser.add_argument("--turbines", type=int, help="override number_of_turbines from the config")
+    parser.add_argument("--workers", type=int, help="override portfolio_workers from the config")
+    parser.add_argument("--id-column", help="column with the site ids")
+    args = parser.parse_args(argv)
+
+    table = screen(
+        args.candidates,
+        args.constraints,
+        output=args.output,
+        weather_file=args.weather,
+        config_file=args.config,
+        iterations=args.iterations,
+        no_of_turbines=args.turbines,
+        workers=args.workers,
+        id_column=args.id_column,
+    )
+    if len(table):
+        best = table.iloc[0]
+        logging.info(f"{len(table)} sites ranked, best {best['site_id']} at {best['min_lcoe']:.3f} ct/kWh, results in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
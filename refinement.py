@@ -0,0 +1,143 @@
+import logging
+import numpy as np
+import shapely
+from scipy.optimize import minimize
+from scipy.spatial.distance import pdist
+import modeling as mdl
+
+
+class LayoutRefiner:
+    """
+    Local polish of an annealed layout with SLSQP.
+
+    The variables are the turbine x, y in rotor diameters around the start
+    layout and the objective is the LCOE. Its gradient is taken by forward
+    differences, the 2n shifted layouts being scored in one batch by the
+    BatchEvaluator. The layouts are solved without the layout cache, whose
+    resolution is as coarse as the steps taken here. Every pair of turbines
+    is kept `min_spacing` metres apart and every turbine on the available
+    land, through its signed distance to the land boundary (positive
+    inside).
+    """
+    def __init__(self, alc, min_spacing, iterations=20, fd_step=1.0, workers=None):
+        self.alc = alc
+        self.min_spacing = min_spacing
+        self.iterations = iterations
+        self.fd_step = fd_step
+        self.workers = workers
+        self.scale = alc.fm.rotor_diameter
+        self.geometry = alc.feasibility.geometry
+        self.boundary = self.geometry.boundary
+        self.evaluations = 0
+        self.last = None
+
+    def lcoe(self, layouts, evaluator):
+        aeps = evaluator.evaluate(layouts)
+        self.evaluations += len(layouts)
+        lcoes = []
+        for layout, aep in zip(layouts, aeps):
+            cables_length, subs = self.alc.get_cables_length_and_substation(layout)
+            lcoes.append(self.alc.econ.get_lcoe(aep, cables_length))
+        return np.array(lcoes), aeps
+
+    def value_and_gradient(self, u, evaluator):
+        # SLSQP asks for the value and the gradient at the same point separately
+        if self.last is not None and np.array_equal(self.last[0], u):
+            return self.last[1], self.last[2]
+
+        coords = self.layout(u)
+        h = self.fd_step
+        layouts = [coords]
+        for i in range(len(coords)):
+            for axis in range(2):
+                shifted = coords.copy()
+                shifted[i, axis] += h
+                layouts.append(shifted)
+
+        lcoes, aeps = self.lcoe(layouts, evaluator)
+        gradient = (lcoes[1:] - lcoes[0]) / h * self.scale
+        self.last = (u.copy(), lcoes[0], gradient)
+        return lcoes[0], gradient
+
+    def layout(self, u):
+        return self.origin + u.reshape(-1, 2) * self.scale
+
+    def signed_distance(self, coords):
+        points = shapely.points(coords)
+        distance = shapely.distance(self.boundary, points)
+        inside = shapely.contains_xy(self.geometry, coords[:, 0], coords[:, 1])
+        return np.where(inside, distance, -distance)
+
+    def land_constraint(self, u):
+        return self.signed_distance(self.layout(u)) / self.scale
+
+    def land_jacobian(self, u):
+        coords = self.layout(u)
+        base = self.signed_distance(coords)
+        jac = np.zeros((len(coords), coords.size))
+        for axis in range(2):
+            shifted = coords.copy()
+            shifted[:, axis] += self.fd_step
+            jac[np.arange(len(coords)), 2 * np.arange(len(coords)) + axis] = (
+                (self.signed_distance(shifted) - base) / self.fd_step
+            )
+        return jac
+
+    def spacing_constraint(self, u):
+        return (pdist(self.layout(u)) - self.min_spacing) / self.scale
+
+    def spacing_jacobian(self, u):
+        coords = self.layout(u)
+        n = len(coords)
+        i, j = np.triu_indices(n, k=1)
+        delta = coords[i] - coords[j]
+        direction = delta / np.maximum(np.hypot(*delta.T), 1e-9)[:, None]
+        jac = np.zeros((len(i), 2 * n))
+        rows = np.arange(len(i))
+        for axis in range(2):
+            jac[rows, 2 * i + axis] = direction[:, axis]
+            jac[rows, 2 * j + axis] = -direction[:, axis]
+        return jac
+
+    def feasible(self, coords):
+        spaced = len(coords) < 2 or pdist(coords).min() >= self.min_spacing - 1e-6
+        return spaced and self.alc.feasibility.contains(coords[:, 0], coords[:, 1]).all()
+
+    def refine(self, start):
+        """
+        Parameters:
+        start (np.ndarray): The (n, 2) layout to start from.
+
+        Returns:
+        tuple: The refined layout (the start when nothing better and
+            feasible was found), its LCOE and AEP.
+        """
+        self.origin = np.array(start, dtype=float)
+        self.last = None
+        evaluator = mdl.BatchEvaluator(self.alc.fm, self.workers, cached=False)
+        try:
+            (start_lcoe,), (start_aep,) = self.lcoe([self.origin], evaluator)
+            constraints = [{"type": "ineq", "fun": self.land_constraint, "jac": self.land_jacobian}]
+            if len(self.origin) > 1:
+                constraints.append({"type": "ineq", "fun": self.spacing_constraint, "jac": self.spacing_jacobian})
+
+            result = minimize(
+                lambda u: self.value_and_gradient(u, evaluator)[0],
+                np.zeros(self.origin.size),
+                jac = lambda u: self.value_and_gradient(u, evaluator)[1],
+                method = "SLSQP",
+                constraints = constraints,
+                options = {"maxiter": self.iterations},
+            )
+            coords = self.layout(result.x)
+            (lcoe,), (aep,) = self.lcoe([coords], evaluator)
+        finally:
+            evaluator.close()
+
+        logging.info(
+            f"Refinement: LCOE {start_lcoe:.4f} -> {lcoe:.4f} ct/kWh after {result.nit} SLSQP iterations, "
+            f"{self.evaluations} layouts evaluated ({result.message})"
+        )
+        if lcoe < start_lcoe and self.feasible(coords):
+            return coords, lcoe, aep
+        return self.origin, start_lcoe, start_aep
@@ -1,4 +1,5 @@
 import logging
+from collections import deque
 import numpy as np
 
 
@@ -9,22 +10,24 @@ logging.basicConfig(
 
 
 class SimulatedAnnealer:
-    def __init__(self, iterations, verbose = True):
+    def __init__(self, iterations, verbose = True, history_size = None):
         self.T = 1
         self.T_final = 1e-2
         self.iterations = iterations
         self.cooling = (self.T_final / self.T) ** (1 / self.iterations)
         self.min_LCOE = 50.0
         self.min_LCOE_hist = []
-        self.min_LCOE_alloc = []
+        self.min_LCOE_alloc = np.empty((0, 2))
         self.max_AEP = 0
         self.max_AEP_hist = []
-        self.max_AEP_alloc = []
+        self.max_AEP_alloc = np.empty((0, 2))
         self.current_LCOE = 50.0
         self.prev_LCOE = 50.0
-        self.delta_list = []
-        self.lcoe_hist = []
-        self.aep_hist = []
+        # per-proposal histories keep the latest history_size values, the
+        # HistoryRecorder of the allocator has the whole run
+        self.delta_list = deque(maxlen = history_size)
+        self.lcoe_hist = deque(maxlen = history_size)
+        self.aep_hist = deque(maxlen = history_size)
         self.aep_at_min_lcoe = 0
 
 
@@ -35,7 +38,7 @@ class SimulatedAnnealer:
         if lcoe < self.min_LCOE:
             self.min_LCOE = lcoe
             self.min_LCOE_hist.append(self.min_LCOE)
-            self.min_LCOE_alloc = allocations
+            self.min_LCOE_alloc = allocations.copy()  # the caller keeps mutating its layout
             self.aep_at_min_lcoe = aep
             if self.verbose:
                 logging.info(f"New min_LCOE: {self.min_LCOE}")
@@ -47,7 +50,7 @@ class SimulatedAnnealer:
         if aep > self.max_AEP:
             self.max_AEP = aep
             self.max_AEP_hist.append(self.max_AEP)
-            self.max_AEP_alloc = allocations
+            self.max_AEP_alloc = allocations.copy()
             if self.verbose:
                 logging.info(f"New max_AEP: {self.max_AEP}")
 
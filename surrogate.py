@@ -0,0 +1,162 @@
+import logging
+import numpy as np
+
+
+class JensenSurrogate:
+    """
+    Cheap AEP estimate of a layout with the Jensen/Park wake model.
+
+    Only the dominant sectors of the wind rose are evaluated (the smallest set
+    of wind directions holding `sector_share` of the frequency), with
+    root-sum-square wake superposition. The raw estimate is calibrated online
+    against the FLORIS AEP of the proposals that do get evaluated, and the
+    relative error of the calibrated estimate is tracked to size the safety
+    margin used when screening proposals.
+    """
+    def __init__(self, wr, turbine, wake_decay=0.05, sector_share=0.9):
+        self.wake_decay = wake_decay
+        self.sector_share = sector_share
+        self.rotor_diameter = turbine["rotor_diameter"]
+        table = turbine["power_thrust_table"]
+        self.curve_ws = np.asarray(table["wind_speed"], dtype=float)
+        self.curve_power = np.asarray(table["power"], dtype=float) * 1000  # kW to W
+        self.curve_ct = np.asarray(table["thrust_coefficient"], dtype=float)
+        self.reset(wr)
+
+    def reset(self, wr):
+        """
+        Use a new wind rose and forget the calibration.
+        """
+        freq = wr.freq_table
+        share = freq.sum(axis=1)
+        order = np.argsort(share)[::-1]
+        keep = order[:np.searchsorted(np.cumsum(share[order]), self.sector_share) + 1]
+
+        self.directions = np.asarray(wr.wind_directions, dtype=float)[keep]
+        self.speeds = np.asarray(wr.wind_speeds, dtype=float)
+        self.freq = freq[keep]
+        self.ct = np.interp(self.speeds, self.curve_ws, self.curve_ct)
+
+        self.scale = None
+        self.pairs = 0
+        self.abs_error = 0.0
+        self.sq_error = 0.0
+
+    def estimate(self, coords):
+        """
+        Raw (uncalibrated) AEP estimate in Wh.
+
+        Parameters:
+        coords (np.ndarray): Turbine positions of shape (n, 2) in metres.
+        """
+        D = self.rotor_diameter
+        k = self.wake_decay
+        # meteorological convention, wind from 270 blows along +x
+        theta = np.deg2rad(270.0 - self.directions)[:, None, None]
+        dx = coords[None, :, 0] - coords[:, None, 0]  # [i, j]: from turbine i to j
+        dy = coords[None, :, 1] - coords[:, None, 1]
+        downstream = dx * np.cos(theta) + dy * np.sin(theta)
+        lateral = np.abs(-dx * np.sin(theta) + dy * np.cos(theta))
+
+        in_wake = (downstream > 0) & (lateral < D / 2 + k * downstream)
+        shape = np.where(in_wake, (D / (D + 2 * k * np.where(in_wake, downstream, 0))) ** 2, 0.0)
+
+        # deficit of each waking pair per speed, combined over upstream turbines i
+        strength = 1 - np.sqrt(1 - np.minimum(self.ct, 0.9999))
+        deficit = np.sqrt(np.einsum("dij,s->dsj", shape ** 2, strength ** 2))
+        u = self.speeds[None, :, None] * (1 - np.minimum(deficit, 1))
+        power = np.interp(u, self.curve_ws, self.curve_power).sum(axis=2)
+        return (self.freq * power).sum() * 8760
+
+    def predict(self, coords):
+        """
+        Calibrated AEP estimate, None until at least one FLORIS result was seen.
+        """
+        if self.scale is None:
+            return None
+        return self.scale * self.estimate(coords)
+
+    def observe(self, coords, aep):
+        """
+        Record the FLORIS AEP of an evaluated layout to calibrate the surrogate.
+        """
+        raw = self.estimate(coords)
+        if self.scale is not None:
+            error = (self.scale * raw - aep) / aep
+            self.abs_error += abs(error)
+            self.sq_error += error ** 2
+        ratio = aep / raw
+        # running mean of the FLORIS / Jensen ratio
+        self.pairs += 1
+        self.scale = ratio if self.scale is None else self.scale + (ratio - self.scale) / self.pairs
+
+    @property
+    def mean_abs_error(self):
+        return self.abs_error / max(self.pairs - 1, 1)
+
+    @property
+    def rms_error(self):
+        return np.sqrt(self.sq_error / max(self.pairs - 1, 1))
+
+
+class SurrogateScreen:
+    """
+    Decides which annealing proposals are worth a FLORIS run.
+
+    A proposal is screened out when even an optimistic surrogate LCOE (the
+    estimate reduced by `margin` times the observed error) would be accepted
+    with a probability below `min_acceptance` at the current temperature.
+    A share `audit_rate` of the screened proposals is evaluated anyway,
+    which measures how often the screen is right (its hit rate).
+    """
+    def __init__(self, surrogate, warmup=20, min_acceptance=1e-3, margin=3.0, audit_rate=0.05):
+        self.surrogate = surrogate
+        self.warmup = warmup
+        self.min_acceptance = min_acceptance
+        self.margin = margin
+        self.audit_rate = audit_rate
+        self.proposals = 0
+        self.screened = 0
+        self.audited = 0
+        self.audit_hits = 0
+
+    def reset(self, wr):
+        self.surrogate.reset(wr)
+
+    def screen(self, coords, lcoe_from_aep, prev_lcoe, T):
+        """
+        Returns:
+        str: "evaluate", "skip" or "audit" for the proposal.
+        """
+        self.proposals += 1
+        if self.surrogate.pairs < self.warmup:
+            return "evaluate"
+
+        aep = self.surrogate.predict(coords)
+        optimistic = aep * (1 + self.margin * self.surrogate.mean_abs_error)
+        delta = lcoe_from_aep(optimistic) - prev_lcoe
+        if delta <= 0 or np.exp(-delta / T) >= self.min_acceptance:
+            return "evaluate"
+
+        if np.random.uniform() < self.audit_rate:
+            self.audited += 1
+            return "audit"
+        self.screened += 1
+        return "skip"
+
+    def audit(self, lcoe, prev_lcoe, T, is_best):
+        """
+        Record whether an audited proposal was indeed hopeless.
+        """
+        delta = lcoe - prev_lcoe
+        if delta > 0 and np.exp(-delta / T) < self.min_acceptance and not is_best:
+            self.audit_hits += 1
+
+    def report(self):
+        hit_rate = self.audit_hits / self.audited if self.audited else float("nan")
+        logging.info(
+            f"Surrogate screened {self.screened}/{self.proposals} proposals, "
+            f"audit hit rate {hit_rate:.3f} ({self.audited} audited), "
+            f"AEP error mean {self.surrogate.mean_abs_error*100:.2f} % "
+            f"rms {self.surrogate.rms_error*100:.2f} %"
+        )
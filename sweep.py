@@ -0,0 +1,124 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import allocator
+import feasibility
+import modeling as mdl
+
+
+class TurbineSweep:
+    """
+    Optimize the layout for a range of turbine counts with one allocator.
+
+    The site, land index, wind rose and FLORIS model of the allocator are
+    reused for every count. Each count after the first starts from the best
+    layout of the previous one: growing adds the turbine with the best
+    marginal LCOE among `candidates` feasible positions, shrinking drops the
+    turbine whose removal gives the lowest LCOE.
+    """
+    def __init__(self, alc, iterations=None, candidates=16):
+        self.alc = alc
+        self.iterations = iterations or alc.iterations
+        self.candidates = candidates
+
+    def score(self, layouts):
+        # the capex depends on the turbine count of the layouts
+        self.alc.econ.no_of_turbines = len(layouts[0])
+        lcoes = []
+        for layout in layouts:
+            lcoe, aep = self.alc.evaluate_lcoe(layout)
+            lcoes.append(lcoe)
+        return np.array(lcoes)
+
+    def grow(self, layout):
+        alc = self.alc
+        minx, miny, maxx, maxy = alc.bounds
+        accept = None
+        if alc.min_spacing:
+            accept = feasibility.SpacingIndex(layout, alc.min_spacing).valid
+        layouts = []
+        for _ in range(self.candidates):
+            position = alc.feasibility.sample(minx, miny, maxx, maxy, accept)
+            layouts.append(np.vstack([layout, position]))
+        return layouts[int(np.argmin(self.score(layouts)))]
+
+    def shrink(self, layout):
+        layouts = [np.delete(layout, i, axis=0) for i in range(len(layout))]
+        return layouts[int(np.argmin(self.score(layouts)))]
+
+    def run(self, counts):
+        """
+        Parameters:
+        counts (iterable): Turbine counts, in the order they are optimized.
+
+        Returns:
+        list: One dict per count with its results and best layout.
+        """
+        alc = self.alc
+        rows = []
+        best = None
+        for n in counts:
+            layout = None
+            if best is not None:
+                layout = best
+                while len(layout) < n:
+                    layout = self.grow(layout)
+                while len(layout) > n:
+                    layout = self.shrink(layout)
+            alc.set_no_of_turbines(n, layout)
+            alc.update_iterations(self.iterations)
+            alc.run()
+
+            best = alc.sa.min_LCOE_alloc.copy()
+            cables_length, subs = alc.get_cables_length_and_substation(best)
+            alc.econ.calculate_capex(cables_length)
+            rows.append({
+                "no_of_turbines": n,
+                "lcoe": alc.sa.min_LCOE,
+                "aep": alc.sa.aep_at_min_lcoe,
+                "wake_losses": alc.fm.get_wake_losses(best),
+                "capex": alc.econ.capex,
+                "cable_length": cables_length,
+                "layout": best,
+            })
+            logging.info(f"{n} turbines: LCOE {alc.sa.min_LCOE:.4f} ct/kWh, AEP {alc.sa.aep_at_min_lcoe/1e6:.1f} MWh")
+        return rows
+
+
+def _sweep_block(data_retriever, counts, iterations, candidates, seed):
+    # worker process: its own allocator, reused for its block of counts
+    np.random.seed(seed)
+    md = mdl.ModelData(data_retriever)
+    fm = mdl.FarmModel(md, no_of_turbines=counts[0])
+    alc = allocator.Allocator(data_retriever, fm)
+    alc.detach_outputs()
+    return TurbineSweep(alc, iterations, candidates).run(counts)
+
+
+def sweep(alc, counts, iterations=None, workers=1, candidates=16):
+    """
+    LCOE and AEP against the number of turbines.
+
+    With one worker the counts run in order on `alc`, each warm started from
+    the one before. With more, the counts are split into contiguous blocks
+    run in parallel processes, warm started within each block.
+
+    Returns:
+    pd.DataFrame: One row per count with lcoe, aep, wake_losses, capex,
+        cable_length and the best layout.
+    """
+    counts = list(counts)
+    if workers <= 1 or len(counts) < 2:
+        rows = TurbineSweep(alc, iterations, candidates).run(counts)
+    else:
+        blocks = [list(block) for block in np.array_split(counts, min(workers, len(counts)))]
+        seeds = np.random.randint(0, 2**31 - 1, len(blocks))
+        with ProcessPoolExecutor(max_workers=len(blocks)) as pool:
+            futures = [
+                pool.submit(_sweep_block, alc.data_retriever, [int(n) for n in block],
+                            iterations or alc.iterations, candidates, int(seed))
+                for block, seed in zip(blocks, seeds)
+            ]
+            rows = [row for future in futures for row in future.result()]
+    return pd.DataFrame(rows)
@@ -0,0 +1,443 @@
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import flatbuffers
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.spatial.distance import cdist, pdist
+import allocator
+import benchmark
+import cables
+import checkpoint
+import context as ctx
+import data_retriever as dr
+import feasibility
+import modeling as mdl
+import weather_store as ws
+
+
+def _float_vector(builder, values):
+    values = np.asarray(values, dtype=np.float32)
+    builder.StartVector(4, len(values), 4)
+    for value in reversed(values):
+        builder.PrependFloat32(float(value))
+    return builder.EndVector()
+
+
+def archive_response(lat, lon, year):
+    """
+    One location of an Open-Meteo archive reply in the flatbuffers format,
+    hourly temperature_2m, wind_direction_100m and wind_speed_100m set to
+    lat, lon and the hour of the year.
+    """
+    start = pd.Timestamp(f"{year}-01-01", tz="UTC")
+    end = pd.Timestamp(f"{year + 1}-01-01", tz="UTC")
+    hours = int((end - start) / pd.Timedelta(hours=1))
+
+    builder = flatbuffers.Builder(0)
+    variables = []
+    for values in (np.full(hours, lat), np.full(hours, lon), np.arange(hours)):
+        vector = _float_vector(builder, values)
+        # VariableWithValues, values in slot 3
+        builder.StartObject(4)
+        builder.PrependUOffsetTRelativeSlot(3, vector, 0)
+        variables.append(builder.EndObject())
+    builder.StartVector(4, len(variables), 4)
+    for variable in reversed(variables):
+        builder.PrependUOffsetTRelative(variable)
+    variables = builder.EndVector()
+
+    # VariablesWithTime: time, time_end, interval, variables
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, int(start.timestamp()), 0)
+    builder.PrependInt64Slot(1, int(end.timestamp()), 0)
+    builder.PrependInt32Slot(2, 3600, 0)
+    builder.PrependUOffsetTRelativeSlot(3, variables, 0)
+    hourly = builder.EndObject()
+
+    # WeatherApiResponse: latitude, longitude, hourly in slot 11
+    builder.StartObject(12)
+    builder.PrependFloat32Slot(0, lat, 0)
+    builder.PrependFloat32Slot(1, lon, 0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly, 0)
+    builder.Finish(builder.EndObject())
+    message = bytes(builder.Output())
+    return len(message).to_bytes(4, "little") + message
+
+
+class StubArchive(BaseHTTPRequestHandler):
+    """
+    Archive API on localhost. The first `rate_limited` requests get a 429,
+    the locations of every other one are recorded in `requests`.
+    """
+    rate_limited = 0
+    refused = 0
+    requests = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        with self.lock:
+            if StubArchive.rate_limited:
+                StubArchive.rate_limited -= 1
+                StubArchive.refused += 1
+                self.reply(429, b'{"error": true, "reason": "Too many requests"}', "application/json")
+                return
+        lats = [float(v) for value in query["latitude"] for v in value.split(",")]
+        lons = [float(v) for value in query["longitude"] for v in value.split(",")]
+        year = int(query["start_date"][0][:4])
+        with self.lock:
+            StubArchive.requests.append((year, list(zip(lats, lons))))
+        body = b"".join(archive_response(lat, lon, year) for lat, lon in zip(lats, lons))
+        self.reply(200, body, "application/octet-stream")
+
+    def reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status != 200:
+            # like the api, an error reply ends the keep-alive connection
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PrefetchWeatherTest(unittest.TestCase):
+    def setUp(self):
+        StubArchive.requests = []
+        StubArchive.rate_limited = 0
+        StubArchive.refused = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubArchive)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1/archive"
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ws.WeatherStore(root=self.tmp.name, precision=2)
+        # the last two share a store cell
+        self.centroids = [(52.24, 15.10), (52.30, 15.20), (51.90, 16.00), (51.901, 16.001)]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def prefetch(self, years=2023):
+        return dr.prefetch_weather(
+            self.centroids, years, store=self.store, batch_size=2, workers=2, rate=0, url=self.url,
+        )
+
+    def test_fills_the_store_in_batches(self):
+        self.assertEqual(self.prefetch(), 3)
+
+        # one location per cell, in requests of at most batch_size locations
+        sizes = sorted(len(locations) for _, locations in StubArchive.requests)
+        self.assertEqual(sizes, [1, 2])
+        for lat, lon in self.centroids:
+            self.assertTrue(self.store.has(lat, lon, 2023, dr.HOURLY_VARIABLES))
+
+        weather = self.store.load(52.30, 15.20, 2023, dr.HOURLY_VARIABLES)
+        self.assertEqual(len(weather), 8760)
+        self.assertAlmostEqual(float(weather["temperature_2m"].iloc[0]), 52.30, places=4)
+        self.assertAlmostEqual(float(weather["wind_direction_100m"].iloc[0]), 15.20, places=4)
+        np.testing.assert_array_equal(weather["wind_speed_100m"].to_numpy(), np.arange(8760))
+        self.assertEqual(weather["date"].iloc[0], pd.Timestamp("2023-01-01", tz="UTC"))
+
+    def test_skips_stored_locations(self):
+        self.prefetch()
+        StubArchive.requests = []
+        self.assertEqual(self.prefetch(), 0)
+        self.assertEqual(StubArchive.requests, [])
+
+        # only the new year is fetched
+        self.assertEqual(self.prefetch([2023, 2024]), 3)
+        self.assertEqual({year for year, _ in StubArchive.requests}, {2024})
+
+    def test_retries_rate_limited_requests(self):
+        StubArchive.rate_limited = 2
+        self.assertEqual(self.prefetch(), 3)
+        # both refused requests were sent again and answered
+        self.assertEqual(StubArchive.refused, 2)
+        self.assertEqual(len(StubArchive.requests), 2)
+        self.assertEqual(sum(len(locations) for _, locations in StubArchive.requests), 3)
+
+    def test_offline_store_refuses(self):
+        self.store.offline = True
+        with self.assertRaises(RuntimeError):
+            self.prefetch()
+        self.assertEqual(StubArchive.requests, [])
+
+
+
+class MinimumSpanningTreeTest(unittest.TestCase):
+    def check_moves(self, n, moves=40, seed=0):
+        rng = np.random.default_rng(seed)
+        # every layout kept, so each move is repaired from its base
+        tree = cables.MinimumSpanningTree(delaunay_threshold=100, max_trees=moves + 1)
+        coords = rng.uniform(0, 10000, (n, 2))
+        self.assertAlmostEqual(tree.length(coords), cables.prim(coords)[1].sum(), places=6)
+        for _ in range(moves):
+            moved = coords.copy()
+            moved[rng.integers(n)] = rng.uniform(0, 10000, 2)
+            self.assertAlmostEqual(tree.length(moved), cables.prim(moved)[1].sum(), places=6)
+            if rng.uniform() < 0.5:
+                coords = moved
+        self.assertEqual(tree.repairs, moves)
+
+    def test_repair_matches_rebuild_below_delaunay_threshold(self):
+        self.check_moves(15)
+
+    def test_repair_matches_rebuild_above_delaunay_threshold(self):
+        self.check_moves(150)
+
+    def test_delaunay_build_matches_dense(self):
+        coords = np.random.default_rng(1).uniform(0, 10000, (300, 2))
+        tree = cables.MinimumSpanningTree(delaunay_threshold=100)
+        self.assertAlmostEqual(tree.build(coords)[1].sum(), cables.prim(coords)[1].sum(), places=6)
+
+    def test_collinear_layout_falls_back_to_dense(self):
+        # Qhull cannot triangulate a line of turbines
+        coords = np.column_stack([np.arange(120) * 500.0, np.zeros(120)])
+        tree = cables.MinimumSpanningTree(delaunay_threshold=100)
+        self.assertAlmostEqual(tree.length(coords), 119 * 500.0)
+        moved = coords.copy()
+        moved[60, 1] = 300.0
+        self.assertAlmostEqual(tree.length(moved), cables.prim(moved)[1].sum(), places=6)
+
+
+
+class FeasibilityIndexTest(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        # an L of 1 km arms with a pond, slanted edges so cells are cut
+        land = shapely.Polygon(
+            [(0, 0), (1000, 0), (1000, 400), (450, 500), (400, 1000), (0, 1000)],
+            holes=[[(150, 150), (300, 180), (250, 320), (120, 280)]],
+        )
+        self.land = land
+        self.index = feasibility.FeasibilityIndex(gpd.GeoDataFrame(geometry=[land]), resolution=37.0)
+
+    def test_raster_cells(self):
+        grid = self.index.grid
+        self.assertTrue({feasibility.INSIDE, feasibility.OUTSIDE, feasibility.BOUNDARY} <= set(np.unique(grid)))
+        r = self.index.resolution
+        minx, miny = self.index.bounds[:2]
+        for (iy, ix), state in np.ndenumerate(grid):
+            x = minx + ix * r + np.random.uniform(0, r, 20)
+            y = miny + iy * r + np.random.uniform(0, r, 20)
+            inside = shapely.contains_xy(self.land, x, y)
+            if state == feasibility.INSIDE:
+                self.assertTrue(inside.all(), (ix, iy))
+            elif state == feasibility.OUTSIDE:
+                self.assertFalse(inside.any(), (ix, iy))
+            else:
+                cell = shapely.box(minx + ix * r, miny + iy * r, minx + (ix + 1) * r, miny + (iy + 1) * r)
+                self.assertTrue(self.land.intersects(cell) and not self.land.contains_properly(cell), (ix, iy))
+
+    def test_contains_matches_shapely(self):
+        x = np.random.uniform(-100, 1100, 20000)
+        y = np.random.uniform(-100, 1100, 20000)
+        # points on the cell edges and the land boundary too
+        x[:200] = np.round(x[:200] / 37.0) * 37.0
+        y[:200] = 0.0
+        np.testing.assert_array_equal(self.index.contains(x, y), shapely.contains_xy(self.land, x, y))
+
+    def test_sample(self):
+        box = (100, 100, 700, 1200)
+        points = np.array([self.index.sample(*box) for _ in range(500)])
+        self.assertTrue(shapely.contains_xy(self.land, *points.T).all())
+        self.assertTrue((points >= [100, 100]).all() and (points <= [700, 1000]).all())
+        self.assertGreater(self.index.rejections, 0)
+
+        # accept sees the candidates on land only, and its choice is kept
+        seen = []
+        def accept(x, y):
+            seen.append((x, y))
+            return x > 500
+        x, y = self.index.sample(*box, accept=accept)
+        self.assertGreater(x, 500)
+        self.assertTrue(shapely.contains_xy(self.land, *np.array(seen).T).all())
+
+    def test_sample_without_raster(self):
+        index = feasibility.FeasibilityIndex(gpd.GeoDataFrame(geometry=[self.land]))
+        points = index.sample_many(300)
+        self.assertEqual(points.shape, (300, 2))
+        self.assertTrue(shapely.contains_xy(self.land, *points.T).all())
+
+
+class SpacingIndexTest(unittest.TestCase):
+    def test_valid_matches_brute_force(self):
+        np.random.seed(0)
+        min_spacing = 120.0
+        # negative coordinates too, cells are floored
+        coords = np.random.uniform(-1500, 1500, (200, 2))
+        index = feasibility.SpacingIndex(coords, min_spacing)
+        candidates = np.random.uniform(-1700, 1700, (5000, 2))
+        # some right at the spacing of a turbine
+        angle = np.random.uniform(0, 2 * np.pi, 200)
+        candidates[:200] = coords + min_spacing * np.column_stack([np.cos(angle), np.sin(angle)]) * 1.000001
+        distance = cdist(candidates, coords)
+        for c, d in zip(candidates, distance):
+            self.assertEqual(index.valid(*c), d.min() >= min_spacing)
+        self.assertEqual(index.rejections, int(np.sum(distance.min(axis=1) < min_spacing)))
+
+        # a turbine does not crowd its own position
+        for i in np.random.choice(len(coords), 50, replace=False):
+            d = np.delete(cdist(coords[i:i + 1], coords)[0], i)
+            self.assertEqual(index.valid(*coords[i], skip=i), d.min() >= min_spacing)
+
+    def test_spread(self):
+        np.random.seed(1)
+        min_spacing = 200.0
+        coords = np.random.uniform(0, 1000, (20, 2))
+        index = feasibility.SpacingIndex(coords, min_spacing)
+        def sample(accept):
+            while True:
+                x, y = np.random.uniform(0, 3000, 2)
+                if accept(x, y):
+                    return x, y
+        spread = index.spread(coords, sample)
+        self.assertGreaterEqual(pdist(spread).min(), min_spacing)
+        # the turbines already spaced are kept
+        self.assertTrue(np.array_equal(spread[0], coords[0]))
+
+
+def farm_model(no_of_turbines=8):
+    # coarse rose of the synthetic weather, a solve takes milliseconds
+    wr = dr.WeatherRetriever(context=ctx.get())
+    wr.weather = benchmark.synthetic_weather()
+    md = mdl.ModelData(wr)
+    md.wr = md.wind_rose_at(30.0, 2.0)
+    return mdl.FarmModel(md, no_of_turbines=no_of_turbines)
+
+
+class IncrementalAEPTest(unittest.TestCase):
+    def setUp(self):
+        self.fm = farm_model()
+        self.rng = np.random.default_rng(0)
+        # spread out, so a move usually touches few wakes
+        self.coords = self.rng.uniform(0, 8000, (8, 2))
+
+    def moves(self, n=10):
+        for _ in range(n):
+            moved = self.coords.copy()
+            moved[self.rng.integers(len(moved))] += self.rng.uniform(-400, 400, 2)
+            yield moved
+
+    def incremental(self, **kwargs):
+        fm = self.fm
+        return mdl.IncrementalAEP(fm.floris, fm.wr, fm.rotor_diameter, **kwargs)
+
+    def test_validation_returns_the_full_solve(self):
+        incremental = self.incremental(validate_every=1, depth=None)
+        incremental.run(self.coords)
+        for moved in self.moves():
+            self.assertEqual(incremental.run(moved), self.fm.solve(moved))
+            self.assertTrue(incremental.exact)
+        self.assertGreater(incremental.updates, 0)
+        self.assertEqual(incremental.failures, 0)
+        self.assertLess(incremental.max_error, incremental.tolerance)
+
+    def test_updates_within_tolerance(self):
+        incremental = self.incremental(validate_every=0, depth=None)
+        incremental.run(self.coords)
+        for moved in self.moves():
+            aep = incremental.run(moved)
+            self.assertLess(abs(aep - self.fm.solve(moved)) / aep, 1e-3)
+        self.assertGreater(incremental.updates, 0)
+
+    def test_exact_runs_bypass_incremental_entries(self):
+        fm = self.fm
+        fm.incremental = self.incremental(validate_every=0)
+        fm.new_run(self.coords)
+        # first move answered by an update, not by the fallback to a full solve
+        for moved in self.moves(50):
+            fm.new_run(moved)
+            if not fm.incremental.exact:
+                break
+        approximate = fm.aep
+        self.assertFalse(fm.incremental.exact)
+        self.assertIn(b"~" + fm.key, fm.cache.entries)
+        self.assertIsNone(fm.cache.entries.get(fm.key))
+
+        runs = fm.floris_runs
+        fm.new_run(moved, exact=True)
+        self.assertEqual(fm.floris_runs, runs + 1)
+        self.assertEqual(fm.aep, fm.solve(moved))
+        self.assertEqual(fm.cache.entries[fm.key][0], fm.aep)
+        # the full solve now answers the approximate lookups too
+        fm.new_run(moved)
+        self.assertEqual(fm.aep, fm.cache.entries[fm.key][0])
+        self.assertLess(abs(approximate - fm.aep) / fm.aep, 1e-3)
+
+
+
+class Interrupt(Exception):
+    pass
+
+
+class InterruptAt:
+    # observer killing the run once it reaches an iteration
+    def __init__(self, iteration):
+        self.iteration = iteration
+
+    def on_iteration(self, alc):
+        if alc.iter == self.iteration:
+            raise Interrupt
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = f"{self.tmp.name}/run.ckpt"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def build(self):
+        np.random.seed(0)
+        wr, turbines = benchmark.site_retriever("small")
+        # the default wind rose, the one checkpoint.load rebuilds
+        alc = allocator.Allocator(wr, mdl.FarmModel(mdl.ModelData(wr), no_of_turbines=turbines))
+        alc.detach_outputs()
+        alc.update_iterations(6)
+        return alc
+
+    def test_resume_reproduces_the_uninterrupted_run(self):
+        reference = self.build()
+        reference.run()
+
+        interrupted = self.build()
+        interrupted.checkpoint_file = self.path
+        interrupted.checkpoint_every = 2
+        interrupted.add_observer(InterruptAt(5))
+        with self.assertRaises(Interrupt):
+            interrupted.run()
+
+        resumed = checkpoint.resume(self.path)
+        self.assertEqual(resumed.iter, reference.iter)
+        self.assertEqual(resumed.sa.min_LCOE, reference.sa.min_LCOE)
+        self.assertEqual(resumed.sa.max_AEP, reference.sa.max_AEP)
+        np.testing.assert_array_equal(resumed.sa.min_LCOE_alloc, reference.sa.min_LCOE_alloc)
+        np.testing.assert_array_equal(resumed.sa.max_AEP_alloc, reference.sa.max_AEP_alloc)
+        np.testing.assert_array_equal(resumed.current_allocations, reference.current_allocations)
+        self.assertEqual(list(resumed.sa.lcoe_hist), list(reference.sa.lcoe_hist))
+
+    def test_extend_keeps_cooling(self):
+        alc = self.build()
+        alc.run()
+        T, cooling = alc.sa.T, alc.sa.cooling
+        alc.extend(2)
+        self.assertEqual(alc.iter, 8)
+        self.assertEqual(alc.sa.cooling, cooling)
+        self.assertLess(alc.sa.T, T)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,5 @@
 import geopandas as gpd
+from shapely.geometry import Polygon
 
 def best_epsg(centroid):
     # input should be epsg 4326
@@ -10,9 +11,14 @@ def best_epsg(centroid):
         epsg_code = 32700 + zone_number  # Southern hemisphere
     return epsg_code
 
-def country_finder(centroid):
-    world = gpd.read_file("data/shapes/ne_110m_admin_0_countries.shp")
-    world = world.to_crs("EPSG:4326")
-    country = world[world.contains(centroid)]
+def available_land(coordinates, constraints, epsg):
+    # coordinates and constraints are lists of lon/lat rings, output is in the given epsg
+    constraints_polygons = [Polygon([tuple(pt) for pt in poly]) for poly in constraints]
+    gdf_constraints = gpd.GeoDataFrame({'geometry': constraints_polygons}, crs="EPSG:4326")
 
-    return country["NAME"].values[0]
\ No newline at end of file
+    coord_polygons = [Polygon([tuple(pt) for pt in poly]) for poly in coordinates]
+    gdf_coord = gpd.GeoDataFrame({'geometry': coord_polygons}, crs="EPSG:4326")
+    area = gdf_coord.to_crs(epsg=epsg).geometry.area.sum()
+
+    available_gdf = gpd.overlay(gdf_coord, gdf_constraints, how="difference").to_crs(epsg=epsg)
+    return available_gdf, area
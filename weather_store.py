@@ -0,0 +1,87 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+class WeatherStore:
+    """
+    On-disk store of hourly weather series.
+
+    Series are keyed by the location rounded to `precision` decimals, the
+    calendar year and the list of variables. Each entry is a directory with
+    the timestamps and the values as .npy files, read back memory-mapped, so
+    loading a stored year costs no parsing. In offline mode a missing entry
+    raises instead of being fetched, which also lets the pipeline run on
+    fixture stores without any network access.
+    """
+    def __init__(self, root=".weather_store", precision=2, offline=False):
+        self.root = root
+        self.precision = precision
+        self.offline = offline
+
+    def cell(self, lat, lon):
+        return f"{round(lat, self.precision):.{self.precision}f}_{round(lon, self.precision):.{self.precision}f}"
+
+    def path(self, lat, lon, year, variables):
+        return os.path.join(self.root, self.cell(lat, lon), str(year), "+".join(sorted(variables)))
+
+    def has(self, lat, lon, year, variables):
+        return os.path.exists(os.path.join(self.path(lat, lon, year, variables), "meta.json"))
+
+    def save(self, lat, lon, year, weather, variables):
+        """
+        Store one year of hourly weather.
+
+        Parameters:
+        weather (pd.DataFrame): Hourly data with a utc `date` column and one column per variable.
+        """
+        path = self.path(lat, lon, year, variables)
+        os.makedirs(path, exist_ok=True)
+        dates = pd.to_datetime(weather["date"], utc=True)
+        seconds = (dates - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)
+        np.save(os.path.join(path, "time.npy"), seconds.to_numpy(dtype=np.int64))
+        np.save(os.path.join(path, "values.npy"), weather[list(variables)].to_numpy(dtype=np.float32))
+        # meta is written last, an entry without it is treated as missing
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"lat": lat, "lon": lon, "year": year, "variables": list(variables)}, f)
+
+    def load(self, lat, lon, year, variables):
+        path = self.path(lat, lon, year, variables)
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        seconds = np.load(os.path.join(path, "time.npy"), mmap_mode="r")
+        values = np.load(os.path.join(path, "values.npy"), mmap_mode="r")
+
+        weather = {"date": pd.to_datetime(np.asarray(seconds), unit="s", utc=True)}
+        for i, variable in enumerate(meta["variables"]):
+            if variable in variables:
+                weather[variable] = values[:, i]
+        return pd.DataFrame(data=weather)
+
+    def get(self, lat, lon, years, variables, fetch=None):
+        """
+        Hourly weather over one or several years, concatenated in order.
+
+        Parameters:
+        years (int or iterable): Year or years to return.
+        fetch (callable): Called as fetch(year) for years not in the store,
+            must return a DataFrame like `save` expects.
+
+        Returns:
+        pd.DataFrame: The concatenated hourly weather.
+        """
+        if isinstance(years, (int, np.integer)):
+            years = [years]
+
+        frames = []
+        for year in years:
+            if not self.has(lat, lon, year, variables):
+                if self.offline or fetch is None:
+                    raise FileNotFoundError(
+                        f"No stored weather for ({lat:.{self.precision}f}, {lon:.{self.precision}f}) "
+                        f"in {year} under {self.root}" + (" (offline mode)" if self.offline else "")
+                    )
+                self.save(lat, lon, year, fetch(year), variables)
+            frames.append(self.load(lat, lon, year, variables))
+        return pd.concat(frames, ignore_index=True)